@@ -0,0 +1,221 @@
+"""
+Intercepting system alerts and popups that interrupt exploration
+"""
+import re
+import logging
+from selenium.common.exceptions import NoAlertPresentException
+from ios_app_explorer import events, metrics
+from ios_app_explorer.profiling import sleep, phase
+from ios_app_explorer.snapshot import take_snapshot, find_by_text, element_center
+from ios_app_explorer.config import (
+    ALERT_INTERCEPTION, ALERT_POLICY, ALERT_CHECK_API, ALERT_SETTLE_TIME, ALERT_MAX_IN_A_ROW, POPUP_PATTERNS
+)
+
+POLICIES = ('accept', 'dismiss', 'ignore')
+
+# Button labels that accept or dismiss an in-app alert, matched in this order.
+# Confirmations such as 'Yes', 'Remove' or 'Log Out' are never accepted
+ACCEPT_LABELS = re.compile(r"(?i)allow( while using app| once| full access)?|ok|continue|accept")
+DISMISS_LABELS = re.compile(r"(?i)don.t allow|ask app not to track|not now|cancel|later|no|close")
+
+def _descendants(elements, root):
+    """
+    Elements under root; in document order they directly follow it
+    """
+    found = []
+    for element in elements[root.index + 1:]:
+        if element.depth <= root.depth:
+            break
+        found.append(element)
+    return found
+
+def _labelled(buttons, labels):
+    return next((b for b in buttons if labels.fullmatch(b.label or b.name or '')), None)
+
+def choose_alert_button(buttons, policy):
+    """
+    Pick the button of an in-app alert that carries out a policy
+
+    In-app alerts often confirm something the app is about to do, such as
+    removing a wallet or logging out, so accepting only taps a button on the
+    ACCEPT_LABELS allow-list; any other alert is dismissed instead.
+
+    Args:
+        buttons: Button elements of the alert, in document order
+        policy: 'accept' or 'dismiss'
+
+    Returns:
+        Element to tap, or None to leave the alert on screen
+    """
+    button = _labelled(buttons, ACCEPT_LABELS) if policy == 'accept' else None
+    if button is None:
+        button = _labelled(buttons, DISMISS_LABELS)
+    if button is None and len(buttons) == 2:
+        # iOS puts the cancelling action of two side-by-side buttons first;
+        # stacked alerts with more buttons put it last, or leave it out
+        button = buttons[0]
+    return button
+
+def _api_alert_text(driver):
+    alert_text = getattr(driver, 'alert_text', None)
+    if alert_text is not None:
+        return alert_text()
+    try:
+        return driver.switch_to.alert.text or ''
+    except NoAlertPresentException:
+        return None
+
+def _api_handle_alert(driver, action):
+    handle_alert = getattr(driver, 'handle_alert', None)
+    if handle_alert is not None:
+        handle_alert(action)
+        return
+    alert = driver.switch_to.alert
+    if action == 'accept':
+        alert.accept()
+    else:
+        alert.dismiss()
+
+class AlertInterceptor:
+    """
+    Clears alerts and popups off the screen after an action
+
+    Checks are cheap: in-app alerts (XCUIElementTypeAlert) and popup patterns
+    are looked up in the snapshot the explorer takes after every action
+    anyway, and only when those find nothing is the alert API asked about
+    system alerts, which do not show in the app's page source. Every alert
+    is recorded, logged and emitted as an event.
+    """
+
+    def __init__(self, driver, app_info, policy=None, check_api=ALERT_CHECK_API, enabled=ALERT_INTERCEPTION):
+        self.driver = driver
+        self.policy = policy or app_info.get('alertPolicy', ALERT_POLICY)
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown alert policy '{self.policy}', expected one of {', '.join(POLICIES)}")
+        self.patterns = list(app_info.get('popups', [])) + list(POPUP_PATTERNS)
+        self.check_api = check_api
+        self.enabled = enabled
+        self.handled = []
+        self._ignored = set()
+
+    def _record(self, kind, text, button):
+        if button is None:
+            # Alerts left on screen show up again; record each one once
+            if (kind, text) in self._ignored:
+                return
+            self._ignored.add((kind, text))
+        self.handled.append({'kind': kind, 'text': text, 'button': button, 'policy': self.policy})
+        metrics.count(metrics.ALERTS)
+        events.emit(events.ALERT, alert=kind, text=text, button=button, policy=self.policy)
+        logging.info(f"{kind.capitalize()} '{text}': {button or 'left on screen'}")
+
+    def _tap(self, element):
+        self.driver.tap([element_center(element)])
+
+    def _handle_in_app_alert(self, state):
+        alert = next((e for e in state.elements if e.type == 'XCUIElementTypeAlert'), None)
+        if alert is None:
+            return None
+        inside = _descendants(state.elements, alert)
+        texts = [e.label for e in inside if e.type == 'XCUIElementTypeStaticText' and e.label]
+        text = alert.label or ' '.join(texts)
+        if self.policy == 'ignore':
+            self._record('alert', text, None)
+            return False
+        button = choose_alert_button([e for e in inside if e.type == 'XCUIElementTypeButton'], self.policy)
+        if button is None:
+            self._record('alert', text, None)
+            return False
+        self._tap(button)
+        self._record('alert', text, button.label or button.name)
+        return True
+
+    def _handle_popup(self, state):
+        for pattern in self.patterns:
+            shown = find_by_text(state, pattern['when'])
+            if not shown:
+                continue
+            targets = find_by_text(state, pattern['tap'])
+            if not targets:
+                continue
+            text = shown[0].label or shown[0].name
+            if self.policy == 'ignore':
+                self._record('popup', text, None)
+                return False
+            self._tap(targets[0])
+            self._record('popup', text, targets[0].label or targets[0].name)
+            return True
+        return None
+
+    def _handle_system_alert(self):
+        if not self.check_api:
+            return None
+        try:
+            text = _api_alert_text(self.driver)
+            if text is None:
+                return None
+            if self.policy == 'ignore':
+                self._record('system_alert', text, None)
+                return False
+            _api_handle_alert(self.driver, self.policy)
+        except Exception as e:
+            # The driver cannot do alerts; stop asking for the rest of the session
+            logging.debug(f"Alert API unavailable, only checking snapshots: {e}")
+            self.check_api = False
+            return None
+        # System alerts are answered through the API rather than a button
+        self._record('system_alert', text, self.policy)
+        return True
+
+    def _handle_one(self, state):
+        """
+        Handle the first alert or popup found
+
+        Returns:
+            True if one was tapped away, False if one was recorded but left on
+            screen, None if the screen is clear
+        """
+        handled = self._handle_in_app_alert(state)
+        if handled is None:
+            handled = self._handle_popup(state)
+        if handled is None:
+            handled = self._handle_system_alert()
+        return handled
+
+    def intercept(self, state=None):
+        """
+        Clear alerts and popups before the explorer looks at the screen
+
+        Args:
+            state: ScreenState just taken of the screen, or None to take one
+
+        Returns:
+            ScreenState of the screen once alerts are handled; the given state
+            itself when there was nothing to handle
+        """
+        if not self.enabled:
+            return state if state is not None else take_snapshot(self.driver)
+        with phase('alerts'):
+            for _ in range(ALERT_MAX_IN_A_ROW):
+                if state is None:
+                    state = take_snapshot(self.driver)
+                if not self._handle_one(state):
+                    break
+                sleep(ALERT_SETTLE_TIME)
+                state = None
+            if state is None:
+                state = take_snapshot(self.driver)
+        return state
+
+    def report(self):
+        """
+        Summarize the alerts handled
+
+        Returns:
+            Dictionary with the number of alerts per kind and the distinct texts seen
+        """
+        kinds = {}
+        for alert in self.handled:
+            kinds[alert['kind']] = kinds.get(alert['kind'], 0) + 1
+        return {'policy': self.policy, 'kinds': kinds,
+                'texts': sorted({alert['text'] for alert in self.handled})}
@@ -0,0 +1,339 @@
+"""
+Asyncio driver core that overlaps device commands with local work
+"""
+import json
+import base64
+import http.client
+import socket
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from ios_app_explorer.config import WDA_HOST, WDA_PORT, WDA_POOL_SIZE, WDA_TIMEOUT
+from ios_app_explorer.output import write_screenshot
+from ios_app_explorer.wda_client import WdaClient, WdaError, FastPathDriver, decode_response, session_from_status
+
+class AsyncWdaClient:
+    """
+    Asyncio HTTP client for WebDriverAgent with a pool of keep-alive connections
+
+    At most pool_size requests are in flight at once and idle connections are
+    reused. Like WdaClient, a request is only sent again when an idle
+    connection turns out to be closed by the server.
+    """
+
+    def __init__(self, host=WDA_HOST, port=WDA_PORT, timeout=WDA_TIMEOUT, pool_size=WDA_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = max(pool_size, 1)
+        self.session_id = None
+        self._idle = []
+        self._slots = None
+
+    async def _connection(self):
+        """
+        Take an idle connection, or open a new one
+
+        Returns:
+            (reader, writer, True if the connection was idle)
+        """
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer, False
+
+    async def _read_response(self, reader):
+        """
+        Read one HTTP/1.1 response
+
+        Returns:
+            Tuple of status code, body and whether the connection can be reused
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Connection closed by WebDriverAgent")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            return status, body, False
+        return status, body, headers.get('connection', '').lower() != 'close'
+
+    async def request(self, method, path, payload=None, full=False):
+        """
+        Send a request to WebDriverAgent and return the 'value' of the response
+
+        The request is sent again, once, only if an idle connection failed
+        while sending or closed before any response byte. A timeout is never
+        retried, since WebDriverAgent may already be running the command.
+
+        Args:
+            method: HTTP method
+            path: Request path
+            payload: Optional JSON body
+            full: Return the whole decoded body instead of its 'value'
+
+        Returns:
+            The decoded 'value' field of the response, or the whole body with full
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode('latin-1')
+
+        async with self._slots:
+            for attempt in range(2):
+                writer = None
+                reused = sent = False
+                try:
+                    reader, writer, reused = await self._connection()
+                    writer.write(head + body)
+                    await writer.drain()
+                    sent = True
+                    status, data, reusable = await asyncio.wait_for(self._read_response(reader), self.timeout)
+                except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    if writer is not None:
+                        writer.close()
+                    closed = isinstance(e, http.client.RemoteDisconnected) or (
+                        not sent and isinstance(e, (BrokenPipeError, ConnectionResetError)))
+                    if reused and closed and attempt == 0:
+                        continue
+                    raise WdaError(f"{method} {path} failed: {e}") from e
+                if reusable:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                break
+        return decode_response(method, path, status, data, full)
+
+    async def close(self):
+        """
+        Close every idle connection
+        """
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    async def attach(self):
+        """
+        Attach to the session WebDriverAgent is running for Appium
+
+        Returns:
+            The WebDriverAgent session id
+        """
+        self.session_id = session_from_status(await self.request('GET', '/status', full=True))
+        return self.session_id
+
+    async def source(self):
+        return await self.request('GET', f'/session/{self.session_id}/source')
+
+    async def screenshot_png(self):
+        return base64.b64decode(await self.request('GET', '/screenshot'))
+
+    async def tap(self, x, y):
+        await self.request('POST', f'/session/{self.session_id}/wda/tap', {'x': x, 'y': y})
+
+    async def swipe(self, start_x, start_y, end_x, end_y, duration_ms=0):
+        await self.request('POST', f'/session/{self.session_id}/wda/dragfromtoforduration', {
+            'fromX': start_x, 'fromY': start_y,
+            'toX': end_x, 'toY': end_y,
+            'duration': max(duration_ms, 0) / 1000
+        })
+
+class _LoopClient(WdaClient):
+    """
+    Synchronous WdaClient whose requests run on an AsyncWdaClient's event loop
+    """
+
+    def __init__(self, client, loop):
+        self.client = client
+        self.loop = loop
+        self.session_id = client.session_id
+        self._response_settings = None
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def request(self, method, path, payload=None, full=False):
+        return self.run(self.client.request(method, path, payload, full))
+
+    def close(self):
+        self.run(self.client.close())
+
+class AsyncDriver(FastPathDriver):
+    """
+    Fast path driver backed by an event loop in a background thread
+
+    It is a drop-in replacement for the Appium driver, so the synchronous
+    explorer runs unchanged. On top of the fast path, screenshots are captured
+    in the background: save_screenshot returns once the capture is scheduled,
+    and encoding, manifest and disk writes overlap with the explorer's next
+    steps. Fetches are ordered before any command that may change the screen:
+    taps, swipes and everything delegated to Appium wait for pending
+    screenshot fetches first.
+    """
+
+    def __init__(self, driver, client, loop, thread):
+        super().__init__(driver, _LoopClient(client, loop))
+        self.client = client
+        self.loop = loop
+        self._thread = thread
+        self._fetches = []
+        self._writes = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        self.wait_for_fetches()
+        return getattr(self._driver, name)
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _capture(self, screenshot_path, metadata, elements, fetched):
+        try:
+            png = await self.client.screenshot_png()
+        except Exception as e:
+            logging.debug(f"Background screenshot fetch failed: {e}")
+            fetched.set_result(None)
+            return
+        fetched.set_result(png)
+        await asyncio.to_thread(write_screenshot, png, screenshot_path, metadata, elements)
+
+    def capture_screenshot(self, screenshot_path, metadata=None, elements=None):
+        """
+        Capture a screenshot in the background
+
+        Args:
+            screenshot_path: Where the PNG goes
+            metadata: Optional dictionary describing the screenshot
+            elements: ElementRecord tuple of the screen, for redaction
+
+        Returns:
+            Boolean indicating if the capture was scheduled; False when the
+            fast path is off and the caller should capture synchronously
+        """
+        if not self.fast_path_enabled:
+            return False
+        fetched = Future()
+        written = self._submit(self._capture(screenshot_path, metadata, elements, fetched))
+        with self._lock:
+            self._fetches.append((fetched, written, screenshot_path, metadata, elements))
+            self._writes.append((written, screenshot_path))
+        return True
+
+    def wait_for_fetches(self):
+        """
+        Wait until every scheduled screenshot has been fetched from the device
+
+        A screenshot whose fetch failed is taken again through Appium, which is
+        still possible because the screen has not changed yet.
+        """
+        with self._lock:
+            fetches, self._fetches = self._fetches, []
+        for fetched, written, screenshot_path, metadata, elements in fetches:
+            png = fetched.result()
+            if png is None:
+                self.failures += 1
+                logging.debug(f"Background screenshot fetch failed, using Appium for {screenshot_path}")
+                with self._lock:
+                    self._writes.remove((written, screenshot_path))
+                write_screenshot(self._driver.get_screenshot_as_png(), screenshot_path, metadata, elements)
+
+    def flush(self):
+        """
+        Wait until every scheduled screenshot has been written
+        """
+        self.wait_for_fetches()
+        with self._lock:
+            writes, self._writes = self._writes, []
+        for written, screenshot_path in writes:
+            try:
+                written.result()
+            except Exception as e:
+                logging.error(f"Failed to write {screenshot_path}: {e}")
+
+    def tap(self, positions, duration=None):
+        self.wait_for_fetches()
+        return super().tap(positions, duration)
+
+    def swipe(self, start_x, start_y, end_x, end_y, duration=0):
+        self.wait_for_fetches()
+        return super().swipe(start_x, start_y, end_x, end_y, duration)
+
+    def handle_alert(self, action):
+        self.wait_for_fetches()
+        return super().handle_alert(action)
+
+    def find_elements(self, by='id', value=None):
+        self.wait_for_fetches()
+        return super().find_elements(by, value)
+
+    def find_element(self, by='id', value=None):
+        self.wait_for_fetches()
+        return super().find_element(by, value)
+
+    def quit(self):
+        self.flush()
+        try:
+            self.wda.close()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._driver.quit()
+
+def enable_async_driver(driver, host=WDA_HOST, port=WDA_PORT):
+    """
+    Wrap an Appium driver in an AsyncDriver
+
+    Args:
+        driver: Appium driver with an active session
+        host: WebDriverAgent host
+        port: WebDriverAgent port
+
+    Returns:
+        AsyncDriver, or the original driver if WebDriverAgent is unreachable
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name=f"wda-loop-{port}", daemon=True)
+    thread.start()
+    client = AsyncWdaClient(host, port)
+    try:
+        session_id = asyncio.run_coroutine_threadsafe(client.attach(), loop).result()
+    except WdaError as e:
+        logging.warning(f"Async driver unavailable, using Appium only: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        return driver
+    logging.info(f"Async driver enabled on {host}:{port} (session {session_id})")
+    return AsyncDriver(driver, client, loop, thread)
@@ -0,0 +1,275 @@
+"""
+Accessibility audit of captured screens, run over their element trees
+"""
+import os
+import json
+import html
+import sqlite3
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from ios_app_explorer.config import TEXT_INDEX_PATH, AUDIT_MIN_TARGET_SIZE
+from ios_app_explorer.logger import setup_logging
+from ios_app_explorer.scroll_utils import SCROLLABLE_TYPES
+from ios_app_explorer.text_index import decode_tree
+
+INTERACTIVE_TYPES = {
+    'XCUIElementTypeButton',
+    'XCUIElementTypeLink',
+    'XCUIElementTypeCell',
+    'XCUIElementTypeSwitch',
+    'XCUIElementTypeSlider',
+    'XCUIElementTypeStepper',
+    'XCUIElementTypeTextField',
+    'XCUIElementTypeSecureTextField',
+    'XCUIElementTypeSearchField',
+    'XCUIElementTypeTextView',
+    'XCUIElementTypePickerWheel'
+}
+
+TEXT_INPUT_TYPES = {
+    'XCUIElementTypeTextField',
+    'XCUIElementTypeSecureTextField',
+    'XCUIElementTypeSearchField',
+    'XCUIElementTypeTextView'
+}
+
+RULES = {
+    'missing_label': "Control has no accessibility label",
+    'duplicate_identifier': "Identifier is used by more than one control",
+    'small_target': "Tap target is smaller than the minimum size",
+    'unreachable': "Enabled control that is hidden, empty or off screen"
+}
+
+REPORT_NAME = 'accessibility'
+
+def _finding(rule, element, message):
+    return {
+        'rule': rule,
+        'type': element.type,
+        'name': element.name,
+        'label': element.label,
+        'rect': [element.x, element.y, element.width, element.height],
+        'message': message
+    }
+
+def _scrollable_ancestors(elements):
+    """
+    Flag the elements that have a scrollable ancestor
+    """
+    inside = [False] * len(elements)
+    for element in elements:
+        parent = element.parent
+        if parent >= 0:
+            inside[element.index] = inside[parent] or elements[parent].type in SCROLLABLE_TYPES
+    return inside
+
+def audit_elements(elements, min_target=AUDIT_MIN_TARGET_SIZE):
+    """
+    Check the element tree of one screen
+
+    Works on the elements of a live ScreenState as well as on trees loaded
+    from the text index.
+
+    Args:
+        elements: Element records in document order
+        min_target: Minimum width and height of a tap target, in points
+
+    Returns:
+        List of finding dictionaries with rule, element type, name, label,
+        rect and message
+    """
+    if not elements:
+        return []
+    findings = []
+    window = elements[0]
+    scrollable = _scrollable_ancestors(elements)
+    controls = [e for e in elements if e.type in INTERACTIVE_TYPES]
+
+    for element in controls:
+        empty = element.width <= 0 or element.height <= 0
+        if element.visible and not element.label.strip() and not (element.type in TEXT_INPUT_TYPES and element.value):
+            findings.append(_finding('missing_label', element, RULES['missing_label']))
+        if element.visible and not empty and (element.width < min_target or element.height < min_target):
+            findings.append(_finding(
+                'small_target', element,
+                f"Tap target is {element.width}x{element.height} pt, below {min_target}x{min_target}"
+            ))
+        if element.enabled:
+            off_screen = (element.x >= window.x + window.width or element.y >= window.y + window.height or
+                          element.x + element.width <= window.x or element.y + element.height <= window.y)
+            if empty:
+                findings.append(_finding('unreachable', element, "Enabled control has an empty frame"))
+            elif not scrollable[element.index] and (not element.visible or off_screen):
+                findings.append(_finding('unreachable', element,
+                                         "Enabled control is hidden or off screen outside any scroll view"))
+
+    # Cells repeat identifiers by design, so only other controls are compared
+    identifiers = Counter(e.name for e in controls
+                          if e.visible and e.name and e.name != e.label and e.type != 'XCUIElementTypeCell')
+    for element in controls:
+        count = identifiers.get(element.name, 0)
+        if count > 1 and element.visible and element.name != element.label and element.type != 'XCUIElementTypeCell':
+            findings.append(_finding('duplicate_identifier', element,
+                                     f"Identifier '{element.name}' is used by {count} controls"))
+    return findings
+
+def _audit_trees(rows, min_target):
+    """
+    Audit a chunk of stored trees in a worker process
+    """
+    return [(fingerprint, audit_elements(decode_tree(blob), min_target)) for fingerprint, blob in rows]
+
+def _chunks(cursor, size):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+def audit_index(db_path=TEXT_INDEX_PATH, apps=None, workers=None, min_target=AUDIT_MIN_TARGET_SIZE, chunk=64):
+    """
+    Audit every screen stored in the text index
+
+    Each distinct tree is audited once, in a process pool with at most two
+    chunks per worker in flight; the device is not needed.
+
+    Args:
+        db_path: Text index database
+        apps: Optional list of app names to audit
+        workers: Worker processes, defaults to the CPU count
+        min_target: Minimum tap target size in points
+        chunk: Trees sent to a worker at a time
+
+    Returns:
+        Dictionary of app name -> report dictionary (see build_report)
+    """
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        where = ''
+        params = []
+        if apps:
+            where = f" WHERE app IN ({', '.join('?' * len(apps))})"
+            params = list(apps)
+        screens = connection.execute(
+            f'SELECT app, screenshot, fingerprint, level FROM screens{where} ORDER BY id', params
+        ).fetchall()
+
+        findings = {}
+        cursor = connection.execute(
+            f'SELECT fingerprint, elements FROM trees WHERE fingerprint IN (SELECT fingerprint FROM screens{where})',
+            params
+        )
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            for rows in _chunks(cursor, chunk):
+                if len(in_flight) >= 2 * workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        findings.update(future.result())
+                in_flight.add(pool.submit(_audit_trees, rows, min_target))
+            for future in in_flight:
+                findings.update(future.result())
+    finally:
+        connection.close()
+    logging.info(f"Audited {len(findings)} distinct trees of {len(screens)} screens")
+
+    by_app = {}
+    for app, screenshot, fingerprint, level in screens:
+        by_app.setdefault(app, []).append({
+            'screenshot': screenshot, 'fingerprint': fingerprint, 'level': level,
+            'findings': findings.get(fingerprint, [])
+        })
+    return {app: build_report(app, entries) for app, entries in by_app.items()}
+
+def build_report(app, screens):
+    """
+    Summarize the findings of an app
+
+    Args:
+        app: App name
+        screens: List of dictionaries with screenshot, fingerprint, level and findings
+
+    Returns:
+        Report dictionary with per-rule totals and the screens, most findings first
+    """
+    totals = Counter(f['rule'] for screen in screens for f in screen['findings'])
+    return {
+        'app': app,
+        'screens': len(screens),
+        'screens_with_findings': sum(1 for screen in screens if screen['findings']),
+        'totals': {rule: totals.get(rule, 0) for rule in RULES},
+        'results': sorted(screens, key=lambda screen: -len(screen['findings']))
+    }
+
+def write_report(report, out_dir):
+    """
+    Write an app's report as JSON and HTML
+
+    Args:
+        report: Report dictionary from build_report
+        out_dir: Directory for accessibility.json and accessibility.html
+
+    Returns:
+        Path of the HTML report
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, f"{REPORT_NAME}.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    html_path = os.path.join(out_dir, f"{REPORT_NAME}.html")
+    app = html.escape(report['app'])
+    with open(html_path, 'w') as f:
+        f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{app} accessibility</title>'
+                '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;margin:1em 0}'
+                'td,th{border:1px solid #ccc;padding:4px 8px;text-align:left;vertical-align:top}'
+                'section{display:flex;gap:1.5em;margin:2em 0}img{width:200px;border:1px solid #ccc}'
+                '</style></head><body>')
+        f.write(f'<h1>{app} accessibility</h1><p>{report["screens_with_findings"]} of {report["screens"]} '
+                'screens have findings</p><table><tr><th>rule</th><th>findings</th></tr>')
+        for rule, count in report['totals'].items():
+            f.write(f'<tr><td title="{html.escape(RULES[rule])}">{rule}</td><td>{count}</td></tr>')
+        f.write('</table>')
+        for screen in report['results']:
+            if not screen['findings']:
+                continue
+            image = html.escape(os.path.relpath(screen['screenshot'], out_dir))
+            f.write(f'<section><a href="{image}"><img loading="lazy" src="{image}" alt=""></a><div>'
+                    f'<h3>{html.escape(os.path.basename(screen["screenshot"]))} (level {screen["level"]})</h3>'
+                    '<table><tr><th>rule</th><th>element</th><th>rect</th><th>message</th></tr>')
+            for finding in screen['findings']:
+                element = finding['type'].replace('XCUIElementType', '')
+                names = ' '.join(html.escape(repr(v)) for v in (finding['name'], finding['label']) if v)
+                f.write(f'<tr><td>{finding["rule"]}</td><td>{element} {names}</td>'
+                        f'<td>{finding["rect"]}</td><td>{html.escape(finding["message"])}</td></tr>')
+            f.write('</table></div></section>')
+        f.write('</body></html>')
+    return html_path
+
+def main():
+    """
+    Command line entry point for auditing the screens in the text index
+    """
+    parser = argparse.ArgumentParser(description="Audit the accessibility of captured screens")
+    parser.add_argument('--db', default=TEXT_INDEX_PATH, help="Text index database")
+    parser.add_argument('--app', action='append', help="Only audit this app (repeatable)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Worker processes")
+    parser.add_argument('--min-target', type=int, default=AUDIT_MIN_TARGET_SIZE,
+                        help="Minimum tap target size in points")
+    parser.add_argument('--out', help="Report directory, defaults to each app's screenshot folder")
+    args = parser.parse_args()
+
+    setup_logging('audit')
+    if not args.db or not os.path.exists(args.db):
+        logging.error(f"No text index at {args.db}")
+        return
+    reports = audit_index(args.db, apps=args.app, workers=args.workers, min_target=args.min_target)
+    for app, report in reports.items():
+        out_dir = os.path.join(args.out, app) if args.out else os.path.dirname(report['results'][0]['screenshot'])
+        path = write_report(report, out_dir)
+        logging.info(f"{app}: {report['totals']}, report written to {path}")
+
+if __name__ == '__main__':
+    main()
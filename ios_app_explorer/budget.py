@@ -0,0 +1,152 @@
+"""
+Sharing a run's wall-clock budget between the apps of APP_LIST
+"""
+import os
+import json
+import time
+import logging
+from ios_app_explorer.config import BUDGET_MODE, BUDGET_HISTORY_PATH
+
+MODES = ('equal', 'size', 'priority')
+
+def load_history(path=BUDGET_HISTORY_PATH):
+    """
+    Load the screens and seconds of each app's previous run
+
+    Returns:
+        Dictionary of app name -> {'screens': int, 'seconds': float}
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read budget history {path}: {e}")
+        return {}
+
+def expired(deadline):
+    """
+    Check whether a time.monotonic() deadline has passed; None never does
+    """
+    return deadline is not None and time.monotonic() >= deadline
+
+def save_history(history, path=BUDGET_HISTORY_PATH):
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+
+def app_weights(apps, mode=BUDGET_MODE, history=None):
+    """
+    Weigh the apps for sharing the budget
+
+    Args:
+        apps: App information dictionaries
+        mode: 'equal', 'size' (screens found by the app's previous run; apps
+            without a previous run get the mean of the others) or 'priority'
+            (the app entry's 'priority', 1 if missing)
+        history: Previous runs, from load_history
+
+    Returns:
+        Dictionary of app name -> weight
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown budget mode '{mode}', expected one of {', '.join(MODES)}")
+    if mode == 'priority':
+        return {app['name']: max(float(app.get('priority', 1)), 0) for app in apps}
+    if mode == 'size':
+        history = history or {}
+        sizes = {app['name']: history[app['name']]['screens'] for app in apps
+                 if history.get(app['name'], {}).get('screens')}
+        default = sum(sizes.values()) / len(sizes) if sizes else 1
+        return {app['name']: sizes.get(app['name'], default) for app in apps}
+    return {app['name']: 1 for app in apps}
+
+class BudgetAllocator:
+    """
+    Splits a total wall-clock budget between apps run one after the other
+
+    Each app is given its weight's share of the time still left when it
+    starts, so time an app does not use (it finished early or failed) goes
+    to the apps after it, and an app that runs over shortens theirs.
+    """
+
+    def __init__(self, apps, total_seconds, mode=BUDGET_MODE, history_path=BUDGET_HISTORY_PATH):
+        self.total = total_seconds
+        self.mode = mode
+        self.history_path = history_path
+        self.history = load_history(history_path)
+        self.weights = app_weights(apps, mode, self.history)
+        self.pending = [app['name'] for app in apps]
+        self.usage = {}
+        self._started = time.monotonic()
+
+    def remaining(self):
+        """
+        Seconds of the total budget still left
+        """
+        return self.total - (time.monotonic() - self._started)
+
+    def allocate(self, app_info):
+        """
+        Give the next app its share of the time left
+
+        Args:
+            app_info: App information dictionary
+
+        Returns:
+            Seconds the app may run; 0 when the budget is used up
+        """
+        name = app_info['name']
+        weight = self.weights.get(name, 0)
+        pending_weight = sum(self.weights.get(n, 0) for n in self.pending)
+        if name in self.pending:
+            self.pending.remove(name)
+        remaining = max(self.remaining(), 0)
+        budget = remaining * weight / pending_weight if pending_weight else 0
+        self.usage[name] = {'budget': round(budget, 1), 'used': 0.0, 'screens': 0}
+        logging.info(f"Budget for {name}: {budget / 60:.1f} of {remaining / 60:.1f} minutes left ({self.mode})")
+        return budget
+
+    def finish(self, app_info, seconds, screens):
+        """
+        Record what an app used and remember its size for the next run
+
+        Args:
+            app_info: App information dictionary
+            seconds: Wall-clock seconds the app took
+            screens: Distinct screens the app's exploration found
+        """
+        name = app_info['name']
+        usage = self.usage.setdefault(name, {'budget': 0.0, 'used': 0.0, 'screens': 0})
+        usage['used'] = round(seconds, 1)
+        usage['screens'] = screens
+        if screens:
+            previous = self.history.get(name, {}).get('screens', 0)
+            if usage['budget'] and seconds >= usage['budget']:
+                # A run cut short by its budget says little about the app's size
+                screens = max(screens, previous)
+            self.history[name] = {'screens': screens, 'seconds': round(seconds, 1)}
+            try:
+                save_history(self.history, self.history_path)
+            except OSError as e:
+                logging.warning(f"Could not write budget history {self.history_path}: {e}")
+
+    def report(self):
+        """
+        Summarize budget use
+
+        Returns:
+            Dictionary with the total, the seconds used and, per app, the
+            seconds given, used and the screens found
+        """
+        return {
+            'total': self.total,
+            'used': round(time.monotonic() - self._started, 1),
+            'mode': self.mode,
+            'apps': self.usage
+        }
@@ -4,8 +4,21 @@ Configuration settings for the iOS App Explorer
 
 # Device configuration
 DEVICE_UDID = '00008120-001608CE3C72201E'
+# Devices that crawl one app together with the shared frontier; each one gets
+# its own WebDriverAgent port counting up from WDA_PORT
+DEVICE_UDIDS = [DEVICE_UDID]
 WDA_BUNDLE_ID = 'com.jonno.WebDriverAgentRunner'
 WDA_PORT = 8101
+APPIUM_SERVER_URL = 'http://localhost:4723'
+
+# Send the hottest commands straight to WebDriverAgent instead of through Appium
+WDA_FAST_PATH = False
+WDA_HOST = '127.0.0.1'
+WDA_POOL_SIZE = 4
+WDA_TIMEOUT = 30
+# Run the fast path on an asyncio event loop and capture screenshots in the
+# background, overlapping fetches and disk writes with navigation
+ASYNC_DRIVER = False
 
 # App list to explore
 APP_LIST = [
@@ -17,13 +30,35 @@ APP_LIST = [
     {
         'name': 'galxe',
         'bundleId': 'com.galxe.app',
-        'ipaPath': '/path/to/AppGalxe.ipa'
+        'ipaPath': '/path/to/AppGalxe.ipa',
+        # Maestro flows run on the same session before exploring
+        # 'flows': ['flows/galxe_navigation.yaml']
+        # URL-scheme deep links used to get back to screens quickly
+        # 'deepLinks': ['galxe://']
+        # Share of the run budget with BUDGET_MODE 'priority' (default 1)
+        # 'priority': 2
+        # Languages captured by python -m ios_app_explorer.locales (overrides CAPTURE_LOCALES)
+        # 'locales': ['de_DE', 'ja_JP']
     },
     # Add more apps as needed
 ]
 
+# Wall-clock budget of a whole run over APP_LIST, in minutes (None for no
+# limit; --budget overrides it). Each app gets a share of the time left when it
+# starts: 'equal', by 'size' (screens found by its previous run, kept in
+# BUDGET_HISTORY_PATH) or by the 'priority' of its entry
+RUN_BUDGET_MINUTES = None
+BUDGET_MODE = 'equal'
+BUDGET_HISTORY_PATH = './iphone_screenshots/budget_history.json'
+
 # Output directories
 SCREENSHOT_DIR = './iphone_screenshots'
+
+# Full-text index of the texts on every captured screen (None to disable)
+TEXT_INDEX_PATH = './iphone_screenshots/text_index.sqlite'
+TEXT_INDEX_BATCH = 20
+# Smallest tap target the accessibility audit accepts, in points
+AUDIT_MIN_TARGET_SIZE = 44
 LOG_DIR = './logs'
 
 # Exploration settings
@@ -31,4 +66,138 @@ MAX_DEPTH = 1
 MAX_BUTTONS_PER_LEVEL = 15
 MAX_SCROLLS = 3
 WAIT_AFTER_CLICK = 1.0
-WAIT_AFTER_LAUNCH = 2.0
\ No newline at end of file
+WAIT_AFTER_LAUNCH = 2.0
+
+# 'snapshot' derives candidates from the page source already fetched for the
+# screen fingerprint; 'query' finds them with one predicate query over all
+# candidate types (a fresh page source when the WDA fast path is off);
+# 'elements' runs one find_elements query per element type
+ELEMENT_DISCOVERY = 'snapshot'
+# Keep a zlib-compressed copy of each screen's XML after fingerprinting
+KEEP_COMPRESSED_SOURCE = False
+# Screens whose trees share this much structure (Jaccard similarity of their
+# type features, see templates.py) belong to one template; at most
+# TEMPLATE_MAX_INSTANCES screens per template are captured and explored
+# (None for no cap)
+TEMPLATE_SIMILARITY = 0.9
+TEMPLATE_MAX_INSTANCES = 3
+# Candidates clicked per group of structurally equivalent siblings, such as
+# the rows of a list (None to click them all)
+SIBLING_SAMPLE_SIZE = 2
+# Discovery saturation: once the last SATURATION_WINDOW clicks (0 to disable)
+# find fewer than SATURATION_MIN_RATE new screens per click, or fewer than
+# SATURATION_MIN_PER_MINUTE per minute (None to ignore), exploration leaves the
+# current subtree ('subtree') or stops exploring the app ('app')
+SATURATION_WINDOW = 30
+SATURATION_MIN_RATE = 0.05
+SATURATION_MIN_PER_MINUTE = None
+SATURATION_ACTION = 'subtree'
+
+# Visual diff settings
+DIFF_PIXEL_THRESHOLD = 16
+DIFF_CHANGED_RATIO = 0.001
+DIFF_SSIM_THRESHOLD = 0.98
+DIFF_SSIM_WINDOW = 7
+DIFF_FINGERPRINT_MAX_DISTANCE = 10
+# Memory all comparison workers may use together; the number of workers
+# comparing at once is capped so that each can hold the largest pair
+DIFF_MEMORY_MB = 2048
+# Pairs sent to a worker per task, to save on inter-process round trips
+DIFF_CHUNK_PAIRS = 8
+
+# Locales captured by replaying a finished crawl instead of exploring again
+# (see locales.py); a replayed screen must share this much structure with the
+# recorded one (Jaccard similarity of its type features)
+CAPTURE_LOCALES = []
+LOCALE_MATCH_SIMILARITY = 0.8
+
+# Alerts and popups handled after every action, before the screen is compared:
+# in-app alerts and POPUP_PATTERNS are found in the snapshot already taken,
+# system alerts through the alert API (ALERT_CHECK_API). ALERT_POLICY is
+# 'accept', 'dismiss' or 'ignore' (only record them); 'accept' only taps in-app
+# alert buttons such as 'Allow' or 'OK' and dismisses other in-app alerts. Apps
+# can override it with 'alertPolicy' and add patterns with 'popups' in their
+# APP_LIST entry
+ALERT_INTERCEPTION = True
+ALERT_POLICY = 'accept'
+ALERT_CHECK_API = True
+ALERT_SETTLE_TIME = 0.5
+# Alerts handled in a row after one action, in case they chain
+ALERT_MAX_IN_A_ROW = 3
+# Popups recognised by a text on screen ('when') and closed by tapping the
+# element with the 'tap' text; both are exact texts or regular expressions, as in flows
+POPUP_PATTERNS = [
+    # App Store rating prompt
+    {'when': r'(?i)enjoying .*\?', 'tap': '(?i)not now'}
+]
+
+# How to get back to a screen when back navigation fails, cheapest first
+RESTORE_STRATEGIES = ['tab', 'deep_link', 'restart']
+
+# Seconds to let a scroll settle before looking at the screen again
+SCROLL_SETTLE_TIME = 0.4
+
+# Try XCUITest's native scroll-to-visible before swiping when looking for an element
+SCROLL_NATIVE_SEARCH = True
+
+# Flow settings
+FLOW_LOOKUP_TIMEOUT = 5.0
+FLOW_POLL_INTERVAL = 0.5
+FLOW_ANIMATION_TIMEOUT = 5.0
+
+# Shared frontier settings
+FRONTIER_CLAIM_TIMEOUT = 600
+FRONTIER_POLL_INTERVAL = 2.0
+FRONTIER_MAX_ATTEMPTS = 2
+
+# Screenshot output: 'directory' writes one PNG per screenshot, 'pack' appends
+# them to screenshots.pack in the app's folder (export with python -m ios_app_explorer.pack),
+# 's3' writes PNGs like 'directory' and uploads them as they are captured
+OUTPUT_BACKEND = 'directory'
+PACK_FSYNC = True
+
+# S3 upload settings; set S3_ENDPOINT_URL for MinIO or another S3-compatible store
+S3_BUCKET = None
+S3_PREFIX = 'screenshots'
+S3_ENDPOINT_URL = None
+S3_REGION = None
+S3_UPLOAD_WORKERS = 8
+# Screenshot bytes held in memory for uploads; beyond that they wait on disk
+S3_MAX_IN_FLIGHT_MB = 64
+S3_MULTIPART_THRESHOLD_MB = 8
+S3_PART_SIZE_MB = 8
+S3_MAX_ATTEMPTS = 5
+
+# Redaction of sensitive data before screenshots are written or uploaded
+# (needs the redact extra): elements whose name, label or value matches one of
+# REDACT_PATTERNS are blurred ('blur', a mosaic of REDACT_BLOCK_SIZE pixel
+# tiles) or covered ('box'), with REDACT_PADDING points around them
+REDACTION = False
+REDACT_MODE = 'blur'
+REDACT_PATTERNS = [
+    # Solana and other base58 addresses, signatures
+    r'\b[1-9A-HJ-NP-Za-km-z]{32,88}\b',
+    # EVM addresses and transaction hashes
+    r'\b0x[0-9a-fA-F]{40,64}\b',
+    # Shortened addresses such as 7xKX...gAsU or 0x12…ab34
+    r'\b(0x[0-9a-fA-F]{2,8}|[1-9A-HJ-NP-Za-km-z]{3,8})(\.{2,3}|…)[1-9A-HJ-NP-Za-km-z]{3,8}\b',
+    # Fiat amounts and balances
+    r'[$€£¥]\s?\d[\d,]*(\.\d+)?',
+    # Token amounts such as 12.5 SOL or 1,000 USDC
+    r'\b\d[\d,]*(\.\d+)?\s?[A-Z]{2,6}\b'
+]
+REDACT_PADDING = 4
+REDACT_BLOCK_SIZE = 16
+# Worker threads redacting screenshots as they are captured
+REDACT_WORKERS = 4
+
+# Gallery settings
+GALLERY_THUMB_WIDTH = 240
+
+# Port of the live Prometheus metrics endpoint (None to disable)
+METRICS_PORT = None
+
+# Event stream settings: events buffered per consumer, and what happens when a
+# consumer falls behind ('drop_oldest', 'drop_newest' or 'spill' to a temporary file)
+EVENT_BUFFER_SIZE = 1000
+EVENT_OVERFLOW_POLICY = 'spill'
@@ -1,17 +1,24 @@
 """
 Appium driver setup and management
 """
+import time
 import logging
 from appium import webdriver
 from appium.options.ios import XCUITestOptions
-from ios_app_explorer.config import DEVICE_UDID, WDA_BUNDLE_ID, WDA_PORT
+from ios_app_explorer.config import (
+    DEVICE_UDID, WDA_BUNDLE_ID, WDA_PORT, APPIUM_SERVER_URL, WDA_FAST_PATH, ASYNC_DRIVER
+)
+from ios_app_explorer.async_driver import enable_async_driver
+from ios_app_explorer.wda_client import enable_fast_path, FastPathDriver
 
-def get_appium_options(app_info):
+def get_appium_options(app_info, udid=None, wda_port=None):
     """
     Configure Appium options for iOS testing
     
     Args:
         app_info: Dictionary containing app information
+        udid: Device UDID, defaults to DEVICE_UDID
+        wda_port: Local WebDriverAgent port, defaults to WDA_PORT
         
     Returns:
         Configured XCUITestOptions
@@ -20,32 +27,69 @@ def get_appium_options(app_info):
     options.show_xcode_log = True
     options.platform_name = "iOS"
     options.device_name = "iPhone"
-    options.udid = DEVICE_UDID
+    options.udid = udid or DEVICE_UDID
     options.automation_name = "XCUITest"
     options.bundle_id = app_info['bundleId']
     options.no_reset = True
-    options.wda_local_port = WDA_PORT
+    options.wda_local_port = wda_port or WDA_PORT
     options.wda_bundle_id = WDA_BUNDLE_ID
     logging.debug(f"Appium options configured for {app_info['name']}")
     return options
 
-def create_driver(app_info):
+def create_driver(app_info, udid=None, wda_port=None):
     """
     Create and initialize Appium driver
     
     Args:
         app_info: Dictionary containing app information
+        udid: Device UDID, defaults to DEVICE_UDID
+        wda_port: Local WebDriverAgent port, defaults to WDA_PORT
         
     Returns:
         Initialized Appium driver or None if failed
     """
     try:
         logging.info("Connecting to Appium server")
-        options = get_appium_options(app_info)
-        driver = webdriver.Remote('http://localhost:4723', options=options)
+        options = get_appium_options(app_info, udid, wda_port)
+        driver = webdriver.Remote(APPIUM_SERVER_URL, options=options)
         driver.implicitly_wait(5)
         logging.info("Successfully connected to Appium server")
+        if ASYNC_DRIVER:
+            driver = enable_async_driver(driver, port=wda_port or WDA_PORT)
+        elif WDA_FAST_PATH:
+            driver = enable_fast_path(driver, port=wda_port or WDA_PORT)
         return driver
     except Exception as e:
         logging.error(f"Failed to create driver: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def _wrap_timed(target, method_name, describe, listener):
+    """
+    Replace a bound method with one that reports its duration to a listener
+    """
+    original = getattr(target, method_name)
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            listener(describe(args), time.perf_counter() - start)
+
+    setattr(target, method_name, timed)
+
+def add_command_listener(driver, listener):
+    """
+    Call listener(command, seconds) after every command sent to the device
+
+    Commands going through Appium are reported by their WebDriver command name,
+    fast path commands as 'wda <endpoint>'.
+
+    Args:
+        driver: Appium driver or FastPathDriver
+        listener: Callable taking the command name and its duration in seconds
+    """
+    if isinstance(driver, FastPathDriver):
+        _wrap_timed(driver.wda, 'request', lambda args: f"wda {args[1].rsplit('/', 1)[-1]}", listener)
+        driver = driver._driver
+    _wrap_timed(driver, 'execute', lambda args: args[0], listener)
@@ -1,10 +1,44 @@
 """
 Utilities for working with UI elements
 """
+import sys
 import logging
 import json
 from time import sleep
 from selenium.webdriver.common.action_chains import ActionChains
+from ios_app_explorer.config import ELEMENT_DISCOVERY, SIBLING_SAMPLE_SIZE
+from ios_app_explorer.snapshot import take_snapshot
+from ios_app_explorer.templates import subtree_shapes
+
+CANDIDATE_TYPES = [
+    'XCUIElementTypeButton',
+    'XCUIElementTypeCell',
+    'XCUIElementTypeLink',
+    'XCUIElementTypeImage',
+    'XCUIElementTypeStaticText',
+    'XCUIElementTypeOther',
+    'XCUIElementTypeNavigationBar'
+]
+
+CLICKABLE_TYPES = ['XCUIElementTypeButton', 'XCUIElementTypeLink', 'XCUIElementTypeCell']
+
+INTERACTIVE_KEYWORDS = [
+    'tap', 'click', 'press', 'select', 'choose', 'open', 
+    'swap', 'stake', 'send', 'receive', 'buy', 'sell',
+    'add', 'remove', 'create', 'delete', 'edit', 'view',
+    'menu', 'settings', 'profile', 'account', 'wallet',
+    'home', 'back', 'next', 'done', 'cancel', 'confirm'
+]
+
+CLOSE_KEYWORDS = ['close', 'dismiss', '×', 'x', 'cancel', 'back']
+
+# List containers whose items are sampled as equivalent siblings
+LIST_PARENT_TYPES = ['XCUIElementTypeTable', 'XCUIElementTypeCollectionView']
+
+# Attributes fetched for every element found by a predicate query; WebDriverAgent
+# answers a plain 'name' with the element type, so name and value are read as
+# attributes and come back under their own names
+QUERY_ATTRIBUTES = ['type', 'attribute/name', 'label', 'attribute/value', 'rect', 'enabled']
 
 def is_element_clickable(element):
     """
@@ -89,40 +123,72 @@ def try_click_element(element, driver):
                 except Exception:
                     return False
 
+class ButtonRecord:
+    """
+    A candidate element to click
+
+    The live WebElement is only kept in 'elements' discovery mode; candidates
+    discovered from a snapshot are clicked by the center of their rect.
+
+    Candidates with the same group are structurally equivalent siblings, such
+    as the rows of a list; represented_by is set on those that are not clicked
+    because another member of their group is.
+    """
+    __slots__ = ('id', 'type', 'name', 'label', 'text', 'rect', 'enabled',
+                 'clickable', 'is_close_button', 'is_tab_item', 'element', 'group', 'represented_by')
+
+    def __init__(self, element_id, element_type, name, label, text, rect, enabled, element=None, group=None):
+        self.id = element_id
+        self.type = sys.intern(element_type)
+        self.name = name
+        self.label = label
+        self.text = text
+        self.rect = rect
+        self.enabled = enabled
+        self.element = element
+        self.group = group
+        self.represented_by = None
+
+        element_text = (name + label + text).lower()
+        has_interactive_keyword = any(keyword in element_text for keyword in INTERACTIVE_KEYWORDS)
+
+        # rect is (x, y, width, height)
+        self.is_tab_item = bool(rect and rect[1] > 250 and rect[3] > 40)
+
+        self.clickable = enabled and (
+            element_type in CLICKABLE_TYPES or
+            (element_type == 'XCUIElementTypeStaticText' and (
+                has_interactive_keyword or self.is_tab_item
+            )) or
+            has_interactive_keyword
+        )
+
+        self.is_close_button = any(close_text in element_text for close_text in CLOSE_KEYWORDS)
+
+    @property
+    def display_name(self):
+        return self.name or self.text or self.label
+
+    def __repr__(self):
+        return f"<ButtonRecord {self.type} name={self.name!r} label={self.label!r}>"
+
 def fetch_all_buttons(driver, buttons=None, level=0):
     """
-    Find all potentially clickable elements on the screen
-    
+    Find all potentially clickable elements on the screen with one
+    find_elements query per element type
+
     Args:
         driver: Appium driver
         buttons: Optional existing buttons dictionary to append to
         level: Current exploration depth level
         
     Returns:
-        Dictionary of button elements with metadata
+        Dictionary of ButtonRecord keyed by element UID
     """
     buttons = {} if buttons is None else buttons
 
-    element_types = [
-        'XCUIElementTypeButton',
-        'XCUIElementTypeCell',
-        'XCUIElementTypeLink',
-        'XCUIElementTypeImage',
-        'XCUIElementTypeStaticText',
-        'XCUIElementTypeOther',
-        'XCUIElementTypeNavigationBar'
-    ]
-    
-    interactive_keywords = [
-        'tap', 'click', 'press', 'select', 'choose', 'open', 
-        'swap', 'stake', 'send', 'receive', 'buy', 'sell',
-        'add', 'remove', 'create', 'delete', 'edit', 'view',
-        'menu', 'settings', 'profile', 'account', 'wallet',
-        'home', 'back', 'next', 'done', 'cancel', 'confirm'
-    ]
-    
     try:
-        for element_type in element_types:
+        for element_type in CANDIDATE_TYPES:
             try:
                 driver.implicitly_wait(2)
                 elements = driver.find_elements(by='class name', value=element_type) or []
@@ -142,54 +208,25 @@ def fetch_all_buttons(driver, buttons=None, level=0):
                         name = btn.get_attribute('name') or ''
                         label = btn.get_attribute('label') or ''
                         text = btn.text or ''
-                        is_visible = True
                         
                         try:
                             is_enabled = bool(btn.is_enabled())
                         except:
                             is_enabled = False
                         
-                        element_text = (name + label + text).lower()
-                        has_interactive_keyword = any(keyword in element_text for keyword in interactive_keywords)
-                        
-                        rect_str = btn.get_attribute('rect')
-                        is_likely_tab_item = False
+                        rect = None
                         try:
+                            rect_str = btn.get_attribute('rect')
                             if rect_str:
-                                rect = json.loads(rect_str)
-                                if rect.get('y', 0) > 250 and rect.get('height', 0) > 40:
-                                    is_likely_tab_item = True
+                                r = json.loads(rect_str)
+                                rect = (r.get('x', 0), r.get('y', 0), r.get('width', 0), r.get('height', 0))
                         except Exception:
                             pass
                         
-                        is_clickable = (
-                            is_visible and is_enabled and (
-                                element_type in ['XCUIElementTypeButton', 'XCUIElementTypeLink', 'XCUIElementTypeCell'] or
-                                (element_type == 'XCUIElementTypeStaticText' and (
-                                    has_interactive_keyword or is_likely_tab_item
-                                )) or
-                                has_interactive_keyword
-                            )
+                        buttons[element_uid] = ButtonRecord(
+                            element_uid, element_type, name, label, text, rect, is_enabled, element=btn,
+                            group=geometry_group(element_type, rect)
                         )
-                        
-                        is_close_button = any(
-                            close_text in element_text
-                            for close_text in ['close', 'dismiss', '×', 'x', 'cancel', 'back']
-                        )
-                        
-                        buttons[element_uid] = {
-                            'id': element_uid,
-                            'text': text,
-                            'name': name,
-                            'label': label,
-                            'visible': is_visible,
-                            'enabled': is_enabled,
-                            'clickable': is_clickable,
-                            'btn': btn,
-                            'is_close_button': is_close_button,
-                            'type': element_type,
-                            'is_tab_item': is_likely_tab_item
-                        }
                     except Exception:
                         continue
             except Exception:
@@ -199,4 +236,263 @@ def fetch_all_buttons(driver, buttons=None, level=0):
     
     except Exception as e:
         logging.error(f"Error in fetch_all_buttons: {e}")
-        return {}
\ No newline at end of file
+        return {}
+
+def geometry_group(element_type, rect):
+    """
+    Group key for a cell found without a tree: cells of one list share their
+    x position and size
+
+    Returns:
+        Group key, or None for anything but a cell with a rect
+    """
+    if element_type != 'XCUIElementTypeCell' or not rect:
+        return None
+    x, _, width, height = rect
+    return ('cell', x, width, height)
+
+def visible_types_predicate(element_types):
+    """
+    Build an iOS predicate matching visible elements of any of the given types
+
+    Args:
+        element_types: XCUIElementType names
+
+    Returns:
+        Predicate string such as "type IN {'XCUIElementTypeButton'} AND visible == 1"
+    """
+    types = ', '.join(f"'{element_type}'" for element_type in element_types)
+    return f"type IN {{{types}}} AND visible == 1"
+
+def _parse_rect(rect):
+    """
+    Turn a rect attribute (a dictionary or its JSON string) into (x, y, width, height)
+    """
+    if isinstance(rect, str):
+        rect = json.loads(rect)
+    if not rect:
+        return None
+    return (rect.get('x', 0), rect.get('y', 0), rect.get('width', 0), rect.get('height', 0))
+
+def _snapshot_records(driver, element_types):
+    """
+    Records of the visible elements of some types, filtered from one page source
+    """
+    wanted = set(element_types)
+    return [{'id': f"#{e.index}", 'type': e.type, 'name': e.name, 'label': e.label, 'value': e.value,
+             'rect': e.rect, 'enabled': e.enabled}
+            for e in take_snapshot(driver).elements if e.type in wanted and e.visible]
+
+def query_elements(driver, element_types):
+    """
+    Find the visible elements of some types in a single round trip
+
+    Through the WDA fast path this is one predicate query whose response
+    carries the attributes. Otherwise reading the attributes through Appium
+    would cost a request per attribute and element, so the page source is
+    fetched instead and filtered locally.
+
+    Args:
+        driver: Appium driver
+        element_types: XCUIElementType names
+
+    Returns:
+        List of dictionaries with id, type, name, label, value, text, rect as
+        (x, y, width, height) and enabled
+    """
+    records = None
+    if hasattr(driver, 'find_element_records'):
+        predicate = visible_types_predicate(element_types)
+        records = driver.find_element_records('predicate string', predicate, QUERY_ATTRIBUTES)
+    if records is None:
+        records = _snapshot_records(driver, element_types)
+    for record in records:
+        record['text'] = record.get('value') or record.get('label')
+        try:
+            record['rect'] = _parse_rect(record.get('rect'))
+        except ValueError:
+            record['rect'] = None
+    return records
+
+def fetch_buttons_by_query(driver, buttons=None, level=0):
+    """
+    Find all potentially clickable elements on the screen with one predicate
+    query over every candidate type
+
+    Args:
+        driver: Appium driver
+        buttons: Optional existing buttons dictionary to append to
+        level: Current exploration depth level
+
+    Returns:
+        Dictionary of ButtonRecord keyed by element id; they are clicked by
+        the center of their rect
+    """
+    buttons = {} if buttons is None else buttons
+    try:
+        records = query_elements(driver, CANDIDATE_TYPES)
+    except Exception as e:
+        logging.error(f"Error in fetch_buttons_by_query: {e}")
+        return buttons
+    for record in records:
+        element_id = record['id']
+        if element_id in buttons or record.get('type') not in CANDIDATE_TYPES:
+            continue
+        buttons[element_id] = ButtonRecord(
+            element_id, record['type'], record.get('name') or '', record.get('label') or '',
+            record.get('text') or '', record['rect'], bool(record.get('enabled')),
+            group=geometry_group(record['type'], record['rect'])
+        )
+    return buttons
+
+def buttons_from_snapshot(state, buttons=None):
+    """
+    Build candidate buttons from an already parsed snapshot, without any device query
+
+    Args:
+        state: ScreenState of the current screen
+        buttons: Optional existing buttons dictionary to append to
+
+    Returns:
+        Dictionary of ButtonRecord keyed by snapshot index
+    """
+    buttons = {} if buttons is None else buttons
+    candidate_types = set(CANDIDATE_TYPES)
+    elements = state.elements
+    shapes = subtree_shapes(elements)
+    has_children = {element.parent for element in elements}
+    for element in elements:
+        if element.type not in candidate_types or not element.visible:
+            continue
+        element_id = f"#{element.index}"
+        if element_id in buttons:
+            continue
+        rect = (element.x, element.y, element.width, element.height)
+
+        # Cells and the composite items of lists group with same-shaped
+        # siblings; controls anywhere else, such as the rows of a settings
+        # stack or the items of a tab bar, always stay distinct
+        group = None
+        parent_type = elements[element.parent].type if element.parent >= 0 else None
+        if element.type == 'XCUIElementTypeCell' or (
+                parent_type in LIST_PARENT_TYPES and element.index in has_children):
+            group = (element.parent, shapes[element.index])
+
+        buttons[element_id] = ButtonRecord(
+            element_id, element.type, element.name, element.label, element.text, rect, element.enabled,
+            group=group
+        )
+    return buttons
+
+def sample_equivalent_siblings(buttons, sample_size=SIBLING_SAMPLE_SIZE):
+    """
+    Keep only a sample of each group of structurally equivalent siblings
+
+    The sample is spread over the group (first, last and evenly in between)
+    and the other members are marked as represented by the first one kept.
+
+    Args:
+        buttons: List of ButtonRecord in click order
+        sample_size: Members to keep per group, None to keep all
+
+    Returns:
+        List of ButtonRecord to click, in the original order
+    """
+    if sample_size is None:
+        return list(buttons)
+    groups = {}
+    for button in buttons:
+        if button.group is not None:
+            groups.setdefault(button.group, []).append(button)
+
+    represented = set()
+    for members in groups.values():
+        if len(members) <= sample_size:
+            continue
+        if sample_size <= 1:
+            keep = {0}
+        else:
+            keep = {round(i * (len(members) - 1) / (sample_size - 1)) for i in range(sample_size)}
+        representative = members[min(keep)]
+        for i, member in enumerate(members):
+            if i not in keep:
+                member.represented_by = representative.id
+                represented.add(id(member))
+        logging.debug(f"Sampling {len(keep)} of {len(members)} equivalent {members[0].type} siblings")
+
+    if represented:
+        logging.info(f"Skipping {len(represented)} candidates represented by an equivalent sibling")
+    return [button for button in buttons if id(button) not in represented]
+
+def discover_buttons(driver, state=None, level=0):
+    """
+    Find candidate buttons using the configured discovery mode
+
+    Args:
+        driver: Appium driver
+        state: Optional ScreenState of the current screen, reused in snapshot mode
+        level: Current exploration depth level
+
+    Returns:
+        Dictionary of ButtonRecord
+    """
+    if ELEMENT_DISCOVERY == 'elements':
+        return fetch_all_buttons(driver=driver, buttons=None, level=level)
+    if ELEMENT_DISCOVERY == 'query':
+        return fetch_buttons_by_query(driver, level=level)
+    if state is None or not state.elements:
+        state = take_snapshot(driver)
+    return buttons_from_snapshot(state)
+
+def click_button(driver, button):
+    """
+    Click a candidate button
+
+    Snapshot candidates are tapped at the center of their rect. Candidates with
+    a live element are looked up again by accessibility id or label first, since
+    the original reference may have gone stale.
+
+    Args:
+        driver: Appium driver
+        button: ButtonRecord to click
+
+    Returns:
+        Boolean indicating if click was successful
+    """
+    if button.element is None:
+        if not button.rect:
+            return False
+        x, y, width, height = button.rect
+        try:
+            logging.info(f"Tapping {button.type} - Name: {button.name}, Label: {button.label}")
+            driver.tap([(x + width / 2, y + height / 2)])
+            return True
+        except Exception as e:
+            logging.debug(f"Tap failed: {e}")
+            return False
+
+    try:
+        fresh_element = None
+        if button.name:
+            try:
+                fresh_element = driver.find_element(by='accessibility id', value=button.name)
+                logging.debug(f"Found element by accessibility id: {button.name}")
+            except Exception as e:
+                logging.debug(f"Could not find element by accessibility id: {e}")
+        
+        if not fresh_element and button.label:
+            try:
+                xpath = f"//{button.type}[@label='{button.label}']"
+                fresh_element = driver.find_element(by='xpath', value=xpath)
+                logging.debug(f"Found element by xpath: {xpath}")
+            except Exception as e:
+                logging.debug(f"Could not find element by xpath: {e}")
+        
+        if not fresh_element:
+            logging.debug("Using original button reference")
+            fresh_element = button.element
+        
+        return try_click_element(fresh_element, driver)
+    except Exception as e:
+        logging.warning(f"Error finding fresh element, using original: {e}")
+        return try_click_element(button.element, driver)
@@ -0,0 +1,313 @@
+"""
+Streaming events of an exploration, for consumers that run alongside the crawl
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import logging
+import tempfile
+import threading
+from ios_app_explorer.config import EVENT_BUFFER_SIZE, EVENT_OVERFLOW_POLICY
+
+APP_STARTED = 'app_started'
+APP_FINISHED = 'app_finished'
+SCREEN_DISCOVERED = 'screen_discovered'
+SCREENSHOT_CAPTURED = 'screenshot_captured'
+ACTION = 'action'
+RESTART = 'restart'
+ALERT = 'alert'
+ERROR = 'error'
+
+EVENT_TYPES = [APP_STARTED, APP_FINISHED, SCREEN_DISCOVERED, SCREENSHOT_CAPTURED, ACTION, RESTART, ALERT, ERROR]
+
+# What to do when a consumer's buffer is full
+OVERFLOW_POLICIES = ['drop_oldest', 'drop_newest', 'spill']
+
+# Subscribed streams, and the app the events belong to
+_streams = []
+_streams_lock = threading.Lock()
+_current_app = None
+
+# Marks the end of the stream in a buffer
+_END = object()
+
+class Event:
+    """
+    One thing the explorer did or learned
+
+    Attributes:
+        kind: One of EVENT_TYPES
+        app: Name of the app being explored
+        time: Unix time of the event
+        data: Dictionary with the event's fields
+    """
+    __slots__ = ('kind', 'app', 'time', 'data')
+
+    def __init__(self, kind, app, data, timestamp=None):
+        self.kind = kind
+        self.app = app
+        self.time = timestamp if timestamp is not None else time.time()
+        self.data = data
+
+    def to_dict(self):
+        return {'kind': self.kind, 'app': self.app, 'time': self.time, **self.data}
+
+    @classmethod
+    def from_dict(cls, record):
+        record = dict(record)
+        return cls(record.pop('kind'), record.pop('app'), record, record.pop('time'))
+
+    def __repr__(self):
+        return f"<Event {self.kind} app={self.app!r} {self.data!r}>"
+
+class EventStream:
+    """
+    Bounded buffer of events for one consumer
+
+    The crawl never waits for a consumer. When the buffer is full the policy
+    decides: 'drop_oldest' discards the oldest buffered event, 'drop_newest'
+    discards the new one, and 'spill' appends events to a temporary file that
+    the consumer reads back, in order, once it has caught up. Iterate the
+    stream (with for or async for) until the crawl ends it.
+    """
+
+    def __init__(self, maxsize=EVENT_BUFFER_SIZE, policy=EVENT_OVERFLOW_POLICY, kinds=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy}, expected one of {OVERFLOW_POLICIES}")
+        self.policy = policy
+        self.kinds = set(kinds) if kinds else None
+        self.dropped = 0
+        self.spilled = 0
+        self._queue = queue.Queue(maxsize=max(maxsize, 1))
+        self._lock = threading.Lock()
+        self._spill = None
+        self._spill_pending = 0
+        self._read_offset = 0
+        self._ended = False
+
+    def put(self, event):
+        """
+        Buffer an event without blocking
+        """
+        if self.kinds is not None and event is not _END and event.kind not in self.kinds:
+            return
+        with self._lock:
+            if self._spill_pending:
+                self._spill_event(event)
+                return
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                pass
+            if event is _END or self.policy == 'spill':
+                self._spill_event(event)
+            elif self.policy == 'drop_oldest':
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(event)
+                self.dropped += 1
+            else:
+                self.dropped += 1
+
+    def _spill_event(self, event):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile('w+')
+        self._spill.seek(0, os.SEEK_END)
+        record = {'end': True} if event is _END else event.to_dict()
+        self._spill.write(json.dumps(record) + '\n')
+        self._spill_pending += 1
+        if event is not _END:
+            self.spilled += 1
+
+    def _unspill(self):
+        with self._lock:
+            if not self._spill_pending:
+                return None
+            self._spill.seek(self._read_offset)
+            line = self._spill.readline()
+            self._read_offset = self._spill.tell()
+            self._spill_pending -= 1
+            if not self._spill_pending:
+                self._spill.seek(0)
+                self._spill.truncate()
+                self._read_offset = 0
+        record = json.loads(line)
+        return _END if record.get('end') else Event.from_dict(record)
+
+    def get(self, timeout=None):
+        """
+        Get the next event
+
+        Args:
+            timeout: Seconds to wait, None to wait until an event arrives
+
+        Returns:
+            The next Event, or None once the stream has ended or the timeout expired
+        """
+        if self._ended:
+            return None
+        while True:
+            # Buffered events are older than spilled ones, so drain the buffer first
+            spilled = self._spill_pending
+            try:
+                event = self._queue.get_nowait() if spilled else self._queue.get(timeout=timeout)
+            except queue.Empty:
+                if not spilled:
+                    return None
+                event = self._unspill()
+                if event is None:
+                    continue
+            break
+        if event is _END:
+            self._ended = True
+            return None
+        return event
+
+    def end(self):
+        self.put(_END)
+
+    def close(self):
+        unsubscribe(self)
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def __iter__(self):
+        while True:
+            event = self.get()
+            if event is None:
+                return
+            yield event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await asyncio.to_thread(self.get)
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+class Sink:
+    """
+    Runs a handler on every event in a background thread
+
+    Handler errors are logged and do not stop the sink or the crawl.
+    """
+
+    def __init__(self, handler, maxsize=EVENT_BUFFER_SIZE, policy=EVENT_OVERFLOW_POLICY, kinds=None, name=None):
+        self.handler = handler
+        self.stream = subscribe(maxsize, policy, kinds)
+        self.thread = threading.Thread(target=self._run, name=name or 'event-sink', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for event in self.stream:
+            try:
+                self.handler(event)
+            except Exception as e:
+                logging.error(f"Event sink {self.thread.name} failed on {event.kind}: {e}")
+
+    def close(self, timeout=None):
+        """
+        End the sink's stream and wait for it to drain
+        """
+        self.stream.end()
+        self.thread.join(timeout)
+        self.stream.close()
+
+class JsonlSink(Sink):
+    """
+    Appends every event as a JSON line to a file
+    """
+
+    def __init__(self, path, **kwargs):
+        self._file = open(path, 'a')
+        super().__init__(self._write, name=f"jsonl:{os.path.basename(path)}", **kwargs)
+
+    def _write(self, event):
+        self._file.write(json.dumps(event.to_dict()) + '\n')
+        self._file.flush()
+
+    def close(self, timeout=None):
+        super().close(timeout)
+        self._file.close()
+
+def subscribe(maxsize=EVENT_BUFFER_SIZE, policy=EVENT_OVERFLOW_POLICY, kinds=None):
+    """
+    Start receiving events
+
+    Args:
+        maxsize: Number of events buffered in memory
+        policy: Overflow policy, one of OVERFLOW_POLICIES
+        kinds: Optional list of event kinds to receive
+
+    Returns:
+        EventStream to iterate
+    """
+    stream = EventStream(maxsize, policy, kinds)
+    with _streams_lock:
+        _streams.append(stream)
+    return stream
+
+def unsubscribe(stream):
+    with _streams_lock:
+        if stream in _streams:
+            _streams.remove(stream)
+
+def add_sink(handler, **kwargs):
+    """
+    Run a handler on every event in a background thread
+
+    Args:
+        handler: Callable taking an Event
+        **kwargs: maxsize, policy and kinds as for subscribe
+
+    Returns:
+        The running Sink
+    """
+    return Sink(handler, **kwargs)
+
+def emit(kind, **data):
+    """
+    Publish an event to every subscriber (a no-op without subscribers)
+
+    Args:
+        kind: One of EVENT_TYPES
+        **data: Event fields
+    """
+    if not _streams:
+        return
+    event = Event(kind, _current_app, data)
+    with _streams_lock:
+        streams = list(_streams)
+    for stream in streams:
+        stream.put(event)
+
+def start_app(app_name):
+    """
+    Mark the start of an app's exploration
+    """
+    global _current_app
+    _current_app = app_name
+    emit(APP_STARTED)
+
+def finish_app(**data):
+    """
+    Mark the end of the current app's exploration
+    """
+    emit(APP_FINISHED, **data)
+
+def end_streams():
+    """
+    End every subscribed stream, e.g. when the crawl is over
+    """
+    with _streams_lock:
+        streams = list(_streams)
+    for stream in streams:
+        stream.end()
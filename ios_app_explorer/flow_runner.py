@@ -0,0 +1,305 @@
+"""
+Native executor for Maestro YAML flows on the Appium session
+"""
+import os
+import re
+import time
+import logging
+import argparse
+from ios_app_explorer.config import (
+    APP_LIST, WAIT_AFTER_LAUNCH,
+    FLOW_LOOKUP_TIMEOUT, FLOW_POLL_INTERVAL, FLOW_ANIMATION_TIMEOUT
+)
+from ios_app_explorer.snapshot import take_snapshot, find_by_text, find_by_id, element_center
+from ios_app_explorer.scroll_utils import scroll_screen, window_size, find_scroll_container
+from ios_app_explorer.output import save_screenshot
+from ios_app_explorer.profiling import sleep
+from ios_app_explorer.budget import expired
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+ENV_PATTERN = re.compile(r'\$\{(\w+)\}')
+
+def _substitute(value, env):
+    """
+    Recursively replace ${VAR} references in a parsed flow
+    """
+    if isinstance(value, str):
+        return ENV_PATTERN.sub(lambda m: env.get(m.group(1), m.group(0)), value)
+    if isinstance(value, list):
+        return [_substitute(v, env) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, env) for k, v in value.items()}
+    return value
+
+def load_flow(flow_path, env=None):
+    """
+    Load a Maestro flow file
+
+    Args:
+        flow_path: Path to the YAML flow
+        env: Variables available to ${VAR} references in the flow
+
+    Returns:
+        Tuple of (header dictionary, list of steps)
+    """
+    if yaml is None:
+        raise RuntimeError("Running flows requires pyyaml (pip install 'iphone-screenshooter[flows]')")
+
+    with open(flow_path) as f:
+        documents = [d for d in yaml.safe_load_all(f)]
+    if len(documents) == 1:
+        header, steps = {}, documents[0]
+    else:
+        header, steps = documents[0] or {}, documents[1]
+
+    env = dict(os.environ if env is None else env)
+    env.update({k: str(v) for k, v in (header.get('env') or {}).items()})
+    return _substitute(header, env), _substitute(steps or [], env)
+
+def _normalize_step(step):
+    """
+    Split a flow step into its command name and arguments
+    """
+    if isinstance(step, str):
+        return step, None
+    if isinstance(step, dict) and len(step) == 1:
+        return next(iter(step.items()))
+    raise ValueError(f"Malformed flow step: {step!r}")
+
+def _snapshot(context):
+    """
+    Get the snapshot for the current step, fetching it only if the screen may have changed
+    """
+    if context['snapshot'] is None:
+        context['snapshot'] = take_snapshot(context['driver'])
+    return context['snapshot']
+
+def _parse_point(context, point):
+    """
+    Convert a Maestro point ("120,300" or "50%,80%") into screen coordinates
+    """
+    x_str, y_str = [p.strip() for p in str(point).split(',')]
+    size = window_size(context['driver'])
+    x = size['width'] * float(x_str[:-1]) / 100 if x_str.endswith('%') else float(x_str)
+    y = size['height'] * float(y_str[:-1]) / 100 if y_str.endswith('%') else float(y_str)
+    return x, y
+
+def _resolve_target(context, selector):
+    """
+    Resolve a tapOn selector to coordinates, refreshing the snapshot until the lookup timeout
+    """
+    if 'point' in selector:
+        return _parse_point(context, selector['point'])
+
+    index = int(selector.get('index', 0))
+    deadline = time.time() + FLOW_LOOKUP_TIMEOUT
+    while True:
+        snapshot = _snapshot(context)
+        if 'id' in selector:
+            matches = find_by_id(snapshot, selector['id'])
+        else:
+            matches = find_by_text(snapshot, str(selector.get('text', '')))
+        if len(matches) > index:
+            return element_center(matches[index])
+        if time.time() >= deadline:
+            return None
+        sleep(FLOW_POLL_INTERVAL)
+        context['snapshot'] = None
+
+def _launch_app(context, args):
+    args = {'appId': args} if isinstance(args, str) else (args or {})
+    app_id = args.get('appId', context['app_id'])
+    driver = context['driver']
+    if args.get('clearState'):
+        logging.warning("launchApp clearState is not supported, launching without clearing")
+    if args.get('stopApp', True):
+        driver.terminate_app(app_id)
+    driver.activate_app(app_id)
+    sleep(WAIT_AFTER_LAUNCH)
+    context['snapshot'] = None
+    return True
+
+def _tap_on(context, args):
+    selector = {'text': args} if isinstance(args, str) else (args or {})
+    target = _resolve_target(context, selector)
+    if target is None:
+        logging.warning(f"tapOn could not find element: {selector}")
+        return False
+    logging.info(f"tapOn {selector} at ({target[0]:.0f}, {target[1]:.0f})")
+    context['driver'].tap([target])
+    context['snapshot'] = None
+    return True
+
+def _input_text(context, args):
+    text = args.get('text', '') if isinstance(args, dict) else str(args)
+    driver = context['driver']
+    try:
+        driver.switch_to.active_element.send_keys(text)
+    except Exception:
+        logging.debug("No active element, typing into the first text field")
+        driver.find_element(by='class name', value='XCUIElementTypeTextField').send_keys(text)
+    context['snapshot'] = None
+    return True
+
+def _scroll(context, args):
+    container = find_scroll_container(context['snapshot'])
+    context['snapshot'] = None
+    return scroll_screen(context['driver'], 'down', container=container)
+
+def _sleep(context, args):
+    milliseconds = args.get('time', 0) if isinstance(args, dict) else args
+    sleep(float(milliseconds) / 1000)
+    context['snapshot'] = None
+    return True
+
+def _wait_for_animation_to_end(context, args):
+    args = args if isinstance(args, dict) else {}
+    deadline = time.time() + float(args.get('timeout', FLOW_ANIMATION_TIMEOUT * 1000)) / 1000
+    previous = take_snapshot(context['driver'])
+    while time.time() < deadline:
+        sleep(FLOW_POLL_INTERVAL)
+        current = take_snapshot(context['driver'])
+        if current.fingerprint == previous.fingerprint:
+            break
+        previous = current
+    # The last snapshot is still valid for the next lookup
+    context['snapshot'] = previous
+    return True
+
+def _take_screenshot(context, args):
+    name = args.get('path') if isinstance(args, dict) else args
+    filename = f"{context['prefix']}_{name}.png"
+    screenshot_path = os.path.join(context['output_dir'], filename)
+    save_screenshot(context['driver'], screenshot_path, {'kind': 'flow', 'flow': context['prefix'], 'step': name})
+    logging.info(f"Saved flow screenshot to {screenshot_path}")
+    return True
+
+COMMANDS = {
+    'launchApp': _launch_app,
+    'tapOn': _tap_on,
+    'inputText': _input_text,
+    'scroll': _scroll,
+    'sleep': _sleep,
+    'waitForAnimationToEnd': _wait_for_animation_to_end,
+    'takeScreenshot': _take_screenshot
+}
+
+def run_flow(driver, app_info, flow_path, output_dir, env=None, deadline=None):
+    """
+    Run a Maestro flow on an existing Appium session
+
+    Args:
+        driver: Appium driver
+        app_info: App information dictionary
+        flow_path: Path to the YAML flow
+        output_dir: Directory for the flow's screenshots
+        env: Extra variables for ${VAR} references in the flow
+        deadline: Optional time.monotonic() value at which the flow stops
+
+    Returns:
+        Boolean indicating if every required step succeeded
+    """
+    flow_env = dict(os.environ)
+    flow_env.update({'MAESTRO_APP_ID': app_info['bundleId'], 'APP_NAME': app_info['name']})
+    flow_env.update(env or {})
+    try:
+        header, steps = load_flow(flow_path, flow_env)
+    except Exception as e:
+        logging.error(f"Failed to load flow {flow_path}: {e}")
+        return False
+
+    flow_name = os.path.splitext(os.path.basename(flow_path))[0]
+    context = {
+        'driver': driver,
+        'app_id': header.get('appId') or app_info['bundleId'],
+        'output_dir': output_dir,
+        'prefix': f"{app_info['name']}_{flow_name}",
+        'snapshot': None
+    }
+    logging.info(f"Running flow {flow_path} ({len(steps)} steps)")
+
+    for number, step in enumerate(steps, start=1):
+        if expired(deadline):
+            logging.warning(f"Flow {flow_name} stopped at step {number}: time budget used up")
+            return False
+        try:
+            command, args = _normalize_step(step)
+        except ValueError as e:
+            logging.error(str(e))
+            return False
+
+        handler = COMMANDS.get(command)
+        if handler is None:
+            logging.warning(f"Step {number}: unsupported command '{command}', skipping")
+            continue
+
+        optional = isinstance(args, dict) and args.get('optional', False)
+        try:
+            success = handler(context, args)
+        except Exception as e:
+            logging.error(f"Step {number} ({command}) failed: {e}")
+            success = False
+
+        if not success and not optional:
+            logging.error(f"Flow {flow_name} stopped at step {number} ({command})")
+            return False
+
+    logging.info(f"Flow {flow_name} finished")
+    return True
+
+def run_app_flows(driver, app_info, output_dir, deadline=None):
+    """
+    Run every flow configured for an app in its 'flows' list
+
+    Args:
+        driver: Appium driver
+        app_info: App information dictionary
+        output_dir: Directory for the flows' screenshots
+        deadline: Optional time.monotonic() value after which no flow runs
+
+    Returns:
+        Number of flows that completed successfully
+    """
+    completed = 0
+    for flow_path in app_info.get('flows', []):
+        if expired(deadline):
+            break
+        if run_flow(driver, app_info, flow_path, output_dir, deadline=deadline):
+            completed += 1
+    return completed
+
+def main():
+    """
+    Command line entry point for running flows against one app
+    """
+    from ios_app_explorer.logger import setup_logging
+    from ios_app_explorer.driver import create_driver
+    from ios_app_explorer.screenshot import create_folders
+
+    parser = argparse.ArgumentParser(description="Run Maestro flows on the Appium session")
+    parser.add_argument('app', help="App name from APP_LIST")
+    parser.add_argument('flows', nargs='*', help="Flow files (defaults to the app's 'flows')")
+    args = parser.parse_args()
+
+    setup_logging(args.app)
+    app_info = next((a for a in APP_LIST if a['name'] == args.app), None)
+    if app_info is None:
+        logging.error(f"App {args.app} is not in APP_LIST")
+        return
+    if args.flows:
+        app_info = dict(app_info, flows=args.flows)
+
+    driver = create_driver(app_info)
+    if not driver:
+        return
+    try:
+        run_app_flows(driver, app_info, create_folders(app_info))
+    finally:
+        driver.quit()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,499 @@
+"""
+Shared crawl frontier so that several devices can explore one app together
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from ios_app_explorer.config import (
+    APP_LIST, DEVICE_UDIDS, WDA_PORT, MAX_DEPTH, MAX_BUTTONS_PER_LEVEL, WAIT_AFTER_CLICK,
+    FRONTIER_CLAIM_TIMEOUT, FRONTIER_POLL_INTERVAL, FRONTIER_MAX_ATTEMPTS, METRICS_PORT, TEXT_INDEX_PATH,
+    SATURATION_ACTION
+)
+from ios_app_explorer import events, metrics, text_index
+from ios_app_explorer.element_utils import discover_buttons, click_button
+from ios_app_explorer.navigation import (
+    select_buttons, action_from_button, replay_path, try_go_back, restart_app
+)
+from ios_app_explorer.restore import ScreenRestorer
+from ios_app_explorer.snapshot import take_snapshot, screen_fingerprint
+from ios_app_explorer.output import save_screenshot, close_backends
+from ios_app_explorer.templates import TemplateClusters
+from ios_app_explorer.saturation import DiscoveryTracker
+from ios_app_explorer.alerts import AlertInterceptor
+from ios_app_explorer.profiling import sleep
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS screens (
+    number INTEGER PRIMARY KEY AUTOINCREMENT,
+    fingerprint TEXT UNIQUE NOT NULL,
+    level INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    discovered_by TEXT
+);
+CREATE INDEX IF NOT EXISTS screens_status ON screens (status, level, number);
+'''
+
+class CrawlFrontier:
+    """
+    SQLite-backed frontier and visited-fingerprint store shared by crawl workers
+
+    Every screen is stored once with the action path that reaches it from the
+    app's root screen. Workers claim pending screens (shallowest first), explore
+    them and publish what they discover. Claims that are not completed within
+    FRONTIER_CLAIM_TIMEOUT go back to the pool, so a dead worker does not lose
+    its screen. Each thread uses its own connection, and the database file can be
+    shared by several processes on the same machine.
+
+    The file outlives the crawl: opening it joins the crawl in progress, or
+    continues an interrupted one, and only a fresh start empties it.
+    """
+
+    def __init__(self, db_path, fresh=False):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+        if fresh:
+            self.reset()
+        else:
+            self.free_claims()
+
+    def reset(self):
+        """
+        Forget every screen, so numbering starts again at 1; workers still
+        crawling this frontier lose their work
+        """
+        connection = self._connect()
+        connection.execute('DELETE FROM screens')
+        connection.execute("DELETE FROM sqlite_sequence WHERE name = 'screens'")
+
+    def free_claims(self):
+        """
+        Put screens whose claims timed out back to pending, as claim does;
+        screens live workers are exploring stay theirs
+        """
+        self._connect().execute(
+            "UPDATE screens SET status = 'pending', claimed_by = NULL "
+            "WHERE status = 'claimed' AND claimed_at < ?",
+            (time.time() - FRONTIER_CLAIM_TIMEOUT,)
+        )
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def publish(self, fingerprint, level, path, worker_id=None, explore=True):
+        """
+        Record a discovered screen
+
+        Args:
+            fingerprint: Screen fingerprint
+            level: Depth of the screen
+            path: Actions that reach the screen from the root
+            worker_id: Worker that discovered the screen
+            explore: Whether the screen still has to be explored
+
+        Returns:
+            The screen's number if it was new, None if it was already known
+        """
+        cursor = self._connect().execute(
+            'INSERT OR IGNORE INTO screens (fingerprint, level, path, status, discovered_by) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (format(fingerprint, '016x'), level, json.dumps(path),
+             'pending' if explore else 'done', worker_id)
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def is_known(self, fingerprint):
+        row = self._connect().execute(
+            'SELECT 1 FROM screens WHERE fingerprint = ?', (format(fingerprint, '016x'),)
+        ).fetchone()
+        return row is not None
+
+    def claim(self, worker_id):
+        """
+        Claim the shallowest pending screen
+
+        Args:
+            worker_id: Worker claiming the screen
+
+        Returns:
+            Dictionary with the screen's number, fingerprint, level and path, or
+            None if nothing can be claimed right now
+        """
+        connection = self._connect()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                "SELECT number, fingerprint, level, path FROM screens "
+                "WHERE status = 'pending' OR (status = 'claimed' AND claimed_at < ?) "
+                "ORDER BY level, number LIMIT 1",
+                (now - FRONTIER_CLAIM_TIMEOUT,)
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            connection.execute(
+                "UPDATE screens SET status = 'claimed', claimed_by = ?, claimed_at = ? WHERE number = ?",
+                (worker_id, now, row['number'])
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return {
+            'number': row['number'],
+            'fingerprint': int(row['fingerprint'], 16),
+            'level': row['level'],
+            'path': json.loads(row['path'])
+        }
+
+    def complete(self, fingerprint):
+        self._connect().execute(
+            "UPDATE screens SET status = 'done' WHERE fingerprint = ?", (format(fingerprint, '016x'),)
+        )
+
+    def release(self, fingerprint):
+        """
+        Give a claimed screen back after a failed attempt, or fail it for good
+        once it has used up FRONTIER_MAX_ATTEMPTS
+        """
+        self._connect().execute(
+            "UPDATE screens SET attempts = attempts + 1, claimed_by = NULL, "
+            "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE fingerprint = ?",
+            (FRONTIER_MAX_ATTEMPTS, format(fingerprint, '016x'))
+        )
+
+    def has_work_in_progress(self):
+        """
+        Check whether any screen is pending or claimed, i.e. whether more work may appear
+        """
+        row = self._connect().execute(
+            "SELECT 1 FROM screens WHERE status IN ('pending', 'claimed') LIMIT 1"
+        ).fetchone()
+        return row is not None
+
+    def stats(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM screens GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+def _reach(driver, app_info, item):
+    """
+    Navigate to a claimed screen and check that it is the expected one
+    """
+    if not replay_path(driver, app_info, item['path']):
+        return None
+    state = take_snapshot(driver)
+    if state.fingerprint != item['fingerprint']:
+        logging.warning(f"Replaying the path to screen {item['number']} led to a different screen")
+        return None
+    return state
+
+def explore_claimed_screen(driver, app_info, frontier, item, path, worker_id, max_per_level=None, restorer=None,
+                           templates=None, saturation=None, alerts=None):
+    """
+    Click through the candidates of one claimed screen and publish the discoveries
+
+    Args:
+        driver: Appium driver
+        app_info: App information dictionary
+        frontier: CrawlFrontier
+        item: Claimed screen from CrawlFrontier.claim
+        path: Path to save screenshots
+        worker_id: Name of this worker
+        max_per_level: Maximum number of buttons to try
+        restorer: Optional ScreenRestorer used when back navigation fails
+        templates: Optional TemplateClusters shared by the workers; screens of a
+            template over its cap are neither published nor captured
+        saturation: Optional DiscoveryTracker shared by the workers; once clicks
+            stop finding new screens the rest of this screen is skipped (or, with
+            SATURATION_ACTION 'app', the crawl stops)
+        alerts: Optional AlertInterceptor of this worker's driver
+
+    Returns:
+        Boolean indicating if the screen was fully explored
+    """
+    max_per_level = max_per_level or MAX_BUTTONS_PER_LEVEL
+    state = _reach(driver, app_info, item)
+    if state is None:
+        return False
+
+    buttons = select_buttons(discover_buttons(driver, state=state), max_per_level)
+    state.release_elements()
+    level = item['level']
+
+    for i, button in enumerate(buttons):
+        if saturation is not None:
+            if saturation.stopped:
+                return False
+            reason = saturation.saturated()
+            if reason is not None:
+                if SATURATION_ACTION == 'app':
+                    saturation.stop(reason)
+                    return False
+                logging.info(f"[{worker_id}] Leaving screen {item['number']} with {len(buttons) - i} buttons untried")
+                saturation.abandon(reason)
+                return True
+        button_name = button.display_name or button.type
+        if not click_button(driver, button):
+            if saturation is not None:
+                saturation.record(False)
+            continue
+        metrics.count(metrics.CLICKS)
+        sleep(WAIT_AFTER_CLICK)
+
+        after_state = take_snapshot(driver)
+        if alerts is not None:
+            after_state = alerts.intercept(after_state)
+        after_click = after_state.fingerprint
+        if after_click == item['fingerprint']:
+            metrics.count(metrics.NOOP_CLICKS)
+            events.emit(events.ACTION, screen=item['number'], button=button_name, outcome='no_change',
+                        worker=worker_id)
+            if saturation is not None:
+                saturation.record(False)
+            continue
+
+        template, admitted = templates.admit(after_state) if templates is not None else (None, True)
+        after_path = item['path'] + [dict(action_from_button(button), fingerprint=after_click)]
+        if not admitted:
+            events.emit(events.ACTION, screen=item['number'], button=button_name, outcome='template_capped',
+                        worker=worker_id)
+            number = None
+        else:
+            number = frontier.publish(
+                after_click, level + 1, after_path, worker_id=worker_id, explore=level + 1 < MAX_DEPTH
+            )
+            events.emit(events.ACTION, screen=item['number'], button=button_name,
+                        outcome='new_screen' if number is not None else 'known_screen', worker=worker_id)
+        if saturation is not None:
+            saturation.record(number is not None)
+        if number is not None:
+            metrics.count(metrics.SCREENS_DISCOVERED)
+            safe_button_name = ''.join(c if c.isalnum() else '_' for c in button_name)[:20]
+            screenshot_path = os.path.join(
+                path, f"{app_info['name']}_{level+1}_{number}_{safe_button_name}.png"
+            )
+            save_screenshot(driver, screenshot_path, {
+                'kind': 'screen', 'screen': number, 'level': level + 1,
+                'parent': item['number'], 'action': button_name,
+                'template': template.id if template is not None else None
+            }, state=after_state)
+            logging.info(f"[{worker_id}] Discovered screen {number}, saved {screenshot_path}")
+            text_index.record_screen(app_info['name'], screenshot_path, after_state, level + 1, after_path)
+            events.emit(events.SCREEN_DISCOVERED, screen=number, level=level + 1,
+                        fingerprint=format(after_click, '016x'), parent=item['number'],
+                        action=button_name, screenshot=screenshot_path, worker=worker_id)
+
+        # Go back, or restore the screen if back navigation does not return here
+        if try_go_back(driver, app_info):
+            current = screen_fingerprint(driver)
+            if current != item['fingerprint'] and alerts is not None:
+                current = alerts.intercept().fingerprint
+            if current == item['fingerprint']:
+                continue
+        metrics.count(metrics.BACK_FAILURES)
+        if restorer is not None:
+            if not restorer.restore(item['fingerprint'], item['path']):
+                return False
+        elif _reach(driver, app_info, item) is None:
+            return False
+    return True
+
+def crawl_worker(driver, app_info, frontier, path, worker_id, max_per_level=None, templates=None,
+                 saturation=None):
+    """
+    Claim and explore screens until the shared frontier is exhausted
+
+    Args:
+        driver: Appium driver of this worker's device
+        app_info: App information dictionary
+        frontier: CrawlFrontier shared with the other workers
+        path: Path to save screenshots
+        worker_id: Name of this worker
+        templates: Optional TemplateClusters shared by the workers
+        saturation: Optional DiscoveryTracker shared by the workers
+
+    Returns:
+        Number of screens this worker explored
+    """
+    # Whoever gets here first publishes the root screen
+    restart_app(driver, app_info)
+    alerts = AlertInterceptor(driver, app_info)
+    root_state = alerts.intercept(take_snapshot(driver))
+    root = root_state.fingerprint
+    template = templates.admit(root_state)[0] if templates is not None else None
+    number = frontier.publish(root, 0, [], worker_id=worker_id, explore=MAX_DEPTH > 0)
+    restorer = ScreenRestorer(driver, app_info, root_fingerprint=root)
+    if number is not None:
+        metrics.count(metrics.SCREENS_DISCOVERED)
+        screenshot_path = os.path.join(path, f"{app_info['name']}_0_{number}.png")
+        save_screenshot(driver, screenshot_path, {
+            'kind': 'screen', 'screen': number, 'level': 0, 'parent': None, 'action': None,
+            'template': template.id if template is not None else None
+        }, state=root_state)
+        logging.info(f"[{worker_id}] Saved root screenshot to {screenshot_path}")
+        text_index.record_screen(app_info['name'], screenshot_path, root_state, 0, [])
+        events.emit(events.SCREEN_DISCOVERED, screen=number, level=0, fingerprint=format(root, '016x'),
+                    parent=None, action=None, screenshot=screenshot_path, worker=worker_id)
+    root_state.release_elements()
+
+    explored = 0
+    while True:
+        if saturation is not None and saturation.stopped:
+            logging.info(f"[{worker_id}] Discovery saturated, leaving the rest of the frontier")
+            break
+        item = frontier.claim(worker_id)
+        if item is None:
+            if not frontier.has_work_in_progress():
+                break
+            sleep(FRONTIER_POLL_INTERVAL)
+            continue
+
+        logging.info(f"[{worker_id}] Exploring screen {item['number']} at level {item['level']}")
+        try:
+            done = explore_claimed_screen(driver, app_info, frontier, item, path, worker_id, max_per_level, restorer,
+                                          templates, saturation, alerts)
+        except Exception as e:
+            logging.error(f"[{worker_id}] Error exploring screen {item['number']}: {e}")
+            events.emit(events.ERROR, screen=item['number'], message=str(e), worker=worker_id)
+            done = False
+        if done:
+            frontier.complete(item['fingerprint'])
+            explored += 1
+        else:
+            frontier.release(item['fingerprint'])
+
+    logging.info(f"[{worker_id}] Frontier exhausted after exploring {explored} screens")
+    logging.info(f"[{worker_id}] Restoration cost: {restorer.report()}")
+    logging.info(f"[{worker_id}] Alerts: {alerts.report()}")
+    frontier.close()
+    return explored
+
+def run_workers(drivers, app_info, frontier, path, max_per_level=None):
+    """
+    Run one crawl worker per driver against a shared frontier
+
+    Args:
+        drivers: Dictionary of worker name -> driver
+        app_info: App information dictionary
+        frontier: CrawlFrontier
+        path: Path to save screenshots
+
+    Returns:
+        Dictionary of worker name -> number of screens explored
+    """
+    results = {}
+    templates = TemplateClusters()
+    saturation = DiscoveryTracker()
+
+    def work(worker_id, driver):
+        results[worker_id] = crawl_worker(driver, app_info, frontier, path, worker_id, max_per_level, templates,
+                                          saturation)
+
+    threads = [threading.Thread(target=work, args=(worker_id, driver), name=worker_id)
+               for worker_id, driver in drivers.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logging.info(f"Shared crawl finished: {frontier.stats()}")
+    logging.info(f"Screen templates: {templates.report()}")
+    logging.info(f"Discovery: {saturation.report()}")
+    return results
+
+def run_shared_crawl(app_info, udids=None, path=None, fresh=False):
+    """
+    Crawl one app cooperatively on several devices
+
+    Args:
+        app_info: App information dictionary
+        udids: Device UDIDs, defaults to DEVICE_UDIDS
+        path: Screenshot directory, defaults to the app's folder
+        fresh: Empty the folder's frontier first instead of joining or
+            continuing the crawl recorded in it
+
+    Returns:
+        Dictionary of device UDID -> number of screens explored
+    """
+    from ios_app_explorer.driver import create_driver, add_command_listener
+    from ios_app_explorer.screenshot import create_folders
+
+    path = path or create_folders(app_info)
+    metrics.set_current_app(app_info['name'])
+    events.start_app(app_info['name'])
+    if TEXT_INDEX_PATH:
+        text_index.open_index(TEXT_INDEX_PATH)
+    udids = udids or DEVICE_UDIDS
+    frontier = CrawlFrontier(os.path.join(path, 'frontier.sqlite'), fresh=fresh)
+    stats = frontier.stats()
+    if stats and not frontier.has_work_in_progress():
+        logging.warning(f"The crawl in {path} is finished ({stats}); pass --fresh to crawl the app again")
+    elif stats:
+        logging.info(f"Joining the shared crawl: {stats}")
+
+    drivers = {}
+    for i, udid in enumerate(udids):
+        driver = create_driver(app_info, udid=udid, wda_port=WDA_PORT + i)
+        if driver:
+            add_command_listener(driver, metrics.observe_command)
+            drivers[udid] = driver
+        else:
+            logging.error(f"Skipping device {udid}")
+    try:
+        results = run_workers(drivers, app_info, frontier, path)
+        events.finish_app(explored=results, frontier=frontier.stats())
+        return results
+    finally:
+        for driver in drivers.values():
+            driver.quit()
+        close_backends()
+        text_index.close_index()
+
+def main():
+    """
+    Command line entry point for a shared multi-device crawl
+    """
+    from ios_app_explorer.logger import setup_logging
+
+    parser = argparse.ArgumentParser(description="Crawl one app on several devices with a shared frontier")
+    parser.add_argument('app', help="App name from APP_LIST")
+    parser.add_argument('--udid', action='append', help="Device UDID (repeat for each device)")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="Serve live Prometheus metrics on this port")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Empty the frontier of a previous crawl instead of joining or continuing it")
+    args = parser.parse_args()
+
+    setup_logging(args.app)
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+    app_info = next((a for a in APP_LIST if a['name'] == args.app), None)
+    if app_info is None:
+        logging.error(f"App {args.app} is not in APP_LIST")
+        return
+    run_shared_crawl(app_info, udids=args.udid, fresh=args.fresh)
+
+if __name__ == '__main__':
+    main()
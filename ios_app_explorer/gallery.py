@@ -0,0 +1,346 @@
+"""
+Static HTML gallery of an exploration run
+"""
+import io
+import os
+import re
+import json
+import html
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from ios_app_explorer.config import SCREENSHOT_DIR, GALLERY_THUMB_WIDTH
+from ios_app_explorer.logger import setup_logging
+from ios_app_explorer.output import MANIFEST_NAME
+from ios_app_explorer.pack import PackReader, PACK_NAME
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+GALLERY_DIR = 'gallery'
+THUMB_DIR = 'thumbs'
+STATE_NAME = 'state.json'
+
+# Pack reader of the worker process, opened on first use
+_reader = None
+
+def _parse_filename(app_name, name):
+    """
+    Recover what a screenshot shows from its file name, for runs without a manifest
+    """
+    prefix = re.escape(app_name)
+    match = re.fullmatch(prefix + r'_(\d+)_(\d+)_scroll_(\d+)\.png', name)
+    if match:
+        return {'kind': 'scroll', 'screen': int(match.group(2)), 'index': int(match.group(3))}
+    match = re.fullmatch(prefix + r'_(\d+)_(\d+)(?:_(.*))?\.png', name)
+    if match:
+        return {'kind': 'screen', 'level': int(match.group(1)), 'screen': int(match.group(2)),
+                'parent': None, 'action': match.group(3)}
+    match = re.fullmatch(prefix + r'_(initial|back)\.png', name)
+    if match:
+        return {'kind': match.group(1)}
+    return {'kind': 'other'}
+
+def load_entries(app_dir):
+    """
+    List the screenshots of an app with what each of them shows
+
+    Screenshots come from the app's pack if it has one, otherwise from its PNG
+    files. Metadata comes from the manifest, or from the file names for runs
+    that predate it.
+
+    Args:
+        app_dir: Screenshot directory of the app
+
+    Returns:
+        Tuple of (list of entry dictionaries, whether the screenshots are packed)
+    """
+    app_name = os.path.basename(os.path.normpath(app_dir))
+    packed = os.path.exists(os.path.join(app_dir, PACK_NAME))
+    if packed:
+        with PackReader(app_dir) as reader:
+            keys = {name: entry['sha256'] for name, entry in reader.entries.items()}
+    else:
+        keys = {}
+        with os.scandir(app_dir) as it:
+            for item in it:
+                if item.is_file() and item.name.lower().endswith('.png'):
+                    stat = item.stat()
+                    keys[item.name] = f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    manifest = {}
+    manifest_path = os.path.join(app_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                manifest[record['name']] = record
+
+    entries = []
+    for name in sorted(keys):
+        entry = dict(manifest.get(name) or _parse_filename(app_name, name))
+        entry['name'] = name
+        entry['key'] = keys[name]
+        entries.append(entry)
+    return entries, packed
+
+def _thumb_name(name):
+    return os.path.splitext(name)[0] + '.jpg'
+
+def _make_thumbnail(task):
+    """
+    Write one JPEG thumbnail (runs in a worker process)
+
+    Returns:
+        Tuple of (name, (width, height)) or (name, None) on failure
+    """
+    global _reader
+    app_dir, name, thumb_path, width, packed = task
+    try:
+        if packed:
+            if _reader is None or _reader.directory != app_dir:
+                _reader = PackReader(app_dir)
+            source = io.BytesIO(_reader.read(name))
+        else:
+            source = os.path.join(app_dir, name)
+        with Image.open(source) as img:
+            img.thumbnail((width, width * 4), Image.Resampling.BILINEAR)
+            img = img.convert('RGB')
+            img.save(thumb_path, 'JPEG', quality=70)
+            return name, img.size
+    except Exception as e:
+        logging.error(f"Failed to make thumbnail for {name}: {e}")
+        return name, None
+
+def _card(entry, packed, label):
+    name = html.escape(entry['name'])
+    thumb = html.escape(f"{THUMB_DIR}/{_thumb_name(entry['name'])}")
+    size = entry.get('thumb_size') or (None, None)
+    dimensions = f' width="{size[0]}" height="{size[1]}"' if size[0] else ''
+    target = thumb if packed else html.escape(f"../{entry['name']}")
+    return (
+        f'<figure><a href="{target}"><img loading="lazy" decoding="async" src="{thumb}"{dimensions} '
+        f'alt="{name}"></a><figcaption>{html.escape(label)}</figcaption></figure>'
+    )
+
+STYLE = '''
+body { font-family: -apple-system, sans-serif; margin: 1em 2em; }
+.row { display: flex; flex-wrap: wrap; gap: 12px; align-items: flex-start; }
+.screen { border: 1px solid #ddd; padding: 6px; border-radius: 6px; }
+.scrolls { display: flex; gap: 4px; }
+.scrolls img { opacity: 0.85; }
+figure { margin: 0; font-size: 12px; max-width: 260px; overflow-wrap: anywhere; }
+ul.tree { font-size: 13px; }
+'''
+
+def _tree(f, children, actions, screen):
+    f.write('<ul class="tree">')
+    for child in children.get(screen, []):
+        action = actions.get(child) or ''
+        f.write(f'<li><a href="#screen-{child}">screen {child}</a> {html.escape(action)}')
+        if child in children:
+            _tree(f, children, actions, child)
+        f.write('</li>')
+    f.write('</ul>')
+
+def write_gallery(app_dir, entries, packed):
+    """
+    Write the gallery page and navigation graph of an app
+
+    Args:
+        app_dir: Screenshot directory of the app
+        entries: Entries from load_entries, with thumbnail sizes
+        packed: Whether the screenshots are in a pack
+
+    Returns:
+        Path of the gallery page
+    """
+    gallery_dir = os.path.join(app_dir, GALLERY_DIR)
+    app_name = os.path.basename(os.path.normpath(app_dir))
+    screens = {}
+    scrolls = {}
+    extras = []
+    for entry in entries:
+        if entry['kind'] == 'screen' and entry.get('screen') is not None:
+            screens[entry['screen']] = entry
+        elif entry['kind'] == 'scroll':
+            scrolls.setdefault(entry.get('screen'), []).append(entry)
+        else:
+            extras.append(entry)
+
+    children = {}
+    actions = {}
+    for number, entry in sorted(screens.items()):
+        children.setdefault(entry.get('parent'), []).append(number)
+        actions[number] = entry.get('action')
+
+    with open(os.path.join(gallery_dir, 'graph.dot'), 'w') as f:
+        f.write(f'digraph "{app_name}" {{\n')
+        for number, entry in sorted(screens.items()):
+            f.write(f'  s{number} [label="{number} (level {entry.get("level")})"];\n')
+            if entry.get('parent') is not None:
+                label = (entry.get('action') or '').replace('"', "'")
+                f.write(f'  s{entry["parent"]} -> s{number} [label="{label}"];\n')
+        f.write('}\n')
+
+    page_path = os.path.join(gallery_dir, 'index.html')
+    with open(page_path, 'w') as f:
+        f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(app_name)}</title>'
+                f'<style>{STYLE}</style></head><body>')
+        f.write(f'<h1>{html.escape(app_name)}</h1><p>{len(screens)} screens, '
+                f'{sum(len(s) for s in scrolls.values())} scroll captures, {len(entries)} screenshots</p>')
+
+        if extras:
+            f.write('<h2>Launch and flows</h2><div class="row">')
+            for entry in extras:
+                f.write(_card(entry, packed, entry.get('step') or entry['name']))
+            f.write('</div>')
+
+        f.write('<h2>Navigation</h2>')
+        for root in children.get(None, []):
+            f.write(f'<a href="#screen-{root}">screen {root}</a>')
+            _tree(f, children, actions, root)
+
+        by_level = {}
+        for number, entry in sorted(screens.items()):
+            by_level.setdefault(entry.get('level') or 0, []).append(entry)
+        for level, level_screens in sorted(by_level.items()):
+            f.write(f'<h2>Level {level}</h2>')
+            by_parent = {}
+            for entry in level_screens:
+                by_parent.setdefault(entry.get('parent'), []).append(entry)
+            for parent, group in by_parent.items():
+                if parent is not None:
+                    f.write(f'<h3>From <a href="#screen-{parent}">screen {parent}</a></h3>')
+                f.write('<div class="row">')
+                for entry in group:
+                    f.write(f'<div class="screen" id="screen-{entry["screen"]}">')
+                    f.write(_card(entry, packed, f"{entry['screen']}: {entry.get('action') or 'root'}"))
+                    sequence = sorted(scrolls.get(entry['screen'], []), key=lambda e: e.get('index', 0))
+                    if sequence:
+                        f.write('<div class="scrolls">')
+                        for frame in sequence:
+                            f.write(_card(frame, packed, f"scroll {frame.get('index')}"))
+                        f.write('</div>')
+                    f.write('</div>')
+                f.write('</div>')
+        f.write('</body></html>')
+    return page_path
+
+def build_gallery(app_dir, workers=None, width=GALLERY_THUMB_WIDTH, pool=None):
+    """
+    Build or update the gallery of one app
+
+    Only screenshots that are new or changed since the last build get a new
+    thumbnail; the page itself is rewritten every time. Images are decoded one
+    at a time per worker, so memory does not grow with the number of screenshots.
+
+    Args:
+        app_dir: Screenshot directory of the app
+        workers: Number of worker processes (defaults to the CPU count)
+        width: Thumbnail width in pixels
+        pool: Optional process pool to reuse
+
+    Returns:
+        Path of the gallery page, or None if pillow is missing
+    """
+    if Image is None:
+        logging.error("The gallery requires pillow (pip install 'iphone-screenshooter[gallery]')")
+        return None
+
+    gallery_dir = os.path.join(app_dir, GALLERY_DIR)
+    thumb_dir = os.path.join(gallery_dir, THUMB_DIR)
+    os.makedirs(thumb_dir, exist_ok=True)
+
+    state_path = os.path.join(gallery_dir, STATE_NAME)
+    state = {'width': width, 'thumbs': {}}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            previous = json.load(f)
+        if previous.get('width') == width:
+            state = previous
+
+    entries, packed = load_entries(app_dir)
+    thumbs = state['thumbs']
+    tasks = [
+        (app_dir, entry['name'], os.path.join(thumb_dir, _thumb_name(entry['name'])), width, packed)
+        for entry in entries
+        if thumbs.get(entry['name'], {}).get('key') != entry['key']
+        or not os.path.exists(os.path.join(thumb_dir, _thumb_name(entry['name'])))
+    ]
+    logging.info(f"{app_dir}: {len(entries)} screenshots, {len(tasks)} new thumbnails")
+
+    if tasks:
+        keys = {entry['name']: entry['key'] for entry in entries}
+        own_pool = pool is None
+        pool = pool or ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        try:
+            for name, size in pool.map(_make_thumbnail, tasks, chunksize=32):
+                if size is not None:
+                    thumbs[name] = {'key': keys[name], 'size': size}
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    for entry in entries:
+        entry['thumb_size'] = thumbs.get(entry['name'], {}).get('size')
+    page_path = write_gallery(app_dir, entries, packed)
+
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+    logging.info(f"Gallery written to {page_path}")
+    return page_path
+
+def build_galleries(run_dir=SCREENSHOT_DIR, apps=None, workers=None, width=GALLERY_THUMB_WIDTH):
+    """
+    Build the gallery of every app in a run, plus an index page linking them
+
+    Args:
+        run_dir: Root screenshot directory of the run
+        apps: Optional list of app names to limit the build to
+        workers: Number of worker processes
+        width: Thumbnail width in pixels
+
+    Returns:
+        Dictionary of app name -> gallery page path
+    """
+    app_names = sorted(
+        name for name in os.listdir(run_dir)
+        if os.path.isdir(os.path.join(run_dir, name)) and (not apps or name in apps)
+    )
+    pages = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for name in app_names:
+            page = build_gallery(os.path.join(run_dir, name), width=width, pool=pool)
+            if page:
+                pages[name] = page
+
+    with open(os.path.join(run_dir, 'index.html'), 'w') as f:
+        f.write('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Screenshots</title></head><body><ul>')
+        for name, page in pages.items():
+            f.write(f'<li><a href="{html.escape(os.path.relpath(page, run_dir))}">{html.escape(name)}</a></li>')
+        f.write('</ul></body></html>')
+    return pages
+
+def main():
+    """
+    Command line entry point for building galleries
+    """
+    parser = argparse.ArgumentParser(description="Build static HTML galleries of a run")
+    parser.add_argument('run_dir', nargs='?', default=SCREENSHOT_DIR, help="Root screenshot directory")
+    parser.add_argument('--app', action='append', help="Only build this app (repeatable)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Worker processes")
+    parser.add_argument('--width', type=int, default=GALLERY_THUMB_WIDTH, help="Thumbnail width")
+    args = parser.parse_args()
+
+    setup_logging('gallery')
+    build_galleries(args.run_dir, apps=args.app, workers=args.workers, width=args.width)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Capturing known screens in other languages by replaying a finished crawl
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from ios_app_explorer import events, metrics, text_index
+from ios_app_explorer.config import (
+    APP_LIST, DEVICE_UDID, SCREENSHOT_DIR, TEXT_INDEX_PATH, WAIT_AFTER_CLICK, WAIT_AFTER_LAUNCH,
+    CAPTURE_LOCALES, LOCALE_MATCH_SIMILARITY
+)
+from ios_app_explorer.alerts import AlertInterceptor
+from ios_app_explorer.driver import create_driver, add_command_listener
+from ios_app_explorer.logger import setup_logging
+from ios_app_explorer.navigation import replay_action, try_go_back, restart_app
+from ios_app_explorer.output import MANIFEST_NAME, save_screenshot, close_backends
+from ios_app_explorer.profiling import sleep, phase
+from ios_app_explorer.scroll_utils import capture_scrolled_screenshots
+from ios_app_explorer.screenshot import create_folders
+from ios_app_explorer.snapshot import take_snapshot
+from ios_app_explorer.templates import structure_features, similarity
+
+def locale_arguments(locale):
+    """
+    Launch arguments that run an app in a language and region
+
+    Args:
+        locale: Locale identifier such as 'de_DE' or 'ja'
+
+    Returns:
+        List of process arguments
+    """
+    arguments = ['-AppleLanguages', f"({locale.replace('_', '-')})"]
+    if '_' in locale:
+        arguments += ['-AppleLocale', locale]
+    return arguments
+
+def launch_in_locale(driver, app_info, locale):
+    """
+    Relaunch the app in a locale; the device's own language is left alone
+
+    Args:
+        driver: Appium driver
+        app_info: App information dictionary
+        locale: Locale identifier such as 'de_DE'
+    """
+    metrics.count(metrics.RESTARTS)
+    with phase('restarts'):
+        driver.terminate_app(app_info['bundleId'])
+        sleep(1)
+        driver.execute_script('mobile: launchApp', {
+            'bundleId': app_info['bundleId'], 'arguments': locale_arguments(locale)
+        })
+        sleep(WAIT_AFTER_LAUNCH)
+
+def _action_key(action):
+    return json.dumps({k: v for k, v in action.items() if k != 'fingerprint'}, sort_keys=True)
+
+def load_crawl(index, app_name):
+    """
+    Load the screens of an app's crawl that were recorded with their action paths
+
+    Args:
+        index: TextIndex the crawl recorded into
+        app_name: App name
+
+    Returns:
+        List of dictionaries with screenshot, level, path, keys (the path as a
+        tuple of action keys) and the structure features of the recorded tree,
+        ordered depth-first by action path
+    """
+    screens = {}
+    for screen in index.recorded_paths(app_name):
+        keys = tuple(_action_key(action) for action in screen['path'])
+        tree = index.load_tree(screen['fingerprint'])
+        # A later run replaces the screen an earlier one reached by the same path
+        screens[keys] = dict(screen, keys=keys, features=structure_features(tree) if tree else None)
+    return [screens[keys] for keys in sorted(screens)]
+
+def _load_manifest(directory):
+    manifest = {}
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                manifest[record.pop('name')] = record
+    return manifest
+
+class LocaleReplay:
+    """
+    Replays a recorded crawl under one locale and captures every screen again
+
+    Screens are visited depth-first in action path order, so the next screen is
+    usually one tap away, or a few back navigations and a tap; the app is only
+    relaunched and the whole path replayed when that does not work. Texts
+    change with the language, so actions are matched by element type,
+    accessibility identifier and position, and a screen counts as reached when
+    its tree has the structure of the recorded one.
+    """
+
+    def __init__(self, driver, app_info, locale, path, threshold=LOCALE_MATCH_SIMILARITY):
+        self.driver = driver
+        self.app_info = app_info
+        self.locale = locale
+        self.path = path
+        self.threshold = threshold
+        self.app_name = f"{app_info['name']}_{locale}"
+        self.alerts = AlertInterceptor(driver, app_info)
+        self.current = None
+        self.fingerprints = {}
+        self.stats = {'captured': 0, 'failed': 0, 'relaunches': 0, 'backs': 0, 'taps': 0}
+
+    def _state(self):
+        return self.alerts.intercept(take_snapshot(self.driver))
+
+    def _matches(self, state, screen):
+        if screen['keys'] and self.fingerprints.get(screen['keys'][:-1]) == state.fingerprint:
+            # The last tap did not leave the parent screen
+            return False
+        if screen['features'] is None:
+            return True
+        return similarity(structure_features(state.elements), screen['features']) >= self.threshold
+
+    def _replay(self, actions):
+        for action in actions:
+            if not replay_action(self.driver, action, match_text=False):
+                return False
+            self.stats['taps'] += 1
+            sleep(WAIT_AFTER_CLICK)
+        return True
+
+    def launch(self):
+        """
+        Relaunch the app in the locale, on its root screen
+        """
+        launch_in_locale(self.driver, self.app_info, self.locale)
+        self.stats['relaunches'] += 1
+        self.current = ()
+
+    def _from_current(self, screen, screens):
+        """
+        Reach a screen from the one on display by going back to their common
+        ancestor and replaying the rest of the path
+        """
+        keys = screen['keys']
+        common = 0
+        while common < min(len(keys), len(self.current)) and keys[common] == self.current[common]:
+            common += 1
+        for _ in range(len(self.current) - common):
+            self.stats['backs'] += 1
+            with phase('back_navigation'):
+                if not try_go_back(self.driver, self.app_info):
+                    return None
+        ancestor = screens.get(keys[:common])
+        if common < len(self.current) and ancestor is not None and not self._matches(self._state(), ancestor):
+            return None
+        if not self._replay(screen['path'][common:]):
+            return None
+        state = self._state()
+        return state if self._matches(state, screen) else None
+
+    def reach(self, screen, screens):
+        """
+        Bring the app to a recorded screen
+
+        Args:
+            screen: Screen dictionary from load_crawl
+            screens: Dictionary of action keys -> screen, for checking ancestors
+
+        Returns:
+            ScreenState of the screen, or None if it could not be reached
+        """
+        if self.current is not None:
+            state = self._from_current(screen, screens)
+            if state is not None:
+                return state
+        self.launch()
+        if self._replay(screen['path']):
+            state = self._state()
+            if self._matches(state, screen):
+                return state
+        return None
+
+    def capture(self, screen, screens, manifest):
+        """
+        Reach a recorded screen and capture it, and its scroll sequence if the
+        crawl took one, under the same file names
+
+        Args:
+            screen: Screen dictionary from load_crawl
+            screens: Dictionary of action keys -> screen
+            manifest: Manifest records of the recorded crawl, by file name
+
+        Returns:
+            Boolean indicating if the screen was captured
+        """
+        name = os.path.basename(screen['screenshot'])
+        state = self.reach(screen, screens)
+        if state is None:
+            self.current = None
+            self.stats['failed'] += 1
+            logging.warning(f"[{self.locale}] Could not reach {name}")
+            return False
+        self.current = screen['keys']
+        self.fingerprints[screen['keys']] = state.fingerprint
+        screenshot_path = os.path.join(self.path, name)
+        metadata = dict(manifest.get(name) or {'kind': 'screen', 'level': screen['level']})
+        metadata.pop('time', None)
+        save_screenshot(self.driver, screenshot_path, dict(metadata, locale=self.locale), state=state)
+        text_index.record_screen(self.app_name, screenshot_path, state, screen['level'], screen['path'])
+        base_name = f"{self.app_info['name']}_{screen['level']}_{metadata.get('screen')}"
+        if f"{base_name}_scroll_0.png" in manifest:
+            # The crawl scrolled this screen; capture the same sequence
+            with phase('scroll_capture'):
+                capture_scrolled_screenshots(self.driver, self.app_info, self.path, base_name,
+                                             state=state, screen=metadata.get('screen'))
+        self.stats['captured'] += 1
+        logging.info(f"[{self.locale}] Captured {name}")
+        return True
+
+def capture_locales(app_info, locales, udid=None):
+    """
+    Capture the screens of an app's last crawl again in other locales
+
+    The crawl must have run with the text index on, which records the action
+    path and tree of every screen. Each locale is written to its own folder,
+    <app>_<locale>, with the file names of the crawl.
+
+    Args:
+        app_info: App information dictionary
+        locales: Locale identifiers such as 'de_DE'
+        udid: Device UDID, defaults to DEVICE_UDID
+
+    Returns:
+        Dictionary of locale -> replay stats
+    """
+    if not TEXT_INDEX_PATH or not os.path.exists(TEXT_INDEX_PATH):
+        logging.error(f"No text index at {TEXT_INDEX_PATH}; crawl the app with the index on first")
+        return {}
+    index = text_index.open_index(TEXT_INDEX_PATH)
+    results = {}
+    driver = None
+    try:
+        crawl = load_crawl(index, app_info['name'])
+        if not crawl:
+            logging.error(f"No recorded crawl of {app_info['name']} in {TEXT_INDEX_PATH}")
+            return results
+        screens = {screen['keys']: screen for screen in crawl}
+        manifest = _load_manifest(os.path.join(SCREENSHOT_DIR, app_info['name']))
+        driver = create_driver(app_info, udid=udid or DEVICE_UDID)
+        if not driver:
+            return results
+        add_command_listener(driver, metrics.observe_command)
+
+        for locale in locales:
+            locale_app = f"{app_info['name']}_{locale}"
+            path = create_folders({'name': locale_app})
+            metrics.set_current_app(locale_app)
+            events.start_app(locale_app)
+            start_time = time.time()
+            replay = LocaleReplay(driver, app_info, locale, path)
+            replay.launch()
+            for screen in crawl:
+                replay.capture(screen, screens, manifest)
+            close_backends()
+            elapsed = time.time() - start_time
+            logging.info(f"[{locale}] Captured {replay.stats['captured']} of {len(crawl)} screens "
+                         f"in {elapsed:.1f} seconds: {replay.stats}")
+            events.finish_app(seconds=round(elapsed, 1), **replay.stats)
+            results[locale] = replay.stats
+        # Leave the app in the device's language
+        restart_app(driver, app_info)
+    finally:
+        if driver:
+            driver.quit()
+        close_backends()
+        text_index.close_index()
+    return results
+
+def main():
+    """
+    Command line entry point for capturing an app in other locales
+    """
+    parser = argparse.ArgumentParser(description="Capture a crawled app again in other languages")
+    parser.add_argument('app', help="App name from APP_LIST")
+    parser.add_argument('--locale', action='append',
+                        help="Locale such as de_DE (repeatable); defaults to the app's 'locales' or CAPTURE_LOCALES")
+    parser.add_argument('--udid', help="Device UDID")
+    args = parser.parse_args()
+
+    setup_logging(f"{args.app}_locales")
+    app_info = next((a for a in APP_LIST if a['name'] == args.app), None)
+    if app_info is None:
+        logging.error(f"App {args.app} is not in APP_LIST")
+        return
+    locales = args.locale or app_info.get('locales') or CAPTURE_LOCALES
+    if not locales:
+        logging.error("No locales given")
+        return
+    capture_locales(app_info, locales, udid=args.udid)
+
+if __name__ == '__main__':
+    main()
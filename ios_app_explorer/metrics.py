@@ -0,0 +1,193 @@
+"""
+Live crawl metrics served in the Prometheus text format
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds for device commands
+COMMAND_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every metric registers itself here on creation
+REGISTRY = []
+
+# App the crawl is currently exploring, used as the 'app' label of the counters
+_current_app = ''
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + '}'
+
+class _Metric:
+    """
+    Base for metrics with optional labels
+
+    Updates take one lock and touch one dictionary entry, so they are cheap
+    enough to call from the device loop.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items
+        ]
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items
+        ]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=COMMAND_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames + ('le',), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+SCREENS_DISCOVERED = Counter('explorer_screens_discovered_total', "New screens discovered", ['app'])
+CLICKS = Counter('explorer_clicks_total', "Clicks performed", ['app'])
+NOOP_CLICKS = Counter('explorer_noop_clicks_total', "Clicks that did not change the screen", ['app'])
+RESTARTS = Counter('explorer_restarts_total', "App restarts", ['app'])
+BACK_FAILURES = Counter('explorer_back_failures_total', "Back navigations that did not return", ['app'])
+ALERTS = Counter('explorer_alerts_total', "Alerts and popups handled", ['app'])
+SCREENSHOTS_WRITTEN = Counter('explorer_screenshots_written_total', "Screenshots written", ['app'])
+BYTES_WRITTEN = Counter('explorer_bytes_written_total', "Screenshot bytes written", ['app'])
+REDACTED_REGIONS = Counter('explorer_redacted_regions_total', "Screenshot regions redacted", ['app'])
+COMMAND_LATENCY = Histogram('explorer_command_duration_seconds', "Device command latency", ['command'])
+CURRENT_APP = Gauge('explorer_current_app', "App being explored (1 for the current app)", ['app'])
+CURRENT_LEVEL = Gauge('explorer_current_level', "Exploration depth of the current screen")
+
+def render():
+    """
+    Render every registered metric in the Prometheus text exposition format
+
+    Returns:
+        The exposition as a string
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def observe_command(command, seconds):
+    """
+    Command listener that records device command latency
+    """
+    COMMAND_LATENCY.observe(seconds, command=command)
+
+def count(counter, amount=1):
+    """
+    Increment a per-app counter for the app being explored
+    """
+    counter.inc(amount, app=_current_app)
+
+def set_current_app(app_name):
+    """
+    Mark the app being explored
+    """
+    global _current_app
+    _current_app = app_name
+    CURRENT_APP.clear()
+    CURRENT_APP.set(1, app=app_name)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serve /metrics on a background thread
+
+    Args:
+        port: Port to listen on
+        host: Interface to bind
+
+    Returns:
+        The running server
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -3,10 +3,19 @@ Navigation and screen exploration utilities
 """
 import os
 import logging
-from time import sleep
-from ios_app_explorer.element_utils import fetch_all_buttons, try_click_element
+from ios_app_explorer import events, metrics, text_index
+from ios_app_explorer.profiling import sleep, phase
+from ios_app_explorer.output import save_screenshot
+from ios_app_explorer.element_utils import (
+    discover_buttons, click_button, try_click_element, sample_equivalent_siblings
+)
 from ios_app_explorer.scroll_utils import capture_scrolled_screenshots
-from ios_app_explorer.config import MAX_DEPTH, MAX_BUTTONS_PER_LEVEL, WAIT_AFTER_CLICK
+from ios_app_explorer.snapshot import take_snapshot, screen_fingerprint, element_center
+from ios_app_explorer.templates import TemplateClusters
+from ios_app_explorer.saturation import DiscoveryTracker
+from ios_app_explorer.alerts import AlertInterceptor
+from ios_app_explorer.budget import expired
+from ios_app_explorer.config import MAX_DEPTH, MAX_BUTTONS_PER_LEVEL, WAIT_AFTER_CLICK, SATURATION_ACTION
 
 def try_go_back(driver, app_info):
     """
@@ -27,10 +36,10 @@ def try_go_back(driver, app_info):
         pass
     
     try:
-        close_buttons = fetch_all_buttons(driver)
-        close_buttons = [b for b in close_buttons.values() if b['is_close_button']]
+        close_buttons = discover_buttons(driver)
+        close_buttons = [b for b in close_buttons.values() if b.is_close_button]
         if close_buttons:
-            try_click_element(close_buttons[0]['btn'], driver)
+            click_button(driver, close_buttons[0])
             sleep(1)
             return True
     except Exception:
@@ -54,136 +63,325 @@ def try_go_back(driver, app_info):
     logging.warning("All back navigation methods failed")
     return False
 
-def navigate_and_capture_screenshots(driver, app_info, path, level=0, buttons=None, visited_screens=None, max_per_level=None):
+def select_buttons(buttons, max_per_level):
+    """
+    Choose which candidate buttons to click on a screen, in order
+
+    Tab items come first, then the other buttons with text and of button type.
+    Close buttons are left out, and of each group of equivalent siblings (the
+    rows of a list) only SIBLING_SAMPLE_SIZE are kept, so the rest of the
+    budget goes to distinct controls.
+
+    Args:
+        buttons: Dictionary of ButtonRecord
+        max_per_level: Maximum number of buttons to return
+
+    Returns:
+        List of ButtonRecord to try
+    """
+    # Filter for clickable buttons
+    clickable_buttons = [b for b in buttons.values() if b.enabled and b.clickable]
+    
+    # Separate tab buttons from other buttons
+    tab_buttons = [b for b in clickable_buttons if b.is_tab_item]
+    other_buttons = [b for b in clickable_buttons if not b.is_tab_item and not b.is_close_button]
+    
+    # Sort buttons by priority (buttons with text are more interesting)
+    def button_priority(btn):
+        has_text = bool(btn.text or btn.name or btn.label)
+        is_button_type = btn.type == 'XCUIElementTypeButton'
+        return (has_text, is_button_type)
+    
+    other_buttons.sort(key=button_priority, reverse=True)
+    
+    all_buttons = tab_buttons + other_buttons
+    
+    logging.info(f"Found {len(all_buttons)} clickable buttons ({len(tab_buttons)} tabs, {len(other_buttons)} other)")
+    
+    # Click only a sample of each group of equivalent siblings
+    all_buttons = sample_equivalent_siblings(all_buttons)
+    
+    # Limit the number of buttons to try
+    all_buttons = all_buttons[:max_per_level]
+    logging.info(f"Will try clicking on {len(all_buttons)} buttons")
+    return all_buttons
+
+def action_from_button(button):
+    """
+    Describe a click on a button so that it can be replayed later
+
+    Args:
+        button: ButtonRecord that was clicked
+
+    Returns:
+        JSON-serializable action dictionary
+    """
+    return {
+        'type': button.type,
+        'name': button.name,
+        'label': button.label,
+        'rect': list(button.rect) if button.rect else None,
+        'tab': button.is_tab_item
+    }
+
+def replay_action(driver, action, strict=False, match_text=True):
+    """
+    Perform a recorded action on the current screen
+
+    The element is matched in a fresh snapshot by type, name and label, taking
+    the one closest to the recorded position; if none matches, the recorded
+    position is tapped unless strict is set.
+
+    Args:
+        driver: Appium driver
+        action: Action dictionary from action_from_button
+        strict: Only tap an element that matches
+        match_text: Match labels too; turn off when replaying in another
+            language, where only the type and a real accessibility identifier
+            (a name other than the label) stay the same
+
+    Returns:
+        Boolean indicating if the action could be performed
+    """
+    state = take_snapshot(driver)
+    if match_text:
+        matches = [e for e in state.elements
+                   if e.visible and e.type == action['type']
+                   and e.name == action['name'] and e.label == action['label']]
+    else:
+        matches = [e for e in state.elements if e.visible and e.type == action['type']]
+        if action['name'] and action['name'] != action['label']:
+            matches = [e for e in matches if e.name == action['name']]
+    if matches:
+        rx, ry = 0, 0
+        if action['rect']:
+            x, y, width, height = action['rect']
+            rx, ry = x + width / 2, y + height / 2
+        target = min(matches, key=lambda e: abs(element_center(e)[0] - rx) + abs(element_center(e)[1] - ry))
+        position = element_center(target)
+    elif action['rect'] and not strict:
+        x, y, width, height = action['rect']
+        position = (x + width / 2, y + height / 2)
+    else:
+        return False
+    try:
+        driver.tap([position])
+        return True
+    except Exception as e:
+        logging.debug(f"Replaying action failed: {e}")
+        return False
+
+def replay_path(driver, app_info, actions, deadline=None):
+    """
+    Restart the app and replay a list of recorded actions to reach a screen
+
+    Args:
+        driver: Appium driver
+        app_info: App information dictionary
+        actions: List of action dictionaries from the app's root screen
+        deadline: Optional time.monotonic() value after which replaying stops
+
+    Returns:
+        Boolean indicating if every action could be performed
+    """
+    if expired(deadline) or not restart_app(driver, app_info):
+        return False
+    for action in actions:
+        if expired(deadline):
+            return False
+        if not replay_action(driver, action):
+            logging.warning(f"Could not replay action on {action['type']} '{action['name'] or action['label']}'")
+            return False
+        sleep(WAIT_AFTER_CLICK)
+    return True
+
+def navigate_and_capture_screenshots(driver, app_info, path, level=0, buttons=None, visited_screens=None,
+                                     max_per_level=None, screen_state=None, actions=None, restorer=None,
+                                     templates=None, saturation=None, deadline=None, alerts=None):
     """
     Navigate through the app and capture screenshots
     
+    Only screen fingerprints are kept across the recursion: each level holds
+    its own fingerprint and at most max_per_level candidate records, so memory
+    per visited screen stays bounded regardless of depth.
+    
     Args:
         driver: Appium driver
         app_info: App information dictionary
         path: Path to save screenshots
         level: Current exploration depth level
         buttons: Optional existing buttons dictionary
-        visited_screens: Set of visited screen signatures
+        visited_screens: Set of visited screen fingerprints
         max_per_level: Maximum number of buttons to try per level
+        screen_state: ScreenState of the current screen if the caller has
+            already recorded and captured it
+        actions: Action path from the root screen to the current screen
+        restorer: Optional ScreenRestorer used when back navigation fails;
+            without one the app is restarted and exploration of the screen stops
+        templates: TemplateClusters shared across the recursion; screens of a
+            template that already has its cap of screens are not captured or explored
+        saturation: DiscoveryTracker shared across the recursion; once clicks stop
+            finding new screens, the current subtree is left (or, with
+            SATURATION_ACTION 'app', exploration stops)
+        deadline: Optional time.monotonic() value at which exploration stops
+        alerts: AlertInterceptor that clears alerts and popups after every action
     """
     if max_per_level is None:
         max_per_level = MAX_BUTTONS_PER_LEVEL
         
     if visited_screens is None:
         visited_screens = set()
-    
-    # Generate a signature for the current screen to avoid revisiting
-    screen_signature = hash(driver.page_source)
-    if screen_signature in visited_screens:
-        logging.debug("Screen already visited, skipping")
+    if actions is None:
+        actions = []
+    if templates is None:
+        templates = TemplateClusters()
+    if saturation is None:
+        saturation = DiscoveryTracker()
+    if alerts is None:
+        alerts = AlertInterceptor(driver, app_info)
+    if expired(deadline):
         return
+    metrics.CURRENT_LEVEL.set(level)
     
-    visited_screens.add(screen_signature)
-    logging.info(f"Exploring screen {len(visited_screens)} at level {level}")
-    
-    # Take regular screenshot
-    screenshot_path = os.path.join(path, f"{app_info['name']}_{level}_{len(visited_screens)}.png")
-    driver.save_screenshot(screenshot_path)
-    logging.info(f"Saved screenshot to {screenshot_path}")
+    if screen_state is None:
+        # Fingerprint the current screen to avoid revisiting
+        with phase('element_discovery'):
+            screen_state = take_snapshot(driver)
+        screen_state = alerts.intercept(screen_state)
+        if screen_state.fingerprint in visited_screens:
+            logging.debug("Screen already visited, skipping")
+            return
+        
+        visited_screens.add(screen_state.fingerprint)
+        template, _ = templates.admit(screen_state)
+        metrics.count(metrics.SCREENS_DISCOVERED)
+        logging.info(f"Exploring screen {len(visited_screens)} at level {level}")
+        
+        # Take regular screenshot
+        screenshot_path = os.path.join(path, f"{app_info['name']}_{level}_{len(visited_screens)}.png")
+        save_screenshot(driver, screenshot_path, {
+            'kind': 'screen', 'screen': len(visited_screens), 'level': level, 'parent': None, 'action': None,
+            'template': template.id
+        }, state=screen_state)
+        logging.info(f"Saved screenshot to {screenshot_path}")
+        text_index.record_screen(app_info['name'], screenshot_path, screen_state, level, actions)
+        events.emit(events.SCREEN_DISCOVERED, screen=len(visited_screens), level=level,
+                    fingerprint=format(screen_state.fingerprint, '016x'), parent=None, action=None,
+                    screenshot=screenshot_path)
     
     # Take scrolled screenshots if the screen is scrollable
-    base_name = f"{app_info['name']}_{level}_{len(visited_screens)}"
-    capture_scrolled_screenshots(driver, app_info, path, base_name)
+    screen_number = len(visited_screens)
+    base_name = f"{app_info['name']}_{level}_{screen_number}"
+    with phase('scroll_capture'):
+        capture_scrolled_screenshots(driver, app_info, path, base_name, state=screen_state, screen=screen_number)
     
     # Check if we've reached the maximum depth
     if level >= MAX_DEPTH:
         logging.debug(f"Reached maximum depth level {level}, stopping exploration")
+        screen_state.release_elements()
         return
     
     # Find all clickable elements on the screen
-    driver.implicitly_wait(3)
     logging.debug("Fetching all buttons on screen")
-    buttons = fetch_all_buttons(driver=driver, buttons=None, level=level)
-    
-    # Filter for clickable buttons
-    clickable_buttons = [b for b in buttons.values() 
-                        if b['enabled'] and b['visible'] and b['clickable']]
-    
-    # Separate tab buttons from other buttons
-    tab_buttons = [b for b in clickable_buttons if b.get('is_tab_item', False)]
-    other_buttons = [b for b in clickable_buttons 
-                    if not b.get('is_tab_item', False) and not b['is_close_button']]
-    
-    all_buttons = tab_buttons + other_buttons
+    with phase('element_discovery'):
+        driver.implicitly_wait(3)
+        buttons = discover_buttons(driver, state=screen_state, level=level)
+    screen_fingerprint_at_entry = screen_state.fingerprint
+    if restorer is not None and level == 0 and restorer.root_fingerprint is None:
+        restorer.root_fingerprint = screen_fingerprint_at_entry
+    screen_state.release_elements()
     
-    logging.info(f"Found {len(all_buttons)} clickable buttons ({len(tab_buttons)} tabs, {len(other_buttons)} other)")
-    
-    # Sort buttons by priority (buttons with text are more interesting)
-    def button_priority(btn):
-        has_text = bool(btn['text'] or btn['name'] or btn['label'])
-        is_button_type = btn['type'] == 'XCUIElementTypeButton'
-        return (has_text, is_button_type)
+    all_buttons = select_buttons(buttons, max_per_level)
+    max_buttons_to_try = len(all_buttons)
+    del buttons
     
-    other_buttons.sort(key=button_priority, reverse=True)
-    
-    # Limit the number of buttons to try
-    max_buttons_to_try = min(max_per_level, len(all_buttons))
-    logging.info(f"Will try clicking on {max_buttons_to_try} buttons")
+    # Fingerprint of the screen right before the next click, reused after a
+    # successful return so that each click costs one source fetch less
+    current_fingerprint = screen_fingerprint_at_entry
     
     # Try clicking each button and explore resulting screens
-    for i, button_data in enumerate(all_buttons[:max_buttons_to_try]):
-        button_name = button_data['name'] or button_data['text'] or button_data['label'] or f"Button {i+1}"
+    for i, button_data in enumerate(all_buttons):
+        if saturation.stopped:
+            return
+        if expired(deadline):
+            return
+        reason = saturation.saturated()
+        if reason is not None:
+            if SATURATION_ACTION == 'app' or level == 0:
+                saturation.stop(reason)
+                return
+            logging.info(f"Leaving screen {screen_number} at level {level} with "
+                         f"{max_buttons_to_try - i} buttons untried")
+            saturation.abandon(reason)
+            break
+        button_name = button_data.display_name or f"Button {i+1}"
         logging.info(f"Attempting to click button {i+1}/{max_buttons_to_try}: {button_name}")
         
         try:
             # Store the state before clicking
-            before_click = driver.page_source
+            if current_fingerprint is None:
+                with phase('element_discovery'):
+                    current_fingerprint = screen_fingerprint(driver)
+            before_click = current_fingerprint
+            current_fingerprint = None
             
-            try:
-                # Try to find a fresh reference to the element
-                fresh_element = None
-                if button_data['name']:
-                    try:
-                        fresh_element = driver.find_element(by='accessibility id', value=button_data['name'])
-                        logging.debug(f"Found element by accessibility id: {button_data['name']}")
-                    except Exception as e:
-                        logging.debug(f"Could not find element by accessibility id: {e}")
-                
-                if not fresh_element and button_data['label']:
-                    try:
-                        xpath = f"//{button_data['type']}[@label='{button_data['label']}']"
-                        fresh_element = driver.find_element(by='xpath', value=xpath)
-                        logging.debug(f"Found element by xpath: {xpath}")
-                    except Exception as e:
-                        logging.debug(f"Could not find element by xpath: {e}")
-                
-                if not fresh_element:
-                    logging.debug("Using original button reference")
-                    fresh_element = button_data['btn']
-                
-                # Try to click the element
-                success = try_click_element(fresh_element, driver)
-            except Exception as e:
-                logging.warning(f"Error finding fresh element, using original: {e}")
-                success = try_click_element(button_data['btn'], driver)
+            with phase('clicking'):
+                success = click_button(driver, button_data)
+            if not success:
+                saturation.record(False)
+                events.emit(events.ACTION, screen=screen_number, button=button_name, outcome='failed')
             
             if success:
+                metrics.count(metrics.CLICKS)
                 logging.info(f"Successfully clicked button: {button_name}")
                 sleep(WAIT_AFTER_CLICK)
                 
                 # Check if the screen changed after clicking
-                after_click = driver.page_source
-                if before_click == after_click:
+                with phase('element_discovery'):
+                    after_click = take_snapshot(driver)
+                after_click = alerts.intercept(after_click)
+                if after_click.fingerprint == before_click:
                     logging.debug("Screen did not change after click, continuing")
+                    metrics.count(metrics.NOOP_CLICKS)
+                    saturation.record(False)
+                    events.emit(events.ACTION, screen=screen_number, button=button_name, outcome='no_change')
+                    current_fingerprint = before_click
                     continue
                 
-                # If we have a new screen, take a screenshot and explore it
-                new_screen_signature = hash(after_click)
-                if new_screen_signature not in visited_screens:
-                    visited_screens.add(new_screen_signature)
+                is_new = after_click.fingerprint not in visited_screens
+                admitted = True
+                if is_new:
+                    visited_screens.add(after_click.fingerprint)
+                    metrics.count(metrics.SCREENS_DISCOVERED)
+                    template, admitted = templates.admit(after_click)
+                if not is_new:
+                    outcome = 'known_screen'
+                elif admitted:
+                    outcome = 'new_screen'
+                else:
+                    outcome = 'template_capped'
+                    logging.info(f"Screen repeats template {template.id}, not capturing it")
+                saturation.record(is_new and admitted)
+                events.emit(events.ACTION, screen=screen_number, button=button_name, outcome=outcome)
+                
+                # If we have a new screen of a layout still under its cap, take a screenshot and explore it
+                if is_new and admitted:
+                    action = dict(action_from_button(button_data), fingerprint=after_click.fingerprint)
                     safe_button_name = ''.join(c if c.isalnum() else '_' for c in button_name)[:20]
                     new_screenshot_path = os.path.join(
                         path, 
                         f"{app_info['name']}_{level+1}_{len(visited_screens)}_{safe_button_name}.png"
                     )
-                    driver.save_screenshot(new_screenshot_path)
+                    save_screenshot(driver, new_screenshot_path, {
+                        'kind': 'screen', 'screen': len(visited_screens), 'level': level + 1,
+                        'parent': screen_number, 'action': button_name, 'template': template.id
+                    }, state=after_click)
                     logging.info(f"Saved new screen screenshot to {new_screenshot_path}")
+                    text_index.record_screen(app_info['name'], new_screenshot_path, after_click, level + 1,
+                                             actions + [action])
+                    events.emit(events.SCREEN_DISCOVERED, screen=len(visited_screens), level=level + 1,
+                                fingerprint=format(after_click.fingerprint, '016x'), parent=screen_number,
+                                action=button_name, screenshot=new_screenshot_path)
                     
                     # Recursively explore the new screen
                     if level < MAX_DEPTH - 1:
@@ -193,33 +391,50 @@ def navigate_and_capture_screenshots(driver, app_info, path, level=0, buttons=No
                             path=path,
                             level=level+1,
                             visited_screens=visited_screens,
-                            max_per_level=max_per_level
+                            max_per_level=max_per_level,
+                            screen_state=after_click,
+                            actions=actions + [action],
+                            restorer=restorer,
+                            templates=templates,
+                            saturation=saturation,
+                            deadline=deadline,
+                            alerts=alerts
                         )
+                        metrics.CURRENT_LEVEL.set(level)
+                        if expired(deadline):
+                            return
+                del after_click
                 
                 # Try to go back to the previous screen
                 logging.debug("Attempting to go back")
-                if not try_go_back(driver, app_info):
-                    logging.warning("Failed to go back, breaking exploration")
-                    break
-                
-                # Verify we're back at the original screen
-                current = driver.page_source
-                if hash(current) != hash(before_click):
-                    logging.warning("Could not return to previous screen, restarting app")
-                    driver.terminate_app(app_info['bundleId'])
-                    sleep(1)
-                    driver.activate_app(app_info['bundleId'])
-                    sleep(2)
+                with phase('back_navigation'):
+                    went_back = try_go_back(driver, app_info)
+                    # Verify we're back at the original screen
+                    current = screen_fingerprint(driver) if went_back else None
+                if went_back and current != before_click:
+                    # An alert that popped up after going back hides the screen
+                    current = alerts.intercept().fingerprint
+                if current != before_click:
+                    metrics.count(metrics.BACK_FAILURES)
+                    if restorer is None:
+                        if not went_back:
+                            logging.warning("Failed to go back, breaking exploration")
+                            break
+                        logging.warning("Could not return to previous screen, restarting app")
+                        restart_app(driver, app_info)
+                        continue
+                    logging.warning("Could not return to previous screen, restoring it")
+                    if not restorer.restore(before_click, actions):
+                        break
+                current_fingerprint = before_click
         except Exception as e:
             logging.error(f"Error clicking button: {e}")
-            try:
+            events.emit(events.ERROR, screen=screen_number, button=button_name, message=str(e))
+            if restorer is None:
                 logging.info("Restarting app after error")
-                driver.terminate_app(app_info['bundleId'])
-                sleep(1)
-                driver.activate_app(app_info['bundleId'])
-                sleep(2)
-            except Exception as restart_error:
-                logging.error(f"Failed to restart app: {restart_error}")
+                restart_app(driver, app_info)
+            elif not restorer.restore(screen_fingerprint_at_entry, actions):
+                break
 
 def restart_app(driver, app_info):
     """
@@ -232,13 +447,16 @@ def restart_app(driver, app_info):
     Returns:
         Boolean indicating if restart was successful
     """
-    try:
-        logging.info(f"Restarting app: {app_info['name']}")
-        driver.terminate_app(app_info['bundleId'])
-        sleep(1)
-        driver.activate_app(app_info['bundleId'])
-        sleep(2)
-        return True
-    except Exception as e:
-        logging.error(f"Failed to restart app: {e}")
-        return False
+    metrics.count(metrics.RESTARTS)
+    events.emit(events.RESTART)
+    with phase('restarts'):
+        try:
+            logging.info(f"Restarting app: {app_info['name']}")
+            driver.terminate_app(app_info['bundleId'])
+            sleep(1)
+            driver.activate_app(app_info['bundleId'])
+            sleep(2)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to restart app: {e}")
+            return False
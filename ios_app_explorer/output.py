@@ -0,0 +1,176 @@
+"""
+Writing captured screenshots
+"""
+import os
+import json
+import time
+import atexit
+import threading
+from ios_app_explorer import events, metrics, redaction
+from ios_app_explorer.config import OUTPUT_BACKEND, PACK_FSYNC
+from ios_app_explorer.pack import PackWriter
+from ios_app_explorer.remote import S3Backend
+from ios_app_explorer.profiling import phase
+from ios_app_explorer.snapshot import take_snapshot
+
+class DirectoryBackend:
+    """
+    Writes every screenshot as its own PNG file
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, name, data, metadata=None):
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+class PackBackend:
+    """
+    Appends screenshots to the directory's pack file (see pack.py)
+    """
+
+    def __init__(self, directory):
+        self.writer = PackWriter(directory, fsync=PACK_FSYNC)
+
+    def write(self, name, data, metadata=None):
+        self.writer.write(name, data, metadata)
+
+    def close(self):
+        self.writer.close()
+
+# Per-directory JSON-lines record of what each screenshot shows
+MANIFEST_NAME = 'manifest.jsonl'
+
+BACKENDS = {
+    'directory': DirectoryBackend,
+    'pack': PackBackend,
+    's3': S3Backend
+}
+
+# Open backends and manifests by output directory
+_backends = {}
+_manifests = {}
+_backends_lock = threading.Lock()
+
+def get_backend(directory):
+    """
+    Get the output backend for a directory, opening it on first use
+
+    Args:
+        directory: Screenshot directory
+
+    Returns:
+        Backend selected by OUTPUT_BACKEND
+    """
+    with _backends_lock:
+        backend = _backends.get(directory)
+        if backend is None:
+            backend = _backends[directory] = BACKENDS[OUTPUT_BACKEND](directory)
+        return backend
+
+def append_manifest(directory, name, metadata):
+    """
+    Append a screenshot's metadata to the directory's manifest
+
+    Args:
+        directory: Screenshot directory
+        name: Screenshot file name
+        metadata: Dictionary describing the screenshot
+    """
+    line = json.dumps({'name': name, 'time': round(time.time(), 3), **metadata}) + '\n'
+    with _backends_lock:
+        manifest = _manifests.get(directory)
+        if manifest is None:
+            manifest = _manifests[directory] = open(os.path.join(directory, MANIFEST_NAME), 'a')
+        manifest.write(line)
+        manifest.flush()
+
+def close_backends():
+    """
+    Close every open output backend and manifest, once the screenshots being
+    redacted have reached them
+    """
+    redaction.flush()
+    with _backends_lock:
+        for backend in _backends.values():
+            backend.close()
+        for manifest in _manifests.values():
+            manifest.close()
+        _backends.clear()
+        _manifests.clear()
+
+atexit.register(close_backends)
+
+def _store(png, screenshot_path, metadata):
+    directory, name = os.path.split(screenshot_path)
+    get_backend(directory).write(name, png, metadata)
+    if metadata is not None:
+        append_manifest(directory, name, metadata)
+    metrics.count(metrics.SCREENSHOTS_WRITTEN)
+    metrics.count(metrics.BYTES_WRITTEN, len(png))
+    events.emit(events.SCREENSHOT_CAPTURED, path=screenshot_path, bytes=len(png), metadata=metadata)
+
+def write_screenshot(png, screenshot_path, metadata=None, elements=None):
+    """
+    Hand a fetched screenshot to the output backend
+
+    With REDACTION on, the screenshot goes through the redaction workers
+    first (see redaction.py) and reaches the backend, manifest and event
+    stream from there.
+
+    Args:
+        png: PNG bytes
+        screenshot_path: Where the PNG goes; the directory selects the
+            backend instance and the file name identifies the screenshot
+        metadata: Optional dictionary describing the screenshot (kind, level,
+            screen number, parent, action); it is appended to the directory's
+            manifest and stored by backends that support it
+        elements: ElementRecord tuple of the screen the screenshot shows,
+            which locates the regions to redact
+    """
+    redactor = redaction.get_redactor()
+    if redactor is None:
+        _store(png, screenshot_path, metadata)
+        return
+
+    def store(redacted, regions):
+        _store(redacted, screenshot_path, dict(metadata, redacted=regions) if metadata is not None else None)
+
+    redactor.submit(png, elements, store)
+
+def save_screenshot(driver, screenshot_path, metadata=None, state=None):
+    """
+    Fetch a screenshot from the device and hand it to the output backend
+
+    Fetching counts as device time, writing as disk I/O. Drivers that can
+    capture in the background (see async_driver.py) return as soon as the
+    capture is scheduled; the screenshot is fetched before their next command
+    reaches the device.
+
+    Args:
+        driver: Appium driver
+        screenshot_path: Where the PNG goes
+        metadata: Optional dictionary describing the screenshot, as for write_screenshot
+        state: ScreenState of the screen on display; with REDACTION on, one is
+            taken when not given
+
+    Returns:
+        The screenshot path
+    """
+    elements = None
+    if redaction.get_redactor() is not None:
+        if state is None:
+            with phase('redaction'):
+                state = take_snapshot(driver)
+        elements = state.elements
+    capture = getattr(driver, 'capture_screenshot', None)
+    if capture is not None and capture(screenshot_path, metadata, elements):
+        return screenshot_path
+    png = driver.get_screenshot_as_png()
+    with phase('disk_io'):
+        write_screenshot(png, screenshot_path, metadata, elements)
+    return screenshot_path
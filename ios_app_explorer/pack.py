@@ -0,0 +1,267 @@
+"""
+Append-only screenshot packs
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import argparse
+import threading
+
+PACK_NAME = 'screenshots.pack'
+INDEX_NAME = 'screenshots.pack.idx'
+
+# Every record starts with the magic, the name length and the data length
+RECORD_MAGIC = b'SPK1'
+RECORD_HEADER = struct.Struct('>4sIQ')
+
+def _read_index(index_path, pack_size):
+    """
+    Read the index entries that point at complete records
+
+    A torn last line (from a crash while appending) or an entry pointing past
+    the end of the pack is ignored.
+
+    Returns:
+        Tuple of (list of entries, whether the index needs rewriting)
+    """
+    entries = []
+    dirty = False
+    if not os.path.exists(index_path):
+        return entries, dirty
+    with open(index_path, 'rb') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                dirty = True
+                continue
+            if entry['offset'] + entry['length'] > pack_size:
+                dirty = True
+                continue
+            entries.append(entry)
+    return entries, dirty
+
+class PackWriter:
+    """
+    Appends screenshots to one pack file per directory
+
+    Records are written sequentially: the record (header, name, data) goes into
+    the pack first, then one JSON line with its offset, length, SHA-256 and
+    metadata goes into the index. Both are flushed and fsynced per record, so a
+    crash loses at most the record being written. On open, records that made it
+    into the pack but not into the index are re-indexed and a torn tail is cut off.
+    """
+
+    def __init__(self, directory, fsync=True):
+        self.directory = directory
+        self.pack_path = os.path.join(directory, PACK_NAME)
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._recover()
+        self._pack = open(self.pack_path, 'ab')
+        self._index = open(self.index_path, 'ab')
+
+    def _recover(self):
+        pack_size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        entries, dirty = _read_index(self.index_path, pack_size)
+        end = max((e['offset'] + e['length'] for e in entries), default=0)
+
+        # Re-index complete records that were written after the last index line
+        if end < pack_size:
+            with open(self.pack_path, 'rb') as f:
+                f.seek(end)
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    magic, name_length, length = RECORD_HEADER.unpack(header)
+                    if magic != RECORD_MAGIC:
+                        break
+                    name = f.read(name_length)
+                    offset = f.tell()
+                    data = f.read(length)
+                    if len(name) < name_length or len(data) < length:
+                        break
+                    entries.append(self._entry(name.decode('utf-8'), offset, data, None))
+                    end = f.tell()
+                    dirty = True
+            if end < pack_size:
+                logging.warning(f"Truncating {pack_size - end} bytes of incomplete record in {self.pack_path}")
+                with open(self.pack_path, 'r+b') as f:
+                    f.truncate(end)
+
+        if dirty:
+            logging.warning(f"Rebuilding pack index {self.index_path} with {len(entries)} records")
+            temporary_path = self.index_path + '.tmp'
+            with open(temporary_path, 'wb') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.index_path)
+
+    @staticmethod
+    def _entry(name, offset, data, metadata):
+        return {
+            'name': name,
+            'offset': offset,
+            'length': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'time': round(time.time(), 3),
+            'metadata': metadata
+        }
+
+    def write(self, name, data, metadata=None):
+        """
+        Append one screenshot
+
+        Args:
+            name: File name the screenshot would have on disk
+            data: PNG bytes
+            metadata: Optional JSON-serializable dictionary stored in the index
+
+        Returns:
+            The index entry of the record
+        """
+        encoded_name = name.encode('utf-8')
+        with self._lock:
+            self._pack.write(RECORD_HEADER.pack(RECORD_MAGIC, len(encoded_name), len(data)))
+            self._pack.write(encoded_name)
+            offset = self._pack.tell()
+            self._pack.write(data)
+            self._sync(self._pack)
+
+            entry = self._entry(name, offset, data, metadata)
+            self._index.write(json.dumps(entry).encode('utf-8') + b'\n')
+            self._sync(self._index)
+        return entry
+
+    def _sync(self, f):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._pack.close()
+            self._index.close()
+
+class PackReader:
+    """
+    Serves screenshots from a pack through a read-only memory map
+
+    If a name was written more than once the latest record wins.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        pack_path = os.path.join(directory, PACK_NAME)
+        self._file = open(pack_path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        entries, _ = _read_index(os.path.join(directory, INDEX_NAME), size)
+        self.entries = {entry['name']: entry for entry in entries}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return sorted(self.entries)
+
+    def view(self, name):
+        """
+        Get a zero-copy view of a screenshot's bytes
+
+        Args:
+            name: Screenshot file name
+
+        Returns:
+            memoryview over the mapped pack
+        """
+        entry = self.entries[name]
+        return memoryview(self._map)[entry['offset']:entry['offset'] + entry['length']]
+
+    def read(self, name, verify=False):
+        """
+        Read a screenshot's bytes
+
+        Args:
+            name: Screenshot file name
+            verify: Check the bytes against the SHA-256 in the index
+
+        Returns:
+            The PNG bytes
+        """
+        data = bytes(self.view(name))
+        if verify and hashlib.sha256(data).hexdigest() != self.entries[name]['sha256']:
+            raise ValueError(f"Checksum mismatch for {name} in {self.directory}")
+        return data
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+def export_pack(directory, out_dir=None, verify=True):
+    """
+    Unpack a pack into plain PNG files, as the directory backend would have written them
+
+    Args:
+        directory: Directory containing the pack
+        out_dir: Where to write the files, defaults to the pack's directory
+        verify: Check every record against its SHA-256
+
+    Returns:
+        Number of files written
+    """
+    out_dir = out_dir or directory
+    os.makedirs(out_dir, exist_ok=True)
+    with PackReader(directory) as reader:
+        for name in reader.names():
+            with open(os.path.join(out_dir, name), 'wb') as f:
+                f.write(reader.read(name, verify=verify))
+        count = len(reader)
+    logging.info(f"Exported {count} screenshots from {directory} to {out_dir}")
+    return count
+
+def main():
+    """
+    Command line entry point to list or export a screenshot pack
+    """
+    parser = argparse.ArgumentParser(description="List or export a screenshot pack")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    list_parser = subparsers.add_parser('list', help="List the screenshots in a pack")
+    list_parser.add_argument('directory', help="App screenshot directory containing the pack")
+    export_parser = subparsers.add_parser('export', help="Unpack to PNG files")
+    export_parser.add_argument('directory', help="App screenshot directory containing the pack")
+    export_parser.add_argument('-o', '--out', help="Output directory (defaults to the pack's directory)")
+    export_parser.add_argument('--no-verify', action='store_true', help="Skip checksum verification")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    if args.command == 'list':
+        with PackReader(args.directory) as reader:
+            for name in reader.names():
+                entry = reader.entries[name]
+                sys.stdout.write(f"{entry['length']:>10}  {entry['sha256'][:12]}  {name}\n")
+    else:
+        export_pack(args.directory, args.out, verify=not args.no_verify)
+
+if __name__ == '__main__':
+    main()
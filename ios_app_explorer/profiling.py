@@ -0,0 +1,298 @@
+"""
+Phase-level profiling of an app run
+"""
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Phases reported for every run, in report order
+PHASES = [
+    'session_setup',
+    'flows',
+    'waiting',
+    'element_discovery',
+    'clicking',
+    'back_navigation',
+    'alerts',
+    'restarts',
+    'scroll_capture',
+    'disk_io',
+    'redaction',
+    'other'
+]
+
+# The profiler of the run in progress, if any
+_active = None
+
+class PhaseProfiler:
+    """
+    Splits the wall time of a run into phases
+
+    Phases nest: time is charged to the innermost open phase only, so a sleep
+    inside back navigation counts as waiting. Device commands reported through
+    record_command are charged to the phase that issued them, which tells device
+    time apart from local time in every phase. Every thread has its own phase
+    stack, so the workers of a shared crawl each charge their own phases and
+    phase times add up over the threads.
+    """
+
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.wall = dict.fromkeys(PHASES, 0.0)
+        self.device = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.commands = {}
+        self.use_cprofile = cprofile
+        self.trace_memory = trace_memory
+        self._profile = None
+        self._memory = None
+        self.peak_memory = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started = None
+        self._cpu_started = None
+        self.elapsed = 0.0
+        self.cpu = 0.0
+        self.sections = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def start(self):
+        global _active
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.use_cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._local.stack = ['other']
+        self._local.last = self._started
+        _active = self
+
+    def stop(self):
+        global _active
+        now = time.perf_counter()
+        self._charge(now)
+        self.elapsed = now - self._started
+        self.cpu = time.process_time() - self._cpu_started
+        if self._profile is not None:
+            self._profile.disable()
+        if self.trace_memory:
+            self._memory = tracemalloc.take_snapshot()
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if _active is self:
+            _active = None
+
+    def _thread_state(self):
+        """
+        Phase stack of the calling thread and when its time was last charged
+        """
+        local = self._local
+        if not hasattr(local, 'stack'):
+            local.stack = ['other']
+            local.last = time.perf_counter()
+        return local
+
+    def _charge(self, now):
+        local = self._thread_state()
+        current = local.stack[-1]
+        with self._lock:
+            self.wall[current] = self.wall.get(current, 0.0) + now - local.last
+        local.last = now
+
+    @contextmanager
+    def phase(self, name):
+        stack = self._thread_state().stack
+        self._charge(time.perf_counter())
+        stack.append(name)
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            stack.pop()
+
+    def record_command(self, command, seconds):
+        current = self._thread_state().stack[-1]
+        with self._lock:
+            self.device[current] = self.device.get(current, 0.0) + seconds
+            count, total = self.commands.get(command, (0, 0.0))
+            self.commands[command] = (count + 1, total + seconds)
+
+    def add_section(self, name, data):
+        """
+        Attach extra measurements (e.g. restoration cost) to the report
+        """
+        self.sections[name] = data
+
+    def report(self):
+        """
+        Build the profiling report
+
+        Returns:
+            Dictionary with per-phase wall, device and local time, per-command
+            device time, Python CPU time and what the run was bound by
+        """
+        phases = {}
+        for name in self.wall:
+            wall = self.wall[name]
+            device = self.device.get(name, 0.0)
+            phases[name] = {
+                'wall': round(wall, 3),
+                'device': round(device, 3),
+                'local': round(max(wall - device, 0.0), 3),
+                'calls': self.calls.get(name, 0),
+                'share': round(wall / self.elapsed, 4) if self.elapsed else 0.0
+            }
+
+        device_total = sum(self.device.values())
+        totals = {
+            'sleep': self.wall.get('waiting', 0.0),
+            'device': device_total,
+            'cpu': self.cpu
+        }
+        report = {
+            'wall': round(self.elapsed, 3),
+            'device': round(device_total, 3),
+            'python_cpu': round(self.cpu, 3),
+            'bound_by': max(totals, key=totals.get) if self.elapsed else None,
+            'phases': phases,
+            'commands': {
+                command: {'count': count, 'total': round(total, 3), 'mean': round(total / count, 4)}
+                for command, (count, total) in sorted(self.commands.items(), key=lambda c: -c[1][1])
+            }
+        }
+        report.update(self.sections)
+        if self._memory is not None:
+            report['memory'] = {
+                'peak_bytes': self.peak_memory,
+                'top': [
+                    {'location': str(stat.traceback[0]), 'bytes': stat.size, 'count': stat.count}
+                    for stat in self._memory.statistics('lineno')[:15]
+                ]
+            }
+        return report
+
+    def write(self, directory, name):
+        """
+        Write the report next to the screenshots as JSON and as a table
+
+        Args:
+            directory: Screenshot directory of the app
+            name: Base name for the report files
+
+        Returns:
+            Path of the JSON report
+        """
+        report = self.report()
+        json_path = os.path.join(directory, f"{name}_profile.json")
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        text = format_report(report)
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.join(directory, f"{name}_profile.pstats"))
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats('cumulative').print_stats(30)
+            text += '\n\n' + stream.getvalue()
+        with open(os.path.join(directory, f"{name}_profile.txt"), 'w') as f:
+            f.write(text)
+
+        logging.info(f"Run was {report['bound_by']}-bound; profile written to {json_path}")
+        return json_path
+
+def format_report(report):
+    """
+    Format a profiling report as a human-readable table
+
+    Args:
+        report: Dictionary from PhaseProfiler.report
+
+    Returns:
+        The table as a string
+    """
+    lines = [
+        f"wall {report['wall']:.1f}s  device {report['device']:.1f}s  "
+        f"python cpu {report['python_cpu']:.1f}s  bound by: {report['bound_by']}",
+        '',
+        f"{'phase':<20}{'wall s':>10}{'share':>8}{'device s':>10}{'local s':>10}{'calls':>8}"
+    ]
+    for name, phase_report in report['phases'].items():
+        lines.append(
+            f"{name:<20}{phase_report['wall']:>10.2f}{phase_report['share'] * 100:>7.1f}%"
+            f"{phase_report['device']:>10.2f}{phase_report['local']:>10.2f}{phase_report['calls']:>8}"
+        )
+    lines += ['', f"{'command':<40}{'count':>8}{'total s':>10}{'mean s':>10}"]
+    for command, stats in report['commands'].items():
+        lines.append(f"{command:<40}{stats['count']:>8}{stats['total']:>10.2f}{stats['mean']:>10.3f}")
+    if 'restoration' in report:
+        lines += ['', f"{'restore strategy':<20}{'attempts':>10}{'successes':>11}{'total s':>10}{'mean s':>10}"]
+        for name, stats in report['restoration'].items():
+            mean = f"{stats['mean']:>10.2f}" if stats['mean'] is not None else f"{'-':>10}"
+            lines.append(f"{name:<20}{stats['attempts']:>10}{stats['successes']:>11}{stats['seconds']:>10.2f}{mean}")
+    if 'templates' in report:
+        templates = report['templates']
+        lines += ['', f"templates {templates['templates']}  screens {templates['screens']}  "
+                      f"skipped {templates['skipped']}"]
+    if 'saturation' in report:
+        saturation = report['saturation']
+        lines += ['', f"actions {saturation['actions']}  new screens {saturation['discoveries']}  "
+                      f"subtrees left {saturation['abandoned_subtrees']}"]
+        if saturation['stopped']:
+            lines.append(f"stopped early: {saturation['stopped']}")
+    if report.get('alerts', {}).get('kinds'):
+        alerts = report['alerts']
+        lines += ['', f"alerts ({alerts['policy']}): " +
+                  '  '.join(f"{kind} {count}" for kind, count in alerts['kinds'].items())]
+    if report.get('redaction', {}).get('screenshots') or report.get('redaction', {}).get('failed'):
+        redaction = report['redaction']
+        lines += ['', f"redaction ({redaction['mode']}): screenshots {redaction['screenshots']}  "
+                      f"redacted {redaction['redacted']}  regions {redaction['regions']}  "
+                      f"dropped {redaction['failed']}  mean {redaction['mean_ms']} ms  "
+                      f"capture waited {redaction['wait_seconds']:.2f}s"]
+    if 'memory' in report:
+        lines += ['', f"peak traced memory {report['memory']['peak_bytes'] / 1024 / 1024:.1f} MiB"]
+        for entry in report['memory']['top']:
+            lines.append(f"{entry['bytes'] / 1024:>10.1f} KiB  {entry['location']}")
+    return '\n'.join(lines)
+
+def phase(name):
+    """
+    Context manager charging the enclosed time to a phase of the active profiler
+
+    Args:
+        name: Phase name
+
+    Returns:
+        Context manager (a no-op when no profiler is active)
+    """
+    return _active.phase(name) if _active is not None else nullcontext()
+
+def sleep(seconds):
+    """
+    Sleep and charge the time to the 'waiting' phase
+    """
+    with phase('waiting'):
+        time.sleep(seconds)
+
+def record_command(command, seconds):
+    """
+    Command listener that charges device time to the active profiler
+    """
+    if _active is not None:
+        _active.record_command(command, seconds)
@@ -0,0 +1,275 @@
+"""
+Redacting sensitive data from screenshots before they are written or uploaded
+"""
+import io
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ios_app_explorer import metrics
+from ios_app_explorer.config import (
+    REDACTION, REDACT_MODE, REDACT_PATTERNS, REDACT_PADDING, REDACT_BLOCK_SIZE, REDACT_WORKERS
+)
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+MODES = ('blur', 'box')
+
+# Redactor shared by every output directory of the run
+_redactor = None
+_redactor_lock = threading.Lock()
+
+def find_sensitive_elements(elements, patterns):
+    """
+    Find the elements whose texts match a sensitive-data pattern
+
+    Containers often carry the texts of their children as their own label, so
+    only the innermost matching elements are returned: covering a whole cell
+    or screen because one of its rows shows an address would hide everything.
+
+    Args:
+        elements: ElementRecord tuple of the screen
+        patterns: Compiled regular expressions, searched in name, label and value
+
+    Returns:
+        List of ElementRecord
+    """
+    matched = [e for e in elements
+               if any(pattern.search(text) for text in (e.label, e.value, e.name) if text for pattern in patterns)]
+    covered = set()
+    for element in matched:
+        parent = element.parent
+        while parent >= 0 and parent not in covered:
+            covered.add(parent)
+            parent = elements[parent].parent
+    return [e for e in matched if e.index not in covered]
+
+def element_regions(elements, image_size, patterns, padding=REDACT_PADDING):
+    """
+    Pixel regions of a screenshot that show sensitive data
+
+    Element rects are in points; they are scaled to the screenshot by the
+    width of the application element at the root of the tree.
+
+    Args:
+        elements: ElementRecord tuple of the screen the screenshot shows
+        image_size: (width, height) of the screenshot in pixels
+        patterns: Compiled regular expressions
+        padding: Points added around every element
+
+    Returns:
+        List of (left, top, right, bottom) pixel boxes clipped to the image
+    """
+    width, height = image_size
+    root_width = elements[0].width if elements and elements[0].width > 0 else width
+    scale = width / root_width
+    regions = []
+    for element in find_sensitive_elements(elements, patterns):
+        left = max(int((element.x - padding) * scale), 0)
+        top = max(int((element.y - padding) * scale), 0)
+        right = min(int((element.x + element.width + padding) * scale + 0.5), width)
+        bottom = min(int((element.y + element.height + padding) * scale + 0.5), height)
+        if right > left and bottom > top:
+            regions.append((left, top, right, bottom))
+    return regions
+
+def _mosaic(region, block):
+    """
+    Replace every block x block tile of an image region by its mean colour
+    """
+    height, width = region.shape[:2]
+    rows = np.arange(0, height, block)
+    columns = np.arange(0, width, block)
+    sums = np.add.reduceat(np.add.reduceat(region.astype(np.uint32), rows, axis=0), columns, axis=1)
+    row_sizes = np.diff(np.append(rows, height))
+    column_sizes = np.diff(np.append(columns, width))
+    counts = np.outer(row_sizes, column_sizes)
+    if region.ndim == 3:
+        counts = counts[:, :, None]
+    means = (sums // counts).astype(region.dtype)
+    return np.repeat(np.repeat(means, row_sizes, axis=0), column_sizes, axis=1)
+
+def redact_pixels(pixels, regions, mode=REDACT_MODE, block=REDACT_BLOCK_SIZE):
+    """
+    Blur or box regions of an image in place
+
+    Blurring is a coarse mosaic rather than a soft blur, which can be
+    sharpened back into legible text.
+
+    Args:
+        pixels: Image as a NumPy array (height, width[, channels])
+        regions: (left, top, right, bottom) pixel boxes
+        mode: 'blur' or 'box'
+        block: Mosaic tile size in pixels
+    """
+    for left, top, right, bottom in regions:
+        if mode == 'box':
+            pixels[top:bottom, left:right] = 0
+            if pixels.ndim == 3 and pixels.shape[2] == 4:
+                pixels[top:bottom, left:right, 3] = 255
+        else:
+            pixels[top:bottom, left:right] = _mosaic(pixels[top:bottom, left:right], block)
+
+def redact_png(png, elements, patterns, mode=REDACT_MODE):
+    """
+    Redact the sensitive regions of a PNG screenshot
+
+    Args:
+        png: PNG bytes
+        elements: ElementRecord tuple of the screen; when there is none to
+            locate the regions by, the whole screenshot is covered
+        patterns: Compiled regular expressions
+        mode: 'blur' or 'box'
+
+    Returns:
+        Tuple of (PNG bytes, number of regions redacted); the bytes are the
+        original ones when nothing needed redacting
+    """
+    image = Image.open(io.BytesIO(png))
+    if not elements:
+        regions = [(0, 0) + image.size]
+    else:
+        regions = element_regions(elements, image.size, patterns)
+    if not regions:
+        return png, 0
+    pixels = np.array(image)
+    redact_pixels(pixels, regions, mode)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, 'PNG')
+    return output.getvalue(), len(regions)
+
+class Redactor:
+    """
+    Redacts captured screenshots in a pool of worker threads
+
+    Decoding, NumPy work and encoding release the GIL, so the workers run in
+    parallel with each other and with the explorer. A screenshot is handed to
+    its output backend only once it is redacted, so nothing unredacted is
+    written, archived or uploaded; a screenshot that cannot be redacted is
+    dropped. At most two screenshots per worker wait for redaction, after that
+    the capture waits, which bounds memory when redaction falls behind.
+    """
+
+    def __init__(self, patterns=REDACT_PATTERNS, mode=REDACT_MODE, workers=REDACT_WORKERS):
+        if np is None:
+            raise RuntimeError("Redaction requires numpy and pillow (pip install 'iphone-screenshooter[redact]')")
+        if mode not in MODES:
+            raise ValueError(f"Unknown redaction mode '{mode}', expected one of {', '.join(MODES)}")
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.mode = mode
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='redact')
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats = {'screenshots': 0, 'redacted': 0, 'regions': 0, 'failed': 0,
+                      'worker_seconds': 0.0, 'wait_seconds': 0.0}
+
+    def submit(self, png, elements, store):
+        """
+        Redact a screenshot in the background and store the result
+
+        Args:
+            png: PNG bytes
+            elements: ElementRecord tuple of the screen the screenshot shows
+            store: Called with the redacted PNG bytes and the number of
+                regions redacted, on a worker thread
+        """
+        started = time.perf_counter()
+        self._slots.acquire()
+        waited = time.perf_counter() - started
+        future = self._pool.submit(self._run, png, elements, store)
+        with self._lock:
+            self.stats['wait_seconds'] += waited
+            self._pending.append(future)
+
+    def _run(self, png, elements, store):
+        try:
+            started = time.perf_counter()
+            try:
+                png, regions = redact_png(png, elements, self.patterns, self.mode)
+            except Exception as e:
+                logging.error(f"Failed to redact a screenshot, dropping it: {e}")
+                with self._lock:
+                    self.stats['failed'] += 1
+                return
+            with self._lock:
+                self.stats['screenshots'] += 1
+                self.stats['redacted'] += 1 if regions else 0
+                self.stats['regions'] += regions
+                self.stats['worker_seconds'] += time.perf_counter() - started
+            if regions:
+                metrics.count(metrics.REDACTED_REGIONS, regions)
+            store(png, regions)
+        finally:
+            self._slots.release()
+
+    def flush(self):
+        """
+        Wait until every submitted screenshot is redacted and stored
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Failed to store a redacted screenshot: {e}")
+
+    def report(self):
+        """
+        Summarize redaction since the last report, and start counting anew
+
+        Returns:
+            Dictionary with the screenshots processed, redacted and dropped,
+            the regions covered, the mean worker time per screenshot and the
+            seconds the capture waited for a free worker
+        """
+        self.flush()
+        with self._lock:
+            stats = dict(self.stats, mode=self.mode)
+            self._reset_stats()
+        stats['mean_ms'] = round(stats['worker_seconds'] * 1000 / stats['screenshots'], 1) if stats['screenshots'] else None
+        stats['worker_seconds'] = round(stats['worker_seconds'], 2)
+        stats['wait_seconds'] = round(stats['wait_seconds'], 2)
+        return stats
+
+def get_redactor():
+    """
+    Get the redactor of the run, creating it on first use
+
+    Returns:
+        The Redactor, or None when REDACTION is off
+    """
+    global _redactor
+    if not REDACTION:
+        return None
+    with _redactor_lock:
+        if _redactor is None:
+            _redactor = Redactor()
+            logging.info(f"Redacting screenshots ({_redactor.mode}, {len(_redactor.patterns)} patterns)")
+        return _redactor
+
+def flush():
+    """
+    Wait for the screenshots being redacted, if redaction is on
+    """
+    if _redactor is not None:
+        _redactor.flush()
+
+def report():
+    """
+    Summarize redaction since the last report
+
+    Returns:
+        Dictionary from Redactor.report, or None if nothing was redacted
+    """
+    return _redactor.report() if _redactor is not None else None
@@ -0,0 +1,242 @@
+"""
+Uploading screenshots to S3-compatible object storage as they are captured
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from ios_app_explorer.config import (
+    SCREENSHOT_DIR, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_UPLOAD_WORKERS,
+    S3_MAX_IN_FLIGHT_MB, S3_MULTIPART_THRESHOLD_MB, S3_PART_SIZE_MB, S3_MAX_ATTEMPTS
+)
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+MB = 1024 * 1024
+
+# S3 rejects multipart parts smaller than this, except the last one
+MIN_PART_SIZE = 5 * MB
+
+# Error codes worth retrying besides 5xx responses
+RETRYABLE_CODES = {'SlowDown', 'RequestTimeout', 'RequestTimeTooSkewed', 'Throttling', 'ThrottlingException'}
+
+# Uploader shared by every S3 backend of the run
+_uploader = None
+_uploader_lock = threading.Lock()
+
+def create_s3_client(endpoint_url=S3_ENDPOINT_URL, region=S3_REGION, workers=S3_UPLOAD_WORKERS):
+    """
+    Create an S3 client; credentials come from the usual AWS environment
+
+    Args:
+        endpoint_url: Endpoint of an S3-compatible store (MinIO, moto server),
+            None for AWS
+        region: Region name
+        workers: Number of concurrent uploads, to size the connection pool
+
+    Returns:
+        boto3 S3 client
+    """
+    if boto3 is None:
+        raise RuntimeError("The s3 output backend requires boto3 (pip install 'iphone-screenshooter[s3]')")
+    # Retries are done by the uploader, which knows about parts and backoff
+    config = Config(max_pool_connections=workers * 2, retries={'max_attempts': 1, 'mode': 'standard'})
+    return boto3.client('s3', endpoint_url=endpoint_url, region_name=region, config=config)
+
+def _retryable(error):
+    if isinstance(error, ClientError):
+        response = error.response or {}
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or response.get('Error', {}).get('Code') in RETRYABLE_CODES
+    return isinstance(error, BotoCoreError)
+
+class S3Uploader:
+    """
+    Uploads objects concurrently while bounding the bytes held in memory
+
+    Uploads start right away as long as the bytes in flight stay under
+    max_in_flight_bytes. Beyond that the object is only kept in its local
+    spool file and read back once earlier uploads finish, so a slow remote
+    never holds up the capture or grows memory. Objects from
+    multipart_threshold bytes up go as multipart uploads with their parts
+    sent concurrently. Every request is retried with exponential backoff.
+    """
+
+    def __init__(self, bucket=S3_BUCKET, client=None, workers=S3_UPLOAD_WORKERS,
+                 max_in_flight_bytes=S3_MAX_IN_FLIGHT_MB * MB, multipart_threshold=S3_MULTIPART_THRESHOLD_MB * MB,
+                 part_size=S3_PART_SIZE_MB * MB, max_attempts=S3_MAX_ATTEMPTS):
+        if not bucket:
+            raise ValueError("S3_BUCKET is not set")
+        self.bucket = bucket
+        self.client = client or create_s3_client(workers=workers)
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.multipart_threshold = multipart_threshold
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_attempts = max(max_attempts, 1)
+        self.stats = {'uploaded': 0, 'bytes': 0, 'multipart': 0, 'spooled': 0, 'retries': 0, 'failed': 0}
+        self._files = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-upload')
+        self._parts = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-part')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._spooled = deque()
+
+    def upload(self, key, data, spool_path, metadata=None):
+        """
+        Upload an object in the background
+
+        Args:
+            key: Object key
+            data: Object bytes
+            spool_path: Local file holding the same bytes, read back if the
+                upload has to wait for memory
+            metadata: Optional dictionary stored as the object's metadata
+
+        Returns:
+            Future resolving to the key once the object is stored
+        """
+        future = Future()
+        size = len(data)
+        with self._lock:
+            if not self._spooled and (self._in_flight == 0 or self._in_flight + size <= self.max_in_flight_bytes):
+                self._in_flight += size
+                self._files.submit(self._run, key, data, spool_path, size, metadata, future)
+            else:
+                self._spooled.append((key, spool_path, size, metadata, future))
+                self.stats['spooled'] += 1
+        return future
+
+    def _start_spooled(self):
+        """
+        Start waiting uploads while memory allows; called with the lock held
+        """
+        while self._spooled:
+            key, spool_path, size, metadata, future = self._spooled[0]
+            if self._in_flight and self._in_flight + size > self.max_in_flight_bytes:
+                break
+            self._spooled.popleft()
+            self._in_flight += size
+            self._files.submit(self._run, key, None, spool_path, size, metadata, future)
+
+    def _run(self, key, data, spool_path, size, metadata, future):
+        try:
+            if data is None:
+                with open(spool_path, 'rb') as f:
+                    data = f.read()
+            extra = {'ContentType': 'image/png'}
+            if metadata:
+                extra['Metadata'] = {'screenshot': json.dumps(metadata)}
+            if size >= self.multipart_threshold:
+                self._multipart(key, data, extra)
+            else:
+                self._retry(lambda: self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra), key)
+            with self._lock:
+                self.stats['uploaded'] += 1
+                self.stats['bytes'] += size
+            future.set_result(key)
+        except Exception as e:
+            with self._lock:
+                self.stats['failed'] += 1
+            logging.error(f"Failed to upload {key}: {e}")
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight -= size
+                self._start_spooled()
+
+    def _retry(self, request, what):
+        for attempt in range(self.max_attempts):
+            try:
+                return request()
+            except (BotoCoreError, ClientError) as e:
+                if attempt == self.max_attempts - 1 or not _retryable(e):
+                    raise
+                with self._lock:
+                    self.stats['retries'] += 1
+                delay = min(0.2 * 2 ** attempt, 10)
+                logging.debug(f"Retrying {what} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _multipart(self, key, data, extra):
+        upload_id = self._retry(
+            lambda: self.client.create_multipart_upload(Bucket=self.bucket, Key=key, **extra), key
+        )['UploadId']
+        try:
+            def send(number, offset):
+                part = data[offset:offset + self.part_size]
+                response = self._retry(lambda: self.client.upload_part(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=part
+                ), f"{key} part {number}")
+                return {'PartNumber': number, 'ETag': response['ETag']}
+
+            futures = [self._parts.submit(send, number, offset)
+                       for number, offset in enumerate(range(0, len(data), self.part_size), start=1)]
+            parts = [future.result() for future in futures]
+            self._retry(lambda: self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            ), key)
+        except Exception:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logging.debug(f"Could not abort multipart upload of {key}: {e}")
+            raise
+        with self._lock:
+            self.stats['multipart'] += 1
+
+def get_uploader():
+    """
+    Get the run's uploader, creating it on first use
+    """
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            _uploader = S3Uploader()
+            logging.info(f"Uploading screenshots to s3://{S3_BUCKET}/{S3_PREFIX}")
+        return _uploader
+
+class S3Backend:
+    """
+    Writes every screenshot to its directory, as DirectoryBackend does, and
+    uploads it to S3_BUCKET as it is captured
+
+    The local file doubles as the spool for uploads that wait on a slow
+    remote. Objects are keyed by S3_PREFIX and the directory's path under
+    SCREENSHOT_DIR.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.uploader = get_uploader()
+        relative = os.path.relpath(directory, SCREENSHOT_DIR)
+        if relative.startswith('..'):
+            relative = os.path.basename(os.path.normpath(directory))
+        self.prefix = '/'.join(part for part in (S3_PREFIX, relative.replace(os.sep, '/')) if part and part != '.')
+        self._futures = []
+
+    def write(self, name, data, metadata=None):
+        spool_path = os.path.join(self.directory, name)
+        with open(spool_path, 'wb') as f:
+            f.write(data)
+        self._futures.append(self.uploader.upload(f"{self.prefix}/{name}", data, spool_path, metadata))
+
+    def close(self):
+        """
+        Wait for this directory's uploads to finish
+        """
+        futures, self._futures = self._futures, []
+        if not futures:
+            return
+        wait(futures)
+        failed = sum(1 for future in futures if future.exception() is not None)
+        if failed:
+            logging.error(f"{failed} of {len(futures)} uploads from {self.directory} failed; "
+                          f"the files are still on disk")
+        logging.info(f"Uploads: {self.uploader.stats}")
@@ -0,0 +1,147 @@
+"""
+Restoring a known screen after navigation went astray
+"""
+import time
+import logging
+from ios_app_explorer.config import RESTORE_STRATEGIES, WAIT_AFTER_CLICK
+from ios_app_explorer.budget import expired
+from ios_app_explorer.navigation import replay_action, replay_path
+from ios_app_explorer.profiling import phase, sleep
+from ios_app_explorer.snapshot import screen_fingerprint
+
+class ScreenRestorer:
+    """
+    Brings the app back to a screen it has already reached, the cheapest way known
+
+    Strategies are tried in RESTORE_STRATEGIES order and each one is verified by
+    the screen fingerprint:
+
+    - 'tab': tap the last tab-bar item on the screen's action path, then replay
+      the actions after it
+    - 'deep_link': open the app deep link (from app_info['deepLinks']) that lands
+      deepest on the screen's path, then replay the rest. Landing screens are
+      learned the first time the strategy is needed.
+    - 'restart': cold restart and replay the whole path
+
+    Action paths are lists of action dictionaries from the root screen; each
+    action may carry the 'fingerprint' of the screen it led to. Once the
+    optional time.monotonic() deadline passes, nothing is restored.
+    """
+
+    def __init__(self, driver, app_info, root_fingerprint=None, deadline=None):
+        self.driver = driver
+        self.app_info = app_info
+        self.root_fingerprint = root_fingerprint
+        self.deadline = deadline
+        self.deep_links = list(app_info.get('deepLinks') or [])
+        self.landings = None
+        self.stats = {name: {'attempts': 0, 'successes': 0, 'seconds': 0.0} for name in RESTORE_STRATEGIES}
+
+    def restore(self, target, actions):
+        """
+        Bring the app back to a screen
+
+        Args:
+            target: Fingerprint of the screen to restore
+            actions: Action path that reaches the screen from the root
+
+        Returns:
+            Boolean indicating if the screen was restored
+        """
+        strategies = {
+            'tab': self._via_tab,
+            'deep_link': self._via_deep_link,
+            'restart': self._via_restart
+        }
+        with phase('restarts'):
+            for name in RESTORE_STRATEGIES:
+                if expired(self.deadline):
+                    logging.info("Time budget used up, not restoring the screen")
+                    return False
+                start = time.perf_counter()
+                try:
+                    attempted = strategies[name](actions)
+                    restored = attempted and screen_fingerprint(self.driver) == target
+                except Exception as e:
+                    logging.debug(f"Restoring with {name} failed: {e}")
+                    attempted, restored = True, False
+                if not attempted:
+                    continue
+                stats = self.stats[name]
+                stats['attempts'] += 1
+                stats['seconds'] += time.perf_counter() - start
+                if restored:
+                    stats['successes'] += 1
+                    logging.info(f"Restored screen with {name} in {time.perf_counter() - start:.1f}s")
+                    return True
+                logging.debug(f"Restoring with {name} did not reach the screen")
+        logging.warning("Could not restore screen")
+        return False
+
+    def _replay(self, actions):
+        for action in actions:
+            if expired(self.deadline) or not replay_action(self.driver, action):
+                return False
+            sleep(WAIT_AFTER_CLICK)
+        return True
+
+    def _via_tab(self, actions):
+        tabs = [i for i, action in enumerate(actions) if action.get('tab')]
+        if not tabs:
+            return False
+        last = tabs[-1]
+        if not replay_action(self.driver, actions[last], strict=True):
+            return False
+        sleep(WAIT_AFTER_CLICK)
+        return self._replay(actions[last + 1:])
+
+    def _open_deep_link(self, url):
+        self.driver.execute_script('mobile: deepLink', {'url': url, 'bundleId': self.app_info['bundleId']})
+        sleep(WAIT_AFTER_CLICK)
+        return screen_fingerprint(self.driver)
+
+    def _via_deep_link(self, actions):
+        if not self.deep_links:
+            return False
+        if self.landings is None:
+            self.landings = {}
+            for url in self.deep_links:
+                if expired(self.deadline):
+                    # Learn the rest the next time
+                    self.landings = None
+                    return False
+                try:
+                    self.landings[self._open_deep_link(url)] = url
+                except Exception as e:
+                    logging.warning(f"Deep link {url} failed: {e}")
+            logging.info(f"Learned landing screens of {len(self.landings)} deep links")
+
+        path = [self.root_fingerprint] + [action.get('fingerprint') for action in actions]
+        for depth in range(len(path) - 1, -1, -1):
+            url = self.landings.get(path[depth])
+            if url is not None:
+                if self._open_deep_link(url) != path[depth]:
+                    return True
+                return self._replay(actions[depth:])
+        return False
+
+    def _via_restart(self, actions):
+        replay_path(self.driver, self.app_info, actions, deadline=self.deadline)
+        return True
+
+    def report(self):
+        """
+        Summarize restoration cost per strategy
+
+        Returns:
+            Dictionary of strategy -> attempts, successes, total and mean seconds
+        """
+        return {
+            name: {
+                'attempts': stats['attempts'],
+                'successes': stats['successes'],
+                'seconds': round(stats['seconds'], 3),
+                'mean': round(stats['seconds'] / stats['attempts'], 3) if stats['attempts'] else None
+            }
+            for name, stats in self.stats.items()
+        }
@@ -0,0 +1,110 @@
+"""
+Stopping exploration once clicks stop discovering new screens
+"""
+import time
+import logging
+import threading
+from collections import deque
+from ios_app_explorer.config import SATURATION_WINDOW, SATURATION_MIN_RATE, SATURATION_MIN_PER_MINUTE
+
+class DiscoveryTracker:
+    """
+    Discovery rate over a sliding window of the most recent actions
+
+    Every click (or attempted click) is recorded with whether it led to a
+    new screen. Once the window is full, exploration is saturated when the
+    window's new screens per action fall below min_rate, or new screens per
+    minute below min_per_minute. The tracker can be shared by threads.
+    """
+
+    def __init__(self, window=SATURATION_WINDOW, min_rate=SATURATION_MIN_RATE,
+                 min_per_minute=SATURATION_MIN_PER_MINUTE):
+        self.window = window or 0
+        self.min_rate = min_rate
+        self.min_per_minute = min_per_minute
+        self.actions = 0
+        self.discoveries = 0
+        self.abandoned = 0
+        self.stopped = None
+        self._recent = deque(maxlen=max(self.window, 1))
+        self._lock = threading.Lock()
+
+    def record(self, new_screen):
+        """
+        Record an action
+
+        Args:
+            new_screen: Whether the action led to a new screen
+        """
+        with self._lock:
+            self.actions += 1
+            self.discoveries += bool(new_screen)
+            self._recent.append((time.monotonic(), bool(new_screen)))
+
+    def rates(self):
+        """
+        Returns:
+            Tuple of new screens per action and per minute over the window
+        """
+        with self._lock:
+            recent = list(self._recent)
+        if not recent:
+            return None, None
+        found = sum(new for _, new in recent)
+        elapsed = time.monotonic() - recent[0][0]
+        per_minute = found * 60 / elapsed if elapsed > 0 else None
+        return found / len(recent), per_minute
+
+    def saturated(self):
+        """
+        Check whether the window's discovery rate is below the thresholds
+
+        Returns:
+            Description of why exploration is saturated, or None
+        """
+        if self.stopped is not None:
+            return self.stopped
+        with self._lock:
+            filled = len(self._recent)
+        if not self.window or filled < self.window:
+            return None
+        per_action, per_minute = self.rates()
+        if self.min_rate is not None and per_action < self.min_rate:
+            return (f"{per_action:.2f} new screens per action over the last {self.window} actions, "
+                    f"below {self.min_rate}")
+        if self.min_per_minute is not None and per_minute is not None and per_minute < self.min_per_minute:
+            return (f"{per_minute:.2f} new screens per minute over the last {self.window} actions, "
+                    f"below {self.min_per_minute}")
+        return None
+
+    def abandon(self, reason):
+        """
+        Give up on the current subtree and give the next one a fresh window
+        """
+        with self._lock:
+            self.abandoned += 1
+            self._recent.clear()
+        logging.info(f"Leaving saturated subtree: {reason}")
+
+    def stop(self, reason):
+        """
+        Stop exploring the app altogether
+        """
+        if self.stopped is None:
+            self.stopped = reason
+            logging.info(f"Stopping exploration early: {reason}")
+
+    def report(self):
+        """
+        Summarize discovery
+
+        Returns:
+            Dictionary with actions, discoveries, subtrees abandoned and why
+            exploration stopped early, if it did
+        """
+        return {
+            'actions': self.actions,
+            'discoveries': self.discoveries,
+            'abandoned_subtrees': self.abandoned,
+            'stopped': self.stopped
+        }
@@ -4,11 +4,22 @@ Main module for capturing iOS app screenshots
 import os
 import time
 import logging
-from time import sleep
-from ios_app_explorer.config import APP_LIST, SCREENSHOT_DIR, WAIT_AFTER_LAUNCH
+import argparse
+from ios_app_explorer import events, metrics, text_index, redaction
+from ios_app_explorer.config import (
+    APP_LIST, SCREENSHOT_DIR, WAIT_AFTER_LAUNCH, METRICS_PORT, TEXT_INDEX_PATH, RUN_BUDGET_MINUTES, BUDGET_MODE
+)
 from ios_app_explorer.logger import setup_logging
-from ios_app_explorer.driver import create_driver
+from ios_app_explorer.driver import create_driver, add_command_listener
+from ios_app_explorer.profiling import PhaseProfiler, phase, sleep, record_command
+from ios_app_explorer.output import save_screenshot, close_backends
+from ios_app_explorer.templates import TemplateClusters
+from ios_app_explorer.saturation import DiscoveryTracker
 from ios_app_explorer.navigation import navigate_and_capture_screenshots, restart_app
+from ios_app_explorer.flow_runner import run_app_flows
+from ios_app_explorer.restore import ScreenRestorer
+from ios_app_explorer.budget import BudgetAllocator, MODES, expired
+from ios_app_explorer.alerts import AlertInterceptor
 
 def create_folders(app_data):
     """
@@ -31,90 +42,191 @@ def create_folders(app_data):
 
     return app_screenshot_dir
 
-def take_app_screenshots(app_info):
+def take_app_screenshots(app_info, cprofile=False, trace_memory=False, budget=None):
     """
     Capture screenshots for a single app
     
+    A phase profile of the run is written next to the screenshots.
+    
     Args:
         app_info: App information dictionary
+        cprofile: Also capture a cProfile of the run
+        trace_memory: Also trace Python allocations with tracemalloc
+        budget: Optional seconds the app may take; the back test, flows and
+            exploration are cut short once they are used up
+        
+    Returns:
+        Number of distinct screens explored
     """
+    deadline = time.monotonic() + budget if budget is not None else None
     # Set up logging for this app
     setup_logging(app_info['name'])
     logging.info(f"Starting screenshot capture for {app_info['name']}")
     
     # Create screenshot directory
     app_screenshot_dir = create_folders(app_info)
+    metrics.set_current_app(app_info['name'])
+    events.start_app(app_info['name'])
+    if TEXT_INDEX_PATH:
+        text_index.open_index(TEXT_INDEX_PATH)
     
     # Create driver
     driver = None
+    profiler = PhaseProfiler(cprofile=cprofile, trace_memory=trace_memory)
+    profiler.start()
+    visited_screens = set()
     try:
-        driver = create_driver(app_info)
-        if not driver:
-            logging.error("Failed to create driver, skipping app")
-            return
-            
-        # Wait for app to fully load
-        sleep(WAIT_AFTER_LAUNCH)
-        
-        # Take initial screenshot
-        initial_screenshot_path = os.path.join(app_screenshot_dir, f"{app_info['name']}_initial.png")
-        driver.save_screenshot(initial_screenshot_path)
-        logging.info(f"Saved initial screenshot to {initial_screenshot_path}")
-        
-        # Try basic back navigation test
-        try:
-            driver.back()
-            sleep(1.5)
+        with phase('session_setup'):
+            driver = create_driver(app_info)
+            if not driver:
+                logging.error("Failed to create driver, skipping app")
+                return 0
+            add_command_listener(driver, record_command)
+            add_command_listener(driver, metrics.observe_command)
+                
+            # Wait for app to fully load
+            sleep(WAIT_AFTER_LAUNCH)
             
-            back_screenshot_path = os.path.join(app_screenshot_dir, f"{app_info['name']}_back.png")
-            driver.save_screenshot(back_screenshot_path)
-            logging.info(f"Saved back button screenshot to {back_screenshot_path}")
+            # Take initial screenshot
+            initial_screenshot_path = os.path.join(app_screenshot_dir, f"{app_info['name']}_initial.png")
+            save_screenshot(driver, initial_screenshot_path, {'kind': 'initial'})
+            logging.info(f"Saved initial screenshot to {initial_screenshot_path}")
             
-            # Restart app to ensure we're in a clean state
-            restart_app(driver, app_info)
-        except Exception as e:
-            logging.warning(f"Back button test failed: {e}")
+            # Try basic back navigation test, unless the budget is already used up
+            if not expired(deadline):
+                try:
+                    driver.back()
+                    sleep(1.5)
+                    
+                    back_screenshot_path = os.path.join(app_screenshot_dir, f"{app_info['name']}_back.png")
+                    save_screenshot(driver, back_screenshot_path, {'kind': 'back'})
+                    logging.info(f"Saved back button screenshot to {back_screenshot_path}")
+                    
+                    # Restart app to ensure we're in a clean state
+                    restart_app(driver, app_info)
+                except Exception as e:
+                    logging.warning(f"Back button test failed: {e}")
+        
+        # Run the app's scripted flows on the same session before exploring
+        if app_info.get('flows') and not expired(deadline):
+            with phase('flows'):
+                run_app_flows(driver, app_info, app_screenshot_dir, deadline=deadline)
+                restart_app(driver, app_info)
         
         # Start the main navigation and screenshot capture
         start_time = time.time()
         
+        restorer = ScreenRestorer(driver, app_info, deadline=deadline)
+        templates = TemplateClusters()
+        saturation = DiscoveryTracker()
+        alerts = AlertInterceptor(driver, app_info)
         navigate_and_capture_screenshots(
             driver=driver, 
             app_info=app_info, 
-            path=app_screenshot_dir
+            path=app_screenshot_dir,
+            visited_screens=visited_screens,
+            restorer=restorer,
+            templates=templates,
+            saturation=saturation,
+            deadline=deadline,
+            alerts=alerts
         )
+        profiler.add_section('restoration', restorer.report())
+        profiler.add_section('templates', templates.report())
+        profiler.add_section('saturation', saturation.report())
+        profiler.add_section('alerts', alerts.report())
+        if deadline is not None:
+            used_up = expired(deadline)
+            profiler.add_section('budget', {'seconds': round(budget, 1), 'used_up': used_up})
+            if used_up:
+                logging.info(f"Time budget of {budget / 60:.1f} minutes used up, stopped {app_info['name']} early")
 
         elapsed_time = time.time() - start_time
         logging.info(f"Finished screenshots for {app_info['name']} in {elapsed_time:.1f} seconds")
+        events.finish_app(seconds=round(elapsed_time, 1))
 
     except Exception as e:
         logging.error(f"Error processing {app_info['name']}: {e}", exc_info=True)
+        events.emit(events.ERROR, message=str(e))
     finally:
         if driver:
             logging.info("Quitting driver")
             driver.quit()
+        close_backends()
+        text_index.close_index()
+        profiler.stop()
+        redaction_report = redaction.report()
+        if redaction_report is not None:
+            profiler.add_section('redaction', redaction_report)
+        try:
+            profiler.write(app_screenshot_dir, app_info['name'])
+        except Exception as e:
+            logging.error(f"Failed to write profile: {e}")
         sleep(2)
+    return len(visited_screens)
+
+def parse_args(argv=None):
+    """
+    Parse the command line options of a run
+    """
+    parser = argparse.ArgumentParser(description="Explore iOS apps and capture screenshots")
+    parser.add_argument('--cprofile', action='store_true', help="Capture a cProfile of each app run")
+    parser.add_argument('--tracemalloc', action='store_true', help="Trace Python memory allocations")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="Serve live Prometheus metrics on this port")
+    parser.add_argument('--events', metavar='PATH', help="Append the exploration events to a JSON-lines file")
+    parser.add_argument('--budget', type=float, default=RUN_BUDGET_MINUTES, metavar='MINUTES',
+                        help="Wall-clock budget of the whole run, shared between the apps")
+    parser.add_argument('--budget-mode', choices=MODES, default=BUDGET_MODE,
+                        help="Share the budget equally, by app size in the previous run or by app priority")
+    return parser.parse_args(argv)
 
 def main():
     """
     Main function to process all apps
     """
+    args = parse_args()
+    
     # Set up initial logging
     setup_logging()
     logging.info("Starting iOS app screenshot capture script")
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
     
     # Validate configuration
     if not APP_LIST:
         logging.error("No apps configured in APP_LIST. Please add at least one app.")
         return
+    event_sink = events.JsonlSink(args.events) if args.events else None
+        
+    allocator = BudgetAllocator(APP_LIST, args.budget * 60, args.budget_mode) if args.budget else None
         
     # Process each app
     logging.info(f"Processing {len(APP_LIST)} apps")
     for app_data in APP_LIST:
+        budget = None
+        if allocator is not None:
+            budget = allocator.allocate(app_data)
+            if budget <= 0:
+                logging.warning(f"Run budget used up, skipping app: {app_data['name']}")
+                continue
         logging.info(f"Processing app: {app_data['name']}")
-        take_app_screenshots(app_data)
+        start_time = time.monotonic()
+        screens = take_app_screenshots(app_data, cprofile=args.cprofile, trace_memory=args.tracemalloc,
+                                       budget=budget)
+        if allocator is not None:
+            allocator.finish(app_data, time.monotonic() - start_time, screens)
     
     logging.info("Screenshot capture completed for all apps")
+    if allocator is not None:
+        report = allocator.report()
+        logging.info(f"Run budget: used {report['used'] / 60:.1f} of {report['total'] / 60:.1f} minutes")
+        for name, usage in report['apps'].items():
+            logging.info(f"  {name}: used {usage['used'] / 60:.1f} of {usage['budget'] / 60:.1f} minutes, "
+                         f"{usage['screens']} screens")
+    if event_sink is not None:
+        event_sink.close()
+    events.end_streams()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -3,82 +3,174 @@ Utilities for scrolling and capturing scrolled content
 """
 import os
 import logging
-from time import sleep
+import xml.etree.ElementTree as ET
+from ios_app_explorer.profiling import sleep
+from ios_app_explorer.output import save_screenshot
+from ios_app_explorer.element_utils import query_elements, visible_types_predicate
+from ios_app_explorer.snapshot import ElementRecord, ScreenState, screen_fingerprint, take_snapshot, find_by_id, find_by_text
+from ios_app_explorer.config import SCROLL_SETTLE_TIME, SCROLL_NATIVE_SEARCH
 
-def scroll_screen(driver, direction='down', percent=0.5):
+SCROLLABLE_TYPES = [
+    'XCUIElementTypeScrollView',
+    'XCUIElementTypeTable',
+    'XCUIElementTypeCollectionView'
+]
+
+# Window size of each session, fetched once
+_window_sizes = {}
+
+# Swipes from a screen's top at which an element was found, by
+# (screen fingerprint, locator type, locator)
+_scroll_positions = {}
+
+def window_size(driver):
     """
-    Scroll the screen in the specified direction
-    
+    Get the window size of a driver's session, querying the device only once per session
+
+    Args:
+        driver: Appium driver
+
+    Returns:
+        Dictionary with 'width' and 'height'
+    """
+    key = getattr(driver, 'session_id', None) or id(driver)
+    size = _window_sizes.get(key)
+    if size is None:
+        size = _window_sizes[key] = driver.get_window_size()
+    return size
+
+def find_scroll_container(state, direction='down'):
+    """
+    Pick the scroll container to use from a snapshot
+
+    Vertical scrolling uses the largest visible scrollable element; horizontal
+    scrolling uses the largest one that is wider than it is tall (a carousel or
+    pager) and falls back to the largest scrollable otherwise.
+
+    Args:
+        state: ScreenState of the current screen
+        direction: 'up', 'down', 'left' or 'right'
+
+    Returns:
+        ElementRecord of the container, or None if the snapshot has none
+    """
+    if state is None or not state.elements:
+        return None
+    candidates = [e for e in state.elements
+                  if e.type in SCROLLABLE_TYPES and e.visible and e.width > 0 and e.height > 0]
+    if direction in ('left', 'right'):
+        carousels = [e for e in candidates if e.width > e.height]
+        candidates = carousels or candidates
+    return max(candidates, key=lambda e: e.width * e.height, default=None)
+
+def query_scroll_container(driver, direction='down'):
+    """
+    Pick the scroll container with one query, when there is no snapshot
+
+    Args:
+        driver: Appium driver
+        direction: 'up', 'down', 'left' or 'right'
+
+    Returns:
+        ElementRecord of the container, or None if the screen has none
+    """
+    try:
+        records = query_elements(driver, SCROLLABLE_TYPES)
+    except Exception as e:
+        logging.error(f"Error querying scroll containers: {e}")
+        return None
+    elements = [
+        ElementRecord(i, -1, 0, record['type'], record.get('name') or '', record.get('label') or '', '',
+                      *record['rect'], True, bool(record.get('enabled')))
+        for i, record in enumerate(records) if record['rect']
+    ]
+    return find_scroll_container(ScreenState(0, tuple(elements)), direction)
+
+def scroll_screen(driver, direction='down', percent=0.5, container=None, settle=SCROLL_SETTLE_TIME):
+    """
+    Scroll the screen or a scroll container in the specified direction
+
+    The direction is the one the content moves into view from: 'down' reveals
+    what is below, so the finger moves up. The drag stays inside the container's
+    rect (clipped to the window) so nested scroll views scroll themselves rather
+    than their parent.
+
     Args:
         driver: Appium driver
         direction: 'up', 'down', 'left', or 'right'
-        percent: How much of the screen to scroll (0.0-1.0)
-    
+        percent: How much of the container to scroll (0.0-1.0)
+        container: Optional ElementRecord of the scroll container, defaults
+            to the whole window
+        settle: Seconds to wait for the scroll to settle
+
     Returns:
         True if scroll was successful, False otherwise
     """
     try:
-        window_size = driver.get_window_size()
-        width = window_size['width']
-        height = window_size['height']
-        
-        # Calculate start and end points for the swipe
+        size = window_size(driver)
+        if container is not None:
+            left = max(container.x, 0)
+            top = max(container.y, 0)
+            width = min(container.x + container.width, size['width']) - left
+            height = min(container.y + container.height, size['height']) - top
+        else:
+            left, top, width, height = 0, 0, size['width'], size['height']
+        if width <= 0 or height <= 0:
+            logging.debug("Scroll container is off screen")
+            return False
+
+        center_x = left + width * 0.5
+        center_y = top + height * 0.5
+        near = 0.5 + percent / 2
+        far = 0.5 - percent / 2
         if direction == 'down':
-            start_x = width * 0.5
-            start_y = height * 0.3
-            end_x = width * 0.5
-            end_y = height * (0.3 + percent)
+            start = (center_x, top + height * near)
+            end = (center_x, top + height * far)
         elif direction == 'up':
-            start_x = width * 0.5
-            start_y = height * 0.7
-            end_x = width * 0.5
-            end_y = height * (0.7 - percent)
+            start = (center_x, top + height * far)
+            end = (center_x, top + height * near)
         elif direction == 'right':
-            start_x = width * 0.2
-            start_y = height * 0.5
-            end_x = width * (0.2 + percent)
-            end_y = height * 0.5
+            start = (left + width * near, center_y)
+            end = (left + width * far, center_y)
         elif direction == 'left':
-            start_x = width * 0.8
-            start_y = height * 0.5
-            end_x = width * (0.8 - percent)
-            end_y = height * 0.5
+            start = (left + width * far, center_y)
+            end = (left + width * near, center_y)
         else:
             logging.error(f"Invalid direction: {direction}")
             return False
-        
-        # Execute the swipe
-        logging.debug(f"Scrolling {direction} by {percent*100}% of screen")
-        driver.swipe(start_x, start_y, end_x, end_y, 500)
-        sleep(1)  # Wait for scroll animation to complete
+
+        logging.debug(f"Scrolling {direction} by {percent*100}% of "
+                      f"{container.type if container is not None else 'screen'}")
+        driver.swipe(int(start[0]), int(start[1]), int(end[0]), int(end[1]), 300)
+        if settle:
+            sleep(settle)
         return True
     except Exception as e:
         logging.error(f"Error scrolling {direction}: {e}")
         return False
 
-def is_scrollable(driver):
+def is_scrollable(driver, state=None):
     """
     Check if the current screen appears to be scrollable
     
     Args:
         driver: Appium driver
+        state: Optional ScreenState of the current screen, checked instead of querying the device
         
     Returns:
         Boolean indicating if screen appears to be scrollable
     """
+    if state is not None and state.elements:
+        scrollable = any(e.type in SCROLLABLE_TYPES for e in state.elements)
+        logging.debug(f"Snapshot {'has' if scrollable else 'has no'} scrollable elements")
+        return scrollable
+
     try:
-        # Look for scrollable elements
-        scrollable_types = [
-            'XCUIElementTypeScrollView',
-            'XCUIElementTypeTable',
-            'XCUIElementTypeCollectionView'
-        ]
-        
-        for element_type in scrollable_types:
-            elements = driver.find_elements(by='class name', value=element_type)
-            if elements:
-                logging.debug(f"Found scrollable element of type: {element_type}")
-                return True
+        # Look for scrollable elements of any type at once
+        elements = driver.find_elements(by='-ios predicate string', value=visible_types_predicate(SCROLLABLE_TYPES))
+        if elements:
+            logging.debug("Found scrollable elements")
+            return True
         
         logging.debug("No scrollable elements found on screen")
         return False
@@ -86,86 +178,198 @@ def is_scrollable(driver):
         logging.error(f"Error checking if screen is scrollable: {e}")
         return False
 
-def capture_scrolled_screenshots(driver, app_info, path, base_name, max_scrolls=3):
+def capture_scrolled_screenshots(driver, app_info, path, base_name, max_scrolls=3, state=None, screen=None):
     """
     Scroll through a screen and capture screenshots at each position
     
+    The screen's main scroll container is scrolled (sideways if it is a
+    carousel). It is taken from the snapshot when there is one, and found
+    with a single query otherwise.
+    
     Args:
         driver: Appium driver
         app_info: App information dictionary
         path: Path to save screenshots
         base_name: Base name for the screenshot files
         max_scrolls: Maximum number of scrolls to perform
+        state: Optional ScreenState of the current screen
+        screen: Number of the screen being scrolled, recorded in the manifest
     """
-    if not is_scrollable(driver):
+    if state is not None and state.elements:
+        container = find_scroll_container(state)
+    else:
+        container = query_scroll_container(driver)
+    if container is None:
         logging.info("Screen doesn't appear to be scrollable, skipping scroll captures")
         return
     
+    forward, backward = 'down', 'up'
+    if container is not None and container.width > container.height:
+        forward, backward = 'right', 'left'
+    
     # Take initial screenshot before scrolling
     initial_path = os.path.join(path, f"{base_name}_scroll_0.png")
-    driver.save_screenshot(initial_path)
+    save_screenshot(driver, initial_path, {'kind': 'scroll', 'screen': screen, 'index': 0}, state=state)
     logging.info(f"Saved initial scroll screenshot to {initial_path}")
     
-    # Store page source to detect when content stops changing
-    previous_source = driver.page_source
+    # Store the screen fingerprint to detect when content stops changing
+    previous_fingerprint = state.fingerprint if state is not None else screen_fingerprint(driver)
     
-    # Scroll down and take screenshots
+    # Scroll and take screenshots until the content stops moving
+    scrolls = 0
     for i in range(1, max_scrolls + 1):
-        if scroll_screen(driver, 'down'):
-            sleep(1)  # Wait for content to settle
-            
-            # Check if page content changed after scrolling
-            current_source = driver.page_source
-            if hash(current_source) == hash(previous_source):
-                logging.info("Reached end of scrollable content")
-                break
-            
-            previous_source = current_source
-            
-            # Take screenshot after scrolling
-            scroll_path = os.path.join(path, f"{base_name}_scroll_{i}.png")
-            driver.save_screenshot(scroll_path)
-            logging.info(f"Saved scroll screenshot to {scroll_path}")
+        if not scroll_screen(driver, forward, container=container):
+            break
+        scrolls += 1
+        
+        # Check if page content changed after scrolling; the snapshot also
+        # locates what to redact in the screenshot
+        current = take_snapshot(driver)
+        current_fingerprint = current.fingerprint
+        if current_fingerprint == previous_fingerprint:
+            logging.info("Reached end of scrollable content")
+            scrolls -= 1
+            break
+        
+        previous_fingerprint = current_fingerprint
+        
+        # Take screenshot after scrolling
+        scroll_path = os.path.join(path, f"{base_name}_scroll_{i}.png")
+        save_screenshot(driver, scroll_path, {'kind': 'scroll', 'screen': screen, 'index': i}, state=current)
+        logging.info(f"Saved scroll screenshot to {scroll_path}")
     
-    # Scroll back to the top
-    logging.debug("Scrolling back to the top")
-    for _ in range(max_scrolls):
-        scroll_screen(driver, 'up')
+    # Scroll back as far as we scrolled, settling once at the end
+    logging.debug("Scrolling back to the start")
+    for _ in range(scrolls):
+        scroll_screen(driver, backward, container=container, settle=0)
+    if scrolls:
+        sleep(SCROLL_SETTLE_TIME)
+
+def _native_predicate(element_locator, locator_type):
+    """
+    Build the predicate for a native scroll-to-visible, or None if the locator has none
+    """
+    value = element_locator.replace("'", "\\'")
+    if locator_type == 'class name':
+        return f"type == '{value}'"
+    if locator_type == 'text':
+        return f"label == '{value}' OR name == '{value}' OR value == '{value}'"
+    return None
+
+def _match(state, element_locator, locator_type):
+    """
+    Find the elements of a snapshot matching a locator, without asking the device
+
+    XPath locators are evaluated with ElementTree's XPath subset against the
+    snapshot's source; unsupported expressions match nothing.
+    """
+    if locator_type == 'accessibility id':
+        return find_by_id(state, element_locator)
+    if locator_type == 'class name':
+        return [e for e in state.elements if e.type == element_locator]
+    if locator_type == 'text':
+        return find_by_text(state, element_locator)
+    if locator_type == 'xpath':
+        source = state.source
+        if source is None:
+            return []
+        try:
+            top = ET.fromstring(source)
+            base = top[0] if top.tag == 'AppiumAUT' and len(top) else top
+            positions = {id(node): i for i, node in enumerate(base.iter())}
+            path = '.' + element_locator if element_locator.startswith('/') else element_locator
+            return [state.elements[positions[id(node)]] for node in top.findall(path) if id(node) in positions]
+        except (ET.ParseError, SyntaxError, KeyError, IndexError) as e:
+            logging.debug(f"Cannot evaluate xpath {element_locator} locally: {e}")
+            return []
+    logging.error(f"Unsupported locator type: {locator_type}")
+    return []
+
+def _in_view(element, size):
+    center_x = element.x + element.width / 2
+    center_y = element.y + element.height / 2
+    return element.visible and 0 <= center_x <= size['width'] and 0 <= center_y <= size['height']
+
+def _find_in_view(driver, element_locator, locator_type):
+    """
+    Take a snapshot and return it with the first in-view match, if any
+    """
+    state = take_snapshot(driver, keep_source=locator_type == 'xpath')
+    size = window_size(driver)
+    for element in _match(state, element_locator, locator_type):
+        if _in_view(element, size):
+            return state, element
+    return state, None
 
 def scroll_to_element(driver, element_locator, locator_type='accessibility id', max_swipes=5):
     """
     Scroll until an element is visible
     
+    Lookups are made against parsed snapshots rather than device queries, so a
+    miss costs one source fetch instead of an implicit wait. The scroll offset
+    (in swipes) at which an element was found is remembered per starting screen
+    fingerprint, and later searches from the same screen jump straight there.
+    Without a remembered offset, a native scroll-to-visible is tried first for
+    accessibility id, text and class name locators, then a swipe-by-swipe search.
+    
     Args:
         driver: Appium driver
         element_locator: The identifier to find the element
-        locator_type: Type of locator (accessibility id, xpath, etc.)
+        locator_type: Type of locator ('accessibility id', 'text', 'class name' or 'xpath')
         max_swipes: Maximum number of swipes to attempt
         
     Returns:
-        The element if found, None otherwise
+        The matching ElementRecord of the final snapshot (tap it at
+        element_center), or None if it was not found
     """
-    for i in range(max_swipes):
-        try:
-            # Try to find the element
-            if locator_type == 'accessibility id':
-                element = driver.find_element(by='accessibility id', value=element_locator)
-            elif locator_type == 'xpath':
-                element = driver.find_element(by='xpath', value=element_locator)
-            elif locator_type == 'class name':
-                element = driver.find_element(by='class name', value=element_locator)
-            else:
-                logging.error(f"Unsupported locator type: {locator_type}")
-                return None
-            
-            # If element is found and displayed, return it
-            if element.is_displayed():
-                return element
-        except Exception:
-            # Element not found, scroll down and try again
-            scroll_screen(driver, 'down')
-            sleep(1)
+    state, element = _find_in_view(driver, element_locator, locator_type)
+    if element is not None:
+        return element
+    
+    key = (state.fingerprint, locator_type, element_locator)
+    container = find_scroll_container(state)
+    swipes = 0
+    
+    # Jump to where the element was seen last time from this screen
+    offset = _scroll_positions.get(key)
+    if offset is not None:
+        for _ in range(offset):
+            scroll_screen(driver, 'down', container=container, settle=0)
+        sleep(SCROLL_SETTLE_TIME)
+        swipes = offset
+        state, element = _find_in_view(driver, element_locator, locator_type)
+        if element is not None:
+            return element
+        logging.debug(f"'{element_locator}' moved away from its remembered scroll offset {offset}")
+    elif SCROLL_NATIVE_SEARCH:
+        if locator_type == 'accessibility id':
+            params = {'name': element_locator}
+        else:
+            predicate = _native_predicate(element_locator, locator_type)
+            params = {'predicateString': predicate} if predicate else None
+        if params is not None:
+            try:
+                driver.execute_script('mobile: scroll', params)
+                state, element = _find_in_view(driver, element_locator, locator_type)
+                if element is not None:
+                    return element
+            except Exception as e:
+                logging.debug(f"Native scroll to '{element_locator}' failed: {e}")
+    
+    # Swipe through the container, matching each position locally
+    previous_fingerprint = state.fingerprint
+    while swipes < max_swipes:
+        if not scroll_screen(driver, 'down', container=container):
+            break
+        swipes += 1
+        state, element = _find_in_view(driver, element_locator, locator_type)
+        if element is not None:
+            _scroll_positions[key] = swipes
+            return element
+        if state.fingerprint == previous_fingerprint:
+            break
+        previous_fingerprint = state.fingerprint
     
     # Element not found after max_swipes
-    logging.warning(f"Element '{element_locator}' not found after {max_swipes} swipes")
-    return None
\ No newline at end of file
+    logging.warning(f"Element '{element_locator}' not found after {swipes} swipes")
+    return None
@@ -0,0 +1,223 @@
+"""
+Parsed snapshots of the current screen's accessibility tree
+"""
+import re
+import sys
+import zlib
+import hashlib
+import logging
+import xml.etree.ElementTree as ET
+from ios_app_explorer.config import KEEP_COMPRESSED_SOURCE
+
+class ElementRecord:
+    """
+    One element of a parsed page source
+
+    Records are slot-based and share interned type strings, so a snapshot
+    costs a fraction of the equivalent dicts.
+    """
+    __slots__ = ('index', 'parent', 'depth', 'type', 'name', 'label', 'value',
+                 'x', 'y', 'width', 'height', 'visible', 'enabled')
+
+    def __init__(self, index, parent, depth, element_type, name, label, value,
+                 x, y, width, height, visible, enabled):
+        self.index = index
+        self.parent = parent
+        self.depth = depth
+        self.type = sys.intern(element_type)
+        self.name = name
+        self.label = label
+        self.value = value
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.visible = visible
+        self.enabled = enabled
+
+    @property
+    def rect(self):
+        return {'x': self.x, 'y': self.y, 'width': self.width, 'height': self.height}
+
+    @property
+    def text(self):
+        return self.value or self.label
+
+    def __repr__(self):
+        return f"<ElementRecord {self.type} name={self.name!r} label={self.label!r}>"
+
+class ScreenState:
+    """
+    Fingerprint and parsed elements of one screen
+
+    The raw XML is dropped once the screen is fingerprinted (or kept
+    zlib-compressed when KEEP_COMPRESSED_SOURCE is set), and the elements can be
+    released once the caller has extracted what it needs.
+    """
+    __slots__ = ('fingerprint', 'elements', '_compressed_source')
+
+    def __init__(self, fingerprint, elements, compressed_source=None):
+        self.fingerprint = fingerprint
+        self.elements = elements
+        self._compressed_source = compressed_source
+
+    @property
+    def source(self):
+        if self._compressed_source is None:
+            return None
+        return zlib.decompress(self._compressed_source).decode('utf-8')
+
+    def release_elements(self):
+        """
+        Drop the parsed elements, keeping only the fingerprint
+        """
+        self.elements = ()
+
+def fingerprint_source(source):
+    """
+    Compute a stable 64-bit fingerprint of a page source
+
+    Args:
+        source: XML page source
+
+    Returns:
+        Fingerprint as an int
+    """
+    return int.from_bytes(hashlib.blake2b(source.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def screen_fingerprint(driver):
+    """
+    Fingerprint the current screen without parsing it
+
+    Args:
+        driver: Appium driver
+
+    Returns:
+        Fingerprint as an int
+    """
+    return fingerprint_source(driver.page_source)
+
+def _int_attribute(node, name):
+    """
+    Read an integer attribute from a page source node, defaulting to 0
+    """
+    try:
+        return int(float(node.get(name, 0)))
+    except (TypeError, ValueError):
+        return 0
+
+def parse_page_source(source):
+    """
+    Parse an XCUITest page source into a flat tuple of element records
+
+    Args:
+        source: XML page source as returned by driver.page_source
+
+    Returns:
+        Tuple of ElementRecord in document order; each record knows the index
+        of its parent (-1 for the root) and its depth in the tree
+    """
+    root = ET.fromstring(source)
+    if root.tag == 'AppiumAUT' and len(root):
+        root = root[0]
+
+    elements = []
+    stack = [(root, -1, 0)]
+    while stack:
+        node, parent, depth = stack.pop()
+        index = len(elements)
+        elements.append(ElementRecord(
+            index, parent, depth,
+            node.get('type') or node.tag,
+            node.get('name') or '',
+            node.get('label') or '',
+            node.get('value') or '',
+            _int_attribute(node, 'x'),
+            _int_attribute(node, 'y'),
+            _int_attribute(node, 'width'),
+            _int_attribute(node, 'height'),
+            node.get('visible') == 'true',
+            node.get('enabled') == 'true'
+        ))
+        for child in reversed(list(node)):
+            stack.append((child, index, depth + 1))
+    return tuple(elements)
+
+def take_snapshot(driver, keep_source=KEEP_COMPRESSED_SOURCE):
+    """
+    Fetch the page source once, fingerprint it and parse it
+
+    Args:
+        driver: Appium driver
+        keep_source: Whether to keep a compressed copy of the XML
+
+    Returns:
+        ScreenState of the current screen
+    """
+    source = driver.page_source
+    try:
+        elements = parse_page_source(source)
+    except ET.ParseError as e:
+        logging.error(f"Could not parse page source: {e}")
+        elements = ()
+    compressed = zlib.compress(source.encode('utf-8')) if keep_source else None
+    return ScreenState(fingerprint_source(source), elements, compressed)
+
+def _text_candidates(element):
+    return [t for t in (element.label, element.name, element.value) if t]
+
+def _by_specificity(matches):
+    """
+    Order matches so that visible and smaller (more specific) elements come first
+    """
+    return sorted(matches, key=lambda e: (not e.visible, e.width * e.height))
+
+def find_by_text(snapshot, text):
+    """
+    Find elements whose label, name or value matches a text
+
+    An exact match wins; otherwise the text is treated as a regular expression
+    that must match the whole attribute, as Maestro does.
+
+    Args:
+        snapshot: ScreenState from take_snapshot
+        text: Text or regular expression to look for
+
+    Returns:
+        List of matching elements, most specific first
+    """
+    elements = snapshot.elements
+    matches = [e for e in elements if text in _text_candidates(e)]
+    if not matches:
+        try:
+            pattern = re.compile(text, re.DOTALL)
+        except re.error:
+            return []
+        matches = [e for e in elements
+                   if any(pattern.fullmatch(t) for t in _text_candidates(e))]
+    return _by_specificity(matches)
+
+def find_by_id(snapshot, identifier):
+    """
+    Find elements by accessibility identifier
+
+    Args:
+        snapshot: ScreenState from take_snapshot
+        identifier: Accessibility identifier (the 'name' attribute on iOS)
+
+    Returns:
+        List of matching elements, most specific first
+    """
+    return _by_specificity([e for e in snapshot.elements if e.name == identifier])
+
+def element_center(element):
+    """
+    Get the center point of an element's rect
+
+    Args:
+        element: ElementRecord from a snapshot
+
+    Returns:
+        Tuple of (x, y) coordinates
+    """
+    return element.x + element.width / 2, element.y + element.height / 2
@@ -0,0 +1,180 @@
+"""
+Grouping screens into layout templates by the structure of their trees
+"""
+import logging
+import threading
+from ios_app_explorer.config import TEMPLATE_SIMILARITY, TEMPLATE_MAX_INSTANCES
+
+def _short_type(element_type):
+    return element_type[15:] if element_type.startswith('XCUIElementType') else element_type
+
+def _collapse_repeats(types):
+    collapsed = []
+    for element_type in types:
+        if not collapsed or collapsed[-1] != element_type:
+            collapsed.append(element_type)
+    return ','.join(collapsed)
+
+def structure_features(elements):
+    """
+    Describe a screen's layout by the element types in its tree
+
+    Each element contributes its path of types from the root together with
+    the sequence of its children's types, with runs of the same type
+    collapsed. Texts, values and positions are left out, so screens that
+    show different data in the same layout get the same features, and lists
+    of different lengths look alike.
+
+    Args:
+        elements: Element records of a snapshot, in document order
+
+    Returns:
+        Frozenset of features such as 'Window/Table>StaticText,Cell'
+    """
+    paths = []
+    children = [[] for _ in elements]
+    for element in elements:
+        name = _short_type(element.type)
+        if element.parent >= 0:
+            paths.append(paths[element.parent] + '/' + name)
+            children[element.parent].append(name)
+        else:
+            paths.append(name)
+    return frozenset(path + '>' + _collapse_repeats(types) for path, types in zip(paths, children))
+
+def subtree_shapes(elements):
+    """
+    Compute a shape for the subtree under every element
+
+    Two subtrees have the same shape when their types match node by node,
+    with runs of same-shaped children collapsed; texts and positions are
+    ignored.
+
+    Args:
+        elements: Element records of a snapshot, in document order
+
+    Returns:
+        List of shapes (ints) indexed like elements
+    """
+    children = [[] for _ in elements]
+    for element in elements:
+        if element.parent >= 0:
+            children[element.parent].append(element.index)
+    shapes = [0] * len(elements)
+    for element in reversed(elements):
+        collapsed = []
+        for child in children[element.index]:
+            if not collapsed or collapsed[-1] != shapes[child]:
+                collapsed.append(shapes[child])
+        shapes[element.index] = hash((element.type, tuple(collapsed)))
+    return shapes
+
+def similarity(a, b):
+    """
+    Jaccard similarity of two feature sets
+    """
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class Template:
+    """
+    A layout shared by several screens
+
+    Attributes:
+        id: Template number, counting from 1 in order of discovery
+        features: Structure features of the first screen of the template
+        instances: Number of distinct screens assigned to the template
+        skipped: Number of those screens that were over the cap
+    """
+    __slots__ = ('id', 'features', 'instances', 'skipped')
+
+    def __init__(self, template_id, features):
+        self.id = template_id
+        self.features = features
+        self.instances = 0
+        self.skipped = 0
+
+    def __repr__(self):
+        return f"<Template {self.id} instances={self.instances} skipped={self.skipped}>"
+
+class TemplateClusters:
+    """
+    Incremental clustering of screens into templates, with a cap on how many
+    screens of each template are captured and explored
+
+    A screen joins the template whose first screen is most similar to it, if
+    the similarity reaches the threshold, and starts a new template otherwise.
+    Screens with exactly the same features are matched by a dictionary lookup.
+    The clusters can be shared by the threads of a crawl.
+    """
+
+    def __init__(self, threshold=TEMPLATE_SIMILARITY, cap=TEMPLATE_MAX_INSTANCES):
+        self.threshold = threshold
+        self.cap = cap
+        self.templates = []
+        self._exact = {}
+        self._screens = {}
+        self._lock = threading.Lock()
+
+    def _match(self, features):
+        template = self._exact.get(features)
+        if template is not None:
+            return template
+        best, best_score = None, self.threshold
+        for candidate in self.templates:
+            # Jaccard similarity cannot reach the threshold when sizes differ too much
+            smaller, larger = sorted((len(features), len(candidate.features)))
+            if larger and smaller / larger < best_score:
+                continue
+            score = similarity(features, candidate.features)
+            if score >= best_score:
+                best, best_score = candidate, score
+        if best is None:
+            best = Template(len(self.templates) + 1, features)
+            self.templates.append(best)
+        self._exact[features] = best
+        return best
+
+    def admit(self, state):
+        """
+        Assign a screen to its template and decide if it should be captured
+
+        Args:
+            state: ScreenState with parsed elements
+
+        Returns:
+            Tuple of the Template and a boolean that is False once the template
+            already has its cap of screens; a screen seen before gets the same
+            answer as the first time
+        """
+        with self._lock:
+            known = self._screens.get(state.fingerprint)
+            if known is not None:
+                return known
+            template = self._match(structure_features(state.elements))
+            template.instances += 1
+            admitted = self.cap is None or template.instances <= self.cap
+            if not admitted:
+                template.skipped += 1
+                if template.skipped == 1:
+                    logging.info(f"Template {template.id} reached {self.cap} screens, skipping further instances")
+            self._screens[state.fingerprint] = (template, admitted)
+            return template, admitted
+
+    def report(self):
+        """
+        Summarize the templates found
+
+        Returns:
+            Dictionary with the number of templates and screens, the screens
+            skipped, and the templates that had screens skipped
+        """
+        with self._lock:
+            return {
+                'templates': len(self.templates),
+                'screens': sum(t.instances for t in self.templates),
+                'skipped': sum(t.skipped for t in self.templates),
+                'capped': {t.id: {'instances': t.instances, 'skipped': t.skipped}
+                           for t in self.templates if t.skipped}
+            }
@@ -0,0 +1,266 @@
+"""
+Full-text index over the accessibility trees of captured screens
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+from ios_app_explorer.config import TEXT_INDEX_PATH, TEXT_INDEX_BATCH
+from ios_app_explorer.snapshot import ElementRecord
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS screens (
+    id INTEGER PRIMARY KEY,
+    app TEXT NOT NULL,
+    screenshot TEXT NOT NULL UNIQUE,
+    fingerprint TEXT NOT NULL,
+    level INTEGER,
+    captured_at REAL NOT NULL,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS screens_fingerprint ON screens (fingerprint);
+CREATE INDEX IF NOT EXISTS screens_app ON screens (app);
+CREATE TABLE IF NOT EXISTS trees (
+    fingerprint TEXT PRIMARY KEY,
+    elements BLOB NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS screen_text USING fts5(
+    texts, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+'''
+
+# Index the crawl writes to, if any
+_active = None
+
+def screen_texts(elements):
+    """
+    Collect the distinct labels, names and values of a screen's elements
+
+    Args:
+        elements: Element records of a snapshot
+
+    Returns:
+        The texts joined by newlines
+    """
+    seen = dict.fromkeys(t for e in elements for t in (e.label, e.name, e.value) if t)
+    return '\n'.join(seen)
+
+def encode_tree(elements):
+    """
+    Store element records as zlib-compressed JSON rows
+    """
+    rows = [[e.type, e.name, e.label, e.value, e.x, e.y, e.width, e.height,
+             e.visible, e.enabled, e.parent, e.depth] for e in elements]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+
+def decode_tree(blob):
+    """
+    Rebuild element records from encode_tree's output
+    """
+    rows = json.loads(zlib.decompress(blob))
+    return tuple(
+        ElementRecord(index, parent, depth, element_type, name, label, value, x, y, width, height, visible, enabled)
+        for index, (element_type, name, label, value, x, y, width, height, visible, enabled, parent, depth)
+        in enumerate(rows)
+    )
+
+class TextIndex:
+    """
+    SQLite FTS5 index of screen texts, with the element tree of every screen
+
+    Screens are keyed by screenshot path; trees are stored once per screen
+    fingerprint. Writes are committed every TEXT_INDEX_BATCH screens and on
+    close. One connection is shared by the crawl's threads under a lock.
+    """
+
+    def __init__(self, db_path=TEXT_INDEX_PATH, batch=TEXT_INDEX_BATCH):
+        self.db_path = db_path
+        self.batch = batch
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+        columns = {row[1] for row in self._connection.execute('PRAGMA table_info(screens)')}
+        if 'path' not in columns:
+            # Indexes written before action paths were recorded
+            self._connection.execute('ALTER TABLE screens ADD COLUMN path TEXT')
+
+    def add_screen(self, app, screenshot, state, level=None, path=None):
+        """
+        Index a captured screen
+
+        Args:
+            app: App name
+            screenshot: Path of the screen's screenshot
+            state: ScreenState with parsed elements
+            level: Depth of the screen
+            path: Optional list of the actions that reach the screen from the
+                app's root screen, for replaying the crawl later
+        """
+        fingerprint = format(state.fingerprint, '016x')
+        texts = screen_texts(state.elements)
+        tree = encode_tree(state.elements)
+        with self._lock:
+            connection = self._connection
+            row = connection.execute('SELECT id FROM screens WHERE screenshot = ?', (screenshot,)).fetchone()
+            if row is not None:
+                connection.execute('DELETE FROM screen_text WHERE rowid = ?', (row[0],))
+                connection.execute('DELETE FROM screens WHERE id = ?', (row[0],))
+            cursor = connection.execute(
+                'INSERT INTO screens (app, screenshot, fingerprint, level, captured_at, path) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (app, screenshot, fingerprint, level, time.time(), json.dumps(path) if path is not None else None)
+            )
+            connection.execute('INSERT INTO screen_text (rowid, texts) VALUES (?, ?)', (cursor.lastrowid, texts))
+            connection.execute('INSERT OR IGNORE INTO trees (fingerprint, elements) VALUES (?, ?)',
+                               (fingerprint, tree))
+            self._pending += 1
+            if self._pending >= self.batch:
+                connection.commit()
+                self._pending = 0
+
+    def search(self, query, app=None, limit=50, raw=False):
+        """
+        Find the screens showing a text
+
+        Args:
+            query: Text to look for; matched as a phrase unless raw is set
+            app: Optional app name to restrict the search to
+            limit: Maximum number of results
+            raw: Pass the query to FTS5 unchanged (AND/OR/NEAR, prefix*)
+
+        Returns:
+            List of dictionaries with app, screenshot, fingerprint, level and a
+            snippet, best matches first
+        """
+        match = query if raw else '"' + query.replace('"', '""') + '"'
+        sql = ('SELECT s.app, s.screenshot, s.fingerprint, s.level, '
+               "snippet(screen_text, 0, '[', ']', ' … ', 12) "
+               'FROM screen_text JOIN screens s ON s.id = screen_text.rowid '
+               'WHERE screen_text MATCH ?')
+        params = [match]
+        if app:
+            sql += ' AND s.app = ?'
+            params.append(app)
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [
+            {'app': a, 'screenshot': s, 'fingerprint': f, 'level': lvl, 'snippet': snippet}
+            for a, s, f, lvl, snippet in rows
+        ]
+
+    def load_tree(self, fingerprint):
+        """
+        Get the stored element tree of a screen
+
+        Args:
+            fingerprint: Screen fingerprint as an int or 16-digit hex string
+
+        Returns:
+            Tuple of ElementRecord, or None if the screen is not stored
+        """
+        if isinstance(fingerprint, int):
+            fingerprint = format(fingerprint, '016x')
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT elements FROM trees WHERE fingerprint = ?', (fingerprint,)
+            ).fetchone()
+        return decode_tree(row[0]) if row else None
+
+    def recorded_paths(self, app):
+        """
+        Get the screens of an app that were captured with their action paths
+
+        Args:
+            app: App name
+
+        Returns:
+            List of dictionaries with screenshot, fingerprint, level and path,
+            in capture order
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT screenshot, fingerprint, level, path FROM screens '
+                'WHERE app = ? AND path IS NOT NULL ORDER BY id', (app,)
+            ).fetchall()
+        return [
+            {'screenshot': screenshot, 'fingerprint': fingerprint, 'level': level, 'path': json.loads(path)}
+            for screenshot, fingerprint, level, path in rows
+        ]
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+def open_index(db_path=TEXT_INDEX_PATH):
+    """
+    Open the index the crawl records captured screens into
+
+    Args:
+        db_path: SQLite database path
+
+    Returns:
+        The TextIndex
+    """
+    global _active
+    if _active is None:
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        _active = TextIndex(db_path)
+        logging.info(f"Indexing screen texts into {db_path}")
+    return _active
+
+def close_index():
+    global _active
+    if _active is not None:
+        _active.close()
+        _active = None
+
+def record_screen(app, screenshot, state, level=None, path=None):
+    """
+    Index a captured screen in the open index (a no-op when none is open)
+    """
+    if _active is None or not state.elements:
+        return
+    try:
+        _active.add_screen(app, screenshot, state, level, path)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to index {screenshot}: {e}")
+
+def main():
+    """
+    Command line entry point for searching screen texts
+    """
+    parser = argparse.ArgumentParser(description="Find the screens that show a text")
+    parser.add_argument('query', help="Text to look for")
+    parser.add_argument('--app', help="Only search this app")
+    parser.add_argument('--db', default=TEXT_INDEX_PATH, help="Index database")
+    parser.add_argument('-n', '--limit', type=int, default=50)
+    parser.add_argument('--raw', action='store_true', help="Use FTS5 query syntax")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No index at {args.db}")
+        return
+    index = TextIndex(args.db)
+    start = time.perf_counter()
+    results = index.search(args.query, app=args.app, limit=args.limit, raw=args.raw)
+    elapsed = (time.perf_counter() - start) * 1000
+    for result in results:
+        print(f"{result['app']:<16} level {result['level']}  {result['screenshot']}\n    {result['snippet']}")
+    print(f"{len(results)} screens in {elapsed:.1f} ms")
+    index.close()
+
+if __name__ == '__main__':
+    main()
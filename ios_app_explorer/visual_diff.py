@@ -0,0 +1,431 @@
+"""
+Visual diff between the screenshots of two exploration runs
+"""
+import os
+import json
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from ios_app_explorer.config import (
+    DIFF_PIXEL_THRESHOLD, DIFF_CHANGED_RATIO, DIFF_SSIM_THRESHOLD, DIFF_SSIM_WINDOW,
+    DIFF_FINGERPRINT_MAX_DISTANCE, DIFF_MEMORY_MB, DIFF_CHUNK_PAIRS
+)
+from ios_app_explorer.logger import setup_logging
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+# Rough working memory per pixel while comparing a pair: about a dozen float64
+# planes are alive at once during SSIM
+BYTES_PER_PIXEL = 8 * 12
+
+def list_screenshots(run_dir):
+    """
+    List all screenshots of a run
+
+    Args:
+        run_dir: Root screenshot directory of the run
+
+    Returns:
+        Sorted list of paths relative to run_dir
+    """
+    screenshots = []
+    for root, _, files in os.walk(run_dir):
+        for filename in files:
+            if filename.lower().endswith('.png'):
+                screenshots.append(os.path.relpath(os.path.join(root, filename), run_dir))
+    return sorted(screenshots)
+
+def content_hash(path):
+    """
+    Compute the SHA-256 of a file's bytes
+
+    Args:
+        path: File to hash
+
+    Returns:
+        Hex digest string
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def image_fingerprint(path):
+    """
+    Compute a 64-bit difference hash of a screenshot
+
+    Screenshots of the same screen in two runs keep the same fingerprint (or one
+    within a few bits) even when their filenames differ.
+
+    Args:
+        path: Screenshot to fingerprint
+
+    Returns:
+        Fingerprint as an int
+    """
+    with Image.open(path) as img:
+        small = np.asarray(img.convert('L').resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def image_pixels(path):
+    """
+    Read the pixel count of a screenshot without decoding it
+
+    Args:
+        path: Screenshot path
+
+    Returns:
+        Width times height
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+    return width * height
+
+def pair_pixels(pair):
+    """
+    Pixel count of the larger screenshot of a pair, without decoding either
+    """
+    return max(image_pixels(pair['path_a']), image_pixels(pair['path_b']))
+
+def _box_mean(plane, radius):
+    """
+    Mean over a (2*radius+1)^2 window around every pixel using an integral image
+    """
+    size = 2 * radius + 1
+    padded = np.pad(plane, radius, mode='edge')
+    integral = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    window_sum = (integral[size:, size:] - integral[:-size, size:]
+                  - integral[size:, :-size] + integral[:-size, :-size])
+    return window_sum / (size * size)
+
+def ssim_map(a, b, window=DIFF_SSIM_WINDOW):
+    """
+    Compute the per-pixel structural similarity of two grayscale images
+
+    Args:
+        a: First image as a 2D float64 array in 0..255
+        b: Second image with the same shape
+        window: Odd side length of the averaging window
+
+    Returns:
+        2D array of SSIM values
+    """
+    radius = window // 2
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    mu_a = _box_mean(a, radius)
+    mu_b = _box_mean(b, radius)
+    var_a = _box_mean(a * a, radius) - mu_a * mu_a
+    var_b = _box_mean(b * b, radius) - mu_b * mu_b
+    cov = _box_mean(a * b, radius) - mu_a * mu_b
+    numerator = (2 * mu_a * mu_b + c1) * (2 * cov + c2)
+    denominator = (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    return numerator / denominator
+
+def write_heatmap(base, heat, heatmap_path):
+    """
+    Write a heatmap of the changed regions over a dimmed copy of the screenshot
+
+    Args:
+        base: Grayscale image the heatmap is drawn on
+        heat: Per-pixel change intensity in 0..1
+        heatmap_path: Output PNG path
+    """
+    dimmed = base * 0.35
+    rgb = np.empty(base.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = dimmed + heat * (255 - dimmed)
+    rgb[..., 1] = dimmed * (1 - heat)
+    rgb[..., 2] = dimmed * (1 - heat)
+    os.makedirs(os.path.dirname(heatmap_path), exist_ok=True)
+    Image.fromarray(rgb).save(heatmap_path)
+
+def compare_images(path_a, path_b, heatmap_path=None):
+    """
+    Compute pixel and structural similarity between two screenshots
+
+    Args:
+        path_a: Screenshot from the first run
+        path_b: Screenshot from the second run
+        heatmap_path: Where to write the diff heatmap if the pair changed
+
+    Returns:
+        Dictionary with the diff metrics and status
+    """
+    with Image.open(path_a) as img_a, Image.open(path_b) as img_b:
+        size_changed = img_a.size != img_b.size
+        gray_a = img_a.convert('L')
+        gray_b = img_b.convert('L')
+        if size_changed:
+            gray_b = gray_b.resize(gray_a.size, Image.Resampling.BILINEAR)
+        a = np.asarray(gray_a, dtype=np.float64)
+        b = np.asarray(gray_b, dtype=np.float64)
+
+    abs_diff = np.abs(a - b)
+    changed_ratio = float(np.count_nonzero(abs_diff > DIFF_PIXEL_THRESHOLD)) / abs_diff.size
+    similarity = ssim_map(a, b)
+    mean_ssim = float(similarity.mean())
+
+    changed = (size_changed or changed_ratio > DIFF_CHANGED_RATIO
+               or mean_ssim < DIFF_SSIM_THRESHOLD)
+    if changed and heatmap_path:
+        heat = np.clip(np.maximum(abs_diff / 255, 1 - similarity), 0, 1)
+        write_heatmap(b, heat, heatmap_path)
+
+    return {
+        'status': 'changed' if changed else 'unchanged',
+        'size_changed': size_changed,
+        'changed_ratio': round(changed_ratio, 6),
+        'mean_abs_diff': round(float(abs_diff.mean()), 4),
+        'ssim': round(mean_ssim, 6),
+        'heatmap': heatmap_path if changed and heatmap_path else None
+    }
+
+def _compare_chunk(chunk, out_dir):
+    """
+    Compare a chunk of pairs in a worker process
+    """
+    results = []
+    for pair in chunk:
+        heatmap_path = os.path.join(out_dir, 'heatmaps', os.path.splitext(pair['a'])[0] + '_diff.png')
+        try:
+            pair.update(compare_images(pair['path_a'], pair['path_b'], heatmap_path))
+        except Exception as e:
+            pair.update({'status': 'error', 'error': str(e)})
+        results.append(pair)
+    return results
+
+def _pair_by_fingerprint(pool, leftover_a, leftover_b, run_a, run_b):
+    """
+    Pair leftover screenshots of the same directory by nearest image fingerprint
+    """
+    if not leftover_a or not leftover_b:
+        return []
+    fingerprints_a = list(pool.map(image_fingerprint, [os.path.join(run_a, p) for p in leftover_a], chunksize=32))
+    fingerprints_b = list(pool.map(image_fingerprint, [os.path.join(run_b, p) for p in leftover_b], chunksize=32))
+
+    pairs = []
+    for directory in sorted({os.path.dirname(p) for p in leftover_a}):
+        idx_a = [i for i, p in enumerate(leftover_a) if os.path.dirname(p) == directory]
+        idx_b = [i for i, p in enumerate(leftover_b) if os.path.dirname(p) == directory]
+        if not idx_b:
+            continue
+        fa = np.array([fingerprints_a[i] for i in idx_a], dtype=np.uint64)
+        fb = np.array([fingerprints_b[i] for i in idx_b], dtype=np.uint64)
+        distances = np.bitwise_count(fa[:, None] ^ fb[None, :])
+
+        # Greedily take the closest pairs first
+        used_a, used_b = set(), set()
+        for flat in np.argsort(distances, axis=None, kind='stable'):
+            i, j = divmod(int(flat), len(idx_b))
+            if distances[i, j] > DIFF_FINGERPRINT_MAX_DISTANCE:
+                break
+            if i in used_a or j in used_b:
+                continue
+            used_a.add(i)
+            used_b.add(j)
+            pairs.append((leftover_a[idx_a[i]], leftover_b[idx_b[j]]))
+    return pairs
+
+def pair_screenshots(pool, run_a, run_b):
+    """
+    Pair the screenshots of two runs
+
+    Pairs are matched by identical relative path first, then by identical content
+    hash, then by nearest image fingerprint within the same app directory.
+
+    Args:
+        pool: Process pool used for hashing and fingerprinting
+        run_a: Root screenshot directory of the first run
+        run_b: Root screenshot directory of the second run
+
+    Returns:
+        Tuple of (pairs, only_in_a, only_in_b); pairs are dicts with both paths
+        and their content hashes
+    """
+    files_a = list_screenshots(run_a)
+    files_b = list_screenshots(run_b)
+    hashes_a = dict(zip(files_a, pool.map(content_hash, [os.path.join(run_a, p) for p in files_a], chunksize=64)))
+    hashes_b = dict(zip(files_b, pool.map(content_hash, [os.path.join(run_b, p) for p in files_b], chunksize=64)))
+
+    matched = [(p, p) for p in files_a if p in hashes_b]
+    leftover_a = [p for p in files_a if p not in hashes_b]
+    leftover_b = [p for p in files_b if p not in hashes_a]
+
+    by_hash_b = {}
+    for p in leftover_b:
+        by_hash_b.setdefault(hashes_b[p], []).append(p)
+    still_a = []
+    for p in leftover_a:
+        candidates = by_hash_b.get(hashes_a[p])
+        if candidates:
+            matched.append((p, candidates.pop(0)))
+        else:
+            still_a.append(p)
+    paired_b = {b for _, b in matched}
+    still_b = [p for p in leftover_b if p not in paired_b]
+
+    fingerprint_pairs = _pair_by_fingerprint(pool, still_a, still_b, run_a, run_b)
+    matched.extend(fingerprint_pairs)
+    paired_a = {a for a, _ in matched}
+    paired_b = {b for _, b in matched}
+
+    pairs = [{
+        'a': a,
+        'b': b,
+        'path_a': os.path.join(run_a, a),
+        'path_b': os.path.join(run_b, b),
+        'hash_a': hashes_a[a],
+        'hash_b': hashes_b[b]
+    } for a, b in matched]
+    only_in_a = [p for p in files_a if p not in paired_a]
+    only_in_b = [p for p in files_b if p not in paired_b]
+    return pairs, only_in_a, only_in_b
+
+def comparison_workers(pixels, workers, memory_budget):
+    """
+    Number of workers that can compare pairs at once within a memory budget
+
+    A worker holds one pair at a time, so the peak is the number of workers
+    times the largest pair, whatever the chunking.
+
+    Args:
+        pixels: Pixel counts of the pairs to compare
+        workers: Worker processes available
+        memory_budget: Bytes all workers may use together
+
+    Returns:
+        Number of comparison workers, at least 1
+    """
+    largest = max(pixels, default=0) * BYTES_PER_PIXEL
+    if largest > memory_budget:
+        logging.warning(f"The largest pair needs about {largest // (1024 * 1024)} MB, over the diff memory budget")
+    return max(1, min(workers, memory_budget // largest if largest else workers))
+
+def _chunk_pairs(pairs, size):
+    """
+    Split pairs into chunks of a few pairs each
+    """
+    for start in range(0, len(pairs), size):
+        yield pairs[start:start + size]
+
+def diff_runs(run_a, run_b, out_dir, workers=None, memory_mb=DIFF_MEMORY_MB):
+    """
+    Diff every screenshot of two runs and write heatmaps and a summary
+
+    Pairs with identical content hashes are reported as identical without being
+    decoded. The rest are compared in a process pool of as many workers as
+    can each hold the largest pair within memory_mb, a few pairs per task, and
+    at most two tasks per worker are in flight at any time.
+
+    Args:
+        run_a: Root screenshot directory of the first run
+        run_b: Root screenshot directory of the second run
+        out_dir: Directory for heatmaps and summary.json
+        workers: Number of worker processes (defaults to the CPU count)
+        memory_mb: Memory budget of all comparison workers together
+
+    Returns:
+        Summary dictionary, or None if the diff dependencies are missing
+    """
+    if np is None or Image is None:
+        logging.error("Visual diff requires numpy and pillow (pip install 'iphone-screenshooter[diff]')")
+        return None
+
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pairs, only_in_a, only_in_b = pair_screenshots(pool, run_a, run_b)
+        logging.info(f"Paired {len(pairs)} screenshots ({len(only_in_a)} removed, {len(only_in_b)} added)")
+
+        to_compare = []
+        for pair in pairs:
+            if pair['hash_a'] == pair['hash_b']:
+                pair['status'] = 'identical'
+                results.append(pair)
+            else:
+                to_compare.append(pair)
+        logging.info(f"Skipped {len(results)} identical pairs, comparing {len(to_compare)}")
+
+        pixels = list(pool.map(pair_pixels, to_compare, chunksize=64))
+
+    compare_workers = comparison_workers(pixels, workers, memory_mb * 1024 * 1024)
+    if compare_workers < workers:
+        logging.info(f"Comparing on {compare_workers} of {workers} workers to stay within {memory_mb} MB")
+    with ProcessPoolExecutor(max_workers=compare_workers) as pool:
+        in_flight = set()
+        for chunk in _chunk_pairs(to_compare, DIFF_CHUNK_PAIRS):
+            if len(in_flight) >= 2 * compare_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.extend(future.result())
+            in_flight.add(pool.submit(_compare_chunk, chunk, out_dir))
+        for future in in_flight:
+            results.extend(future.result())
+
+    summary = summarize(results, only_in_a, only_in_b)
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    logging.info(
+        f"Diff finished: {summary['counts']['changed']} changed, "
+        f"{summary['counts']['unchanged']} unchanged, {summary['counts']['identical']} identical, "
+        f"{summary['counts']['error']} errors"
+    )
+    return summary
+
+def summarize(results, only_in_a, only_in_b):
+    """
+    Build the changed/unchanged summary of a diff
+
+    Args:
+        results: Compared pairs
+        only_in_a: Screenshots present only in the first run
+        only_in_b: Screenshots present only in the second run
+
+    Returns:
+        Summary dictionary
+    """
+    counts = {'identical': 0, 'unchanged': 0, 'changed': 0, 'error': 0}
+    for result in results:
+        counts[result['status']] += 1
+    counts['removed'] = len(only_in_a)
+    counts['added'] = len(only_in_b)
+
+    pairs = []
+    for result in sorted(results, key=lambda r: r['a']):
+        entry = {k: v for k, v in result.items() if k not in ('path_a', 'path_b', 'hash_a', 'hash_b')}
+        pairs.append(entry)
+    return {
+        'counts': counts,
+        'pairs': pairs,
+        'removed': only_in_a,
+        'added': only_in_b
+    }
+
+def main():
+    """
+    Command line entry point for diffing two runs
+    """
+    parser = argparse.ArgumentParser(description="Diff the screenshots of two exploration runs")
+    parser.add_argument('run_a', help="Screenshot directory of the baseline run")
+    parser.add_argument('run_b', help="Screenshot directory of the new run")
+    parser.add_argument('-o', '--out', default='./screenshot_diff', help="Output directory")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Worker processes")
+    parser.add_argument('--memory-mb', type=int, default=DIFF_MEMORY_MB,
+                        help="Memory budget of all comparison workers together")
+    args = parser.parse_args()
+
+    setup_logging('visual_diff')
+    diff_runs(args.run_a, args.run_b, args.out, workers=args.workers, memory_mb=args.memory_mb)
+
+if __name__ == '__main__':
+    main()
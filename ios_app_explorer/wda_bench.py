@@ -0,0 +1,180 @@
+"""
+Benchmark of the WDA fast path against a local stand-in WebDriverAgent
+"""
+import json
+import time
+import base64
+import logging
+import argparse
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ios_app_explorer.wda_client import WdaClient
+
+STAND_IN_SESSION = 'stand-in-session'
+STAND_IN_SOURCE = '<?xml version="1.0" encoding="UTF-8"?><AppiumAUT>' + (
+    '<XCUIElementTypeButton type="XCUIElementTypeButton" name="b" label="b" '
+    'enabled="true" visible="true" x="0" y="0" width="10" height="10"/>' * 400
+) + '</AppiumAUT>'
+STAND_IN_SCREENSHOT = base64.b64encode(bytes(300 * 1024)).decode('ascii')
+
+class _StandInWdaHandler(BaseHTTPRequestHandler):
+    """
+    Answers the fast path commands like WebDriverAgent, after the injected latency
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, value):
+        time.sleep(self.server.latency)
+        body = json.dumps({'value': value, 'sessionId': STAND_IN_SESSION}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            # Like WebDriverAgent, the session id is only at the top level
+            self._reply({'ready': True})
+        elif self.path.endswith('/source'):
+            self._reply(STAND_IN_SOURCE)
+        elif self.path.endswith('/screenshot'):
+            self._reply(STAND_IN_SCREENSHOT)
+        else:
+            self._reply({'error': 'unknown command', 'message': self.path})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/elements'):
+            self._reply([{'ELEMENT': f'element-{i}'} for i in range(20)])
+        else:
+            self._reply(None)
+
+class _StandInAppiumHandler(BaseHTTPRequestHandler):
+    """
+    Forwards every request to the stand-in WebDriverAgent like the Appium proxy does
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _forward(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else None
+        time.sleep(self.server.latency)
+        upstream = http.client.HTTPConnection('127.0.0.1', self.server.upstream_port)
+        upstream.request(self.command, self.path, body=body,
+                         headers={'Content-Type': 'application/json'})
+        response = upstream.getresponse()
+        data = response.read()
+        upstream.close()
+        self.send_response(response.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _forward
+    do_POST = _forward
+
+def start_server(handler, latency, upstream_port=None):
+    """
+    Start a stand-in server on a free local port in a background thread
+
+    Args:
+        handler: Request handler class
+        latency: Seconds to wait before answering each request
+        upstream_port: Port of the stand-in WebDriverAgent for the proxy
+
+    Returns:
+        The running server
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.upstream_port = upstream_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _time_commands(client, iterations):
+    """
+    Time each fast path command over a number of iterations, in milliseconds per call
+    """
+    client.attach()
+    commands = {
+        'source': client.source,
+        'screenshot': client.screenshot_png,
+        'tap': lambda: client.tap(10, 10),
+        'swipe': lambda: client.swipe(10, 300, 10, 100, 200),
+        'find': lambda: client.find_elements('class name', 'XCUIElementTypeButton')
+    }
+    timings = {}
+    for name, command in commands.items():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            command()
+        timings[name] = (time.perf_counter() - start) * 1000 / iterations
+    client.close()
+    return timings
+
+def run_benchmark(iterations=100, latency=0.005, proxy_latency=0.003):
+    """
+    Compare direct pooled, direct unpooled and proxied access to a stand-in WDA
+
+    Args:
+        iterations: Calls per command and mode
+        latency: Injected WebDriverAgent latency in seconds
+        proxy_latency: Injected Appium proxy latency in seconds
+
+    Returns:
+        Dictionary of mode -> {command: milliseconds per call}
+    """
+    wda = start_server(_StandInWdaHandler, latency)
+    wda_port = wda.server_address[1]
+    proxy = start_server(_StandInAppiumHandler, proxy_latency, upstream_port=wda_port)
+    proxy_port = proxy.server_address[1]
+    try:
+        results = {
+            'direct (keep-alive pool)': _time_commands(WdaClient('127.0.0.1', wda_port), iterations),
+            'direct (new connection)': _time_commands(
+                WdaClient('127.0.0.1', wda_port, keep_alive=False), iterations),
+            'via appium proxy': _time_commands(WdaClient('127.0.0.1', proxy_port), iterations)
+        }
+    finally:
+        proxy.shutdown()
+        wda.shutdown()
+    return results
+
+def format_results(results):
+    """
+    Format benchmark results as a table
+    """
+    commands = list(next(iter(results.values())).keys())
+    lines = [f"{'mode':<28}" + ''.join(f"{c:>12}" for c in commands)]
+    for mode, timings in results.items():
+        lines.append(f"{mode:<28}" + ''.join(f"{timings[c]:>10.2f}ms" for c in commands))
+    return '\n'.join(lines)
+
+def main():
+    """
+    Command line entry point for the fast path benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the WDA fast path against a stand-in server")
+    parser.add_argument('-n', '--iterations', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="Injected WDA latency")
+    parser.add_argument('--proxy-latency-ms', type=float, default=3.0, help="Injected Appium proxy latency")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    results = run_benchmark(args.iterations, args.latency_ms / 1000, args.proxy_latency_ms / 1000)
+    print(format_results(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,434 @@
+"""
+Direct WebDriverAgent client for the hottest commands
+"""
+import json
+import queue
+import socket
+import base64
+import logging
+import http.client
+from selenium.common.exceptions import NoSuchElementException, NoAlertPresentException
+from ios_app_explorer.config import WDA_HOST, WDA_PORT, WDA_POOL_SIZE, WDA_TIMEOUT
+
+# Appium locator strategies and their WebDriverAgent names
+WDA_LOCATORS = {
+    'accessibility id': 'accessibility id',
+    'class name': 'class name',
+    'xpath': 'xpath',
+    'name': 'name',
+    '-ios predicate string': 'predicate string',
+    '-ios class chain': 'class chain'
+}
+
+# Consecutive failures after which the fast path gives up and stays on Appium
+MAX_FAST_PATH_FAILURES = 3
+
+class WdaError(Exception):
+    """
+    Raised when WebDriverAgent answers with an error or cannot be reached
+
+    Attributes:
+        error: WebDriver error code of the response, such as 'no such alert'
+    """
+
+    def __init__(self, message, error=None):
+        super().__init__(message)
+        self.error = error
+
+def decode_response(method, path, status, data, full=False):
+    """
+    Decode a WebDriverAgent response body
+
+    Args:
+        method: HTTP method of the request
+        path: Request path
+        status: HTTP status code
+        data: Response body
+        full: Return the whole decoded body instead of its 'value'
+
+    Returns:
+        The decoded 'value' field of the response, or the whole body with full
+    """
+    try:
+        decoded = json.loads(data) if data else {}
+    except ValueError as e:
+        raise WdaError(f"{method} {path} returned invalid JSON") from e
+    value = decoded.get('value')
+    if status >= 400 or (isinstance(value, dict) and 'error' in value):
+        error = value.get('error') if isinstance(value, dict) else None
+        message = value.get('message', error) if isinstance(value, dict) else value
+        raise WdaError(f"{method} {path} returned {status}: {message}", error)
+    return decoded if full else value
+
+def session_from_status(body):
+    """
+    Get the active session id from a decoded /status response
+
+    WebDriverAgent reports the session at the top level of the body, next to
+    'value', not inside it.
+
+    Args:
+        body: Whole decoded /status body
+
+    Returns:
+        The session id
+
+    Raises:
+        WdaError: If WebDriverAgent has no active session
+    """
+    session_id = body.get('sessionId') if isinstance(body, dict) else None
+    if not session_id:
+        raise WdaError("WebDriverAgent has no active session")
+    return session_id
+
+class _NoDelayConnection(http.client.HTTPConnection):
+    """
+    HTTP connection with Nagle's algorithm off, so small commands are not delayed
+    """
+
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+class WdaClient:
+    """
+    Minimal HTTP client for WebDriverAgent with a pool of keep-alive connections
+    """
+
+    def __init__(self, host=WDA_HOST, port=WDA_PORT, timeout=WDA_TIMEOUT,
+                 pool_size=WDA_POOL_SIZE, keep_alive=True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.session_id = None
+        self._response_settings = None
+        self._pool = queue.LifoQueue(maxsize=max(pool_size, 1))
+
+    def _connection(self):
+        """
+        Take a kept-alive connection from the pool, or open a new one
+
+        Returns:
+            (connection, True if it came from the pool)
+        """
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return _NoDelayConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        if not self.keep_alive:
+            connection.close()
+            return
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, payload=None, full=False):
+        """
+        Send a request to WebDriverAgent and return the 'value' of the response
+
+        A pooled connection the server closed while it sat idle is replaced and
+        the request sent again, once. Nothing else is retried: after a timeout
+        or a failure on a new connection WebDriverAgent may already have run
+        the command, and a tap or swipe must not run twice.
+
+        Args:
+            method: HTTP method
+            path: Request path
+            payload: Optional JSON body
+            full: Return the whole decoded body instead of its 'value'
+
+        Returns:
+            The decoded 'value' field of the response, or the whole body with full
+        """
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json'}
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+
+        for attempt in range(2):
+            connection, reused = self._connection()
+            sent = False
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                # The server had closed the idle connection: the request failed
+                # to go out, or the connection ended before any response byte
+                closed = isinstance(e, http.client.RemoteDisconnected) or (
+                    not sent and isinstance(e, (BrokenPipeError, ConnectionResetError)))
+                if reused and closed and attempt == 0:
+                    continue
+                raise WdaError(f"{method} {path} failed: {e}") from e
+            self._release(connection)
+            break
+
+        return decode_response(method, path, response.status, data, full)
+
+    def close(self):
+        """
+        Close every pooled connection
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def attach(self):
+        """
+        Attach to the session WebDriverAgent is running for Appium
+
+        Returns:
+            The WebDriverAgent session id
+        """
+        self.session_id = session_from_status(self.request('GET', '/status', full=True))
+        return self.session_id
+
+    def source(self):
+        return self.request('GET', f'/session/{self.session_id}/source')
+
+    def screenshot_png(self):
+        return base64.b64decode(self.request('GET', '/screenshot'))
+
+    def tap(self, x, y):
+        self.request('POST', f'/session/{self.session_id}/wda/tap', {'x': x, 'y': y})
+
+    def swipe(self, start_x, start_y, end_x, end_y, duration_ms=0):
+        self.request('POST', f'/session/{self.session_id}/wda/dragfromtoforduration', {
+            'fromX': start_x, 'fromY': start_y,
+            'toX': end_x, 'toY': end_y,
+            'duration': max(duration_ms, 0) / 1000
+        })
+
+    def alert_text(self):
+        """
+        Get the text of the alert on screen, including system alerts
+
+        Returns:
+            The alert text, or None when no alert is shown
+        """
+        try:
+            return self.request('GET', f'/session/{self.session_id}/alert/text') or ''
+        except WdaError as e:
+            if e.error == 'no such alert':
+                return None
+            raise
+
+    def handle_alert(self, action):
+        """
+        Accept or dismiss the alert on screen
+
+        Args:
+            action: 'accept' or 'dismiss'
+        """
+        self.request('POST', f'/session/{self.session_id}/alert/{action}', {})
+
+    def find_elements(self, using, value):
+        """
+        Find elements and return their ids
+
+        Args:
+            using: WebDriverAgent locator strategy
+            value: Locator value
+
+        Returns:
+            List of element ids
+        """
+        found = self.request('POST', f'/session/{self.session_id}/elements',
+                             {'using': using, 'value': value}) or []
+        return [e.get('ELEMENT') or e.get('element-6066-11e4-a52e-4f735466cecf') for e in found]
+
+    def find_element_records(self, using, value, attributes):
+        """
+        Find elements and return their attributes in the same response
+
+        WebDriverAgent includes element attributes in find responses when
+        compact responses are turned off; the settings are sent once per session.
+
+        Args:
+            using: WebDriverAgent locator strategy
+            value: Locator value
+            attributes: Attribute names to include, e.g. ['type', 'label', 'rect'];
+                'attribute/<name>' reads an attribute by name
+
+        Returns:
+            List of dictionaries with the element 'id' and the requested
+            attributes, 'attribute/<name>' ones under <name>
+        """
+        settings = (self.session_id, tuple(attributes))
+        if self._response_settings != settings:
+            self.request('POST', f'/session/{self.session_id}/appium/settings', {'settings': {
+                'shouldUseCompactResponses': False,
+                'elementResponseAttributes': ','.join(attributes)
+            }})
+            self._response_settings = settings
+        found = self.request('POST', f'/session/{self.session_id}/elements',
+                             {'using': using, 'value': value}) or []
+        records = []
+        for e in found:
+            record = {name.split('/')[-1]: e.get(name) for name in attributes}
+            record['id'] = e.get('ELEMENT') or e.get('element-6066-11e4-a52e-4f735466cecf')
+            records.append(record)
+        return records
+
+class FastPathDriver:
+    """
+    Appium driver wrapper that sends source, screenshot, tap, swipe and find
+    straight to WebDriverAgent
+
+    Everything else, including session management, goes through the wrapped
+    Appium driver. Any fast path failure falls back to Appium for that call, and
+    repeated failures turn the fast path off for the rest of the session. Direct
+    finds do not honour Appium's implicit wait.
+    """
+
+    def __init__(self, driver, client):
+        self._driver = driver
+        self.wda = client
+        self.failures = 0
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+    @property
+    def fast_path_enabled(self):
+        return self.failures < MAX_FAST_PATH_FAILURES
+
+    def _direct(self, command, *args):
+        """
+        Run a command on WebDriverAgent, returning (True, result) or (False, None) on failure
+        """
+        if not self.fast_path_enabled:
+            return False, None
+        try:
+            result = command(*args)
+            self.failures = 0
+            return True, result
+        except WdaError as e:
+            self.failures += 1
+            logging.debug(f"WDA fast path failed, using Appium: {e}")
+            if not self.fast_path_enabled:
+                logging.warning("WDA fast path disabled after repeated failures")
+            return False, None
+
+    @property
+    def page_source(self):
+        ok, source = self._direct(self.wda.source)
+        return source if ok else self._driver.page_source
+
+    def get_screenshot_as_png(self):
+        ok, png = self._direct(self.wda.screenshot_png)
+        return png if ok else self._driver.get_screenshot_as_png()
+
+    def get_screenshot_as_base64(self):
+        return base64.b64encode(self.get_screenshot_as_png()).decode('ascii')
+
+    def save_screenshot(self, filename):
+        png = self.get_screenshot_as_png()
+        with open(filename, 'wb') as f:
+            f.write(png)
+        return True
+
+    def tap(self, positions, duration=None):
+        if len(positions) == 1 and not duration:
+            ok, _ = self._direct(self.wda.tap, *positions[0])
+            if ok:
+                return self
+        return self._driver.tap(positions, duration)
+
+    def swipe(self, start_x, start_y, end_x, end_y, duration=0):
+        ok, _ = self._direct(self.wda.swipe, start_x, start_y, end_x, end_y, duration)
+        if ok:
+            return self
+        return self._driver.swipe(start_x, start_y, end_x, end_y, duration)
+
+    def find_elements(self, by='id', value=None):
+        using = WDA_LOCATORS.get(by)
+        if using:
+            ok, ids = self._direct(self.wda.find_elements, using, value)
+            if ok:
+                return [self._driver.create_web_element(element_id) for element_id in ids]
+        return self._driver.find_elements(by=by, value=value)
+
+    def find_element(self, by='id', value=None):
+        using = WDA_LOCATORS.get(by)
+        if using:
+            ok, ids = self._direct(self.wda.find_elements, using, value)
+            if ok:
+                if not ids:
+                    raise NoSuchElementException(f"No element found for {by}={value}")
+                return self._driver.create_web_element(ids[0])
+        return self._driver.find_element(by=by, value=value)
+
+    def alert_text(self):
+        """
+        Get the text of the alert on screen
+
+        Returns:
+            The alert text, or None when no alert is shown
+        """
+        ok, text = self._direct(self.wda.alert_text)
+        if ok:
+            return text
+        try:
+            return self._driver.switch_to.alert.text or ''
+        except NoAlertPresentException:
+            return None
+
+    def handle_alert(self, action):
+        """
+        Accept or dismiss the alert on screen
+
+        Args:
+            action: 'accept' or 'dismiss'
+        """
+        ok, _ = self._direct(self.wda.handle_alert, action)
+        if not ok:
+            alert = self._driver.switch_to.alert
+            if action == 'accept':
+                alert.accept()
+            else:
+                alert.dismiss()
+
+    def find_element_records(self, using, value, attributes):
+        """
+        Find elements with their attributes in one WebDriverAgent round trip
+
+        Returns:
+            List of attribute dictionaries, or None when the fast path is off or failed
+        """
+        ok, records = self._direct(self.wda.find_element_records, using, value, attributes)
+        return records if ok else None
+
+    def quit(self):
+        self.wda.close()
+        self._driver.quit()
+
+def enable_fast_path(driver, host=WDA_HOST, port=WDA_PORT):
+    """
+    Wrap an Appium driver so that hot commands go straight to WebDriverAgent
+
+    Args:
+        driver: Appium driver with an active session
+        host: WebDriverAgent host
+        port: WebDriverAgent port
+
+    Returns:
+        FastPathDriver, or the original driver if WebDriverAgent is unreachable
+    """
+    client = WdaClient(host, port)
+    try:
+        session_id = client.attach()
+    except WdaError as e:
+        logging.warning(f"WDA fast path unavailable, using Appium only: {e}")
+        client.close()
+        return driver
+    logging.info(f"WDA fast path enabled on {host}:{port} (session {session_id})")
+    return FastPathDriver(driver, client)
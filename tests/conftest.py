@@ -0,0 +1,17 @@
+import sys
+import time
+import pytest
+from ios_app_explorer import profiling
+
+@pytest.fixture
+def no_waits(monkeypatch):
+    """
+    Cut the explorer's settle and poll waits down to a millisecond
+    """
+    def short_sleep(seconds):
+        time.sleep(min(seconds, 0.001))
+
+    original = profiling.sleep
+    for name, module in list(sys.modules.items()):
+        if name.startswith('ios_app_explorer.') and getattr(module, 'sleep', None) is original:
+            monkeypatch.setattr(module, 'sleep', short_sleep)
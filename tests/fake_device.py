@@ -0,0 +1,185 @@
+"""
+In-memory stand-in for an Appium session on a synthetic app
+"""
+import time
+import zlib
+from xml.sax.saxutils import quoteattr
+from selenium.common.exceptions import NoAlertPresentException
+
+def make_app(tabs=2, depth=2, fanout=3):
+    """
+    Build a synthetic app: tab roots with a tree of screens under each
+
+    Args:
+        tabs: Number of tab-bar roots
+        depth: Levels of screens under each tab root
+        fanout: Buttons per screen that open a child screen
+
+    Returns:
+        AppModel
+    """
+    screens = {}
+
+    def build(screen_id, level, parent):
+        elements = []
+        if parent is not None:
+            elements.append(('XCUIElementTypeButton', 'Back', 'Back', 5, 40, 60, 30, '__back__'))
+        elements.append(('XCUIElementTypeStaticText', f'title {screen_id}', f'Title {screen_id}',
+                         20, 90, 300, 20, None))
+        if level < depth:
+            for i in range(fanout):
+                child = f'{screen_id}.{i}'
+                elements.append(('XCUIElementTypeButton', f'open {child}', f'Open {child}',
+                                 20, 130 + 50 * i, 200, 40, child))
+                build(child, level + 1, screen_id)
+        screens[screen_id] = {'elements': elements, 'parent': parent}
+
+    roots = [f't{i}' for i in range(tabs)]
+    for root in roots:
+        build(root, 0, None)
+    return AppModel(screens, roots)
+
+class AppModel:
+    """
+    Screens of a synthetic app, shared read-only by every FakeDriver on it
+    """
+
+    def __init__(self, screens, roots):
+        self.screens = screens
+        self.roots = roots
+
+    def reachable(self, start, depth):
+        """
+        Screens a crawl reaches from a screen within a number of clicks
+        """
+        seen = {start}
+        layer = [start]
+        for _ in range(depth):
+            following = []
+            for screen_id in layer:
+                targets = [e[7] for e in self.screens[screen_id]['elements'] if e[7] and e[7] != '__back__']
+                for target in targets + self.roots:
+                    if target not in seen:
+                        seen.add(target)
+                        following.append(target)
+            layer = following
+        return seen
+
+class _SwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    @property
+    def alert(self):
+        raise NoAlertPresentException('no alert open')
+
+class FakeDriver:
+    """
+    Appium driver stand-in that navigates an AppModel
+
+    Every command waits latency seconds, so drivers running in threads
+    interleave like real devices do.
+    """
+
+    def __init__(self, app, latency=0.001, size=(390, 844)):
+        self.app = app
+        self.latency = latency
+        self.size = size
+        self.current = app.roots[0]
+        self.commands = []
+        self.swipes = []
+
+    def _command(self, name):
+        self.commands.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _elements(self):
+        elements = list(self.app.screens[self.current]['elements'])
+        for i, root in enumerate(self.app.roots):
+            elements.append(('XCUIElementTypeButton', f'tab {root}', f'Tab {root}', i * 130, 780, 130, 50,
+                             '__tab__' + root))
+        return elements
+
+    def _activate(self, target):
+        if target == '__back__':
+            self.back()
+        elif target.startswith('__tab__'):
+            self.current = target[len('__tab__'):]
+        else:
+            self.current = target
+
+    def source_of(self, screen_id):
+        """
+        Page source of a screen, without going through the driver's state
+        """
+        current, self.current = self.current, screen_id
+        try:
+            return self._source()
+        finally:
+            self.current = current
+
+    def _source(self):
+        width, height = self.size
+        parts = [f'<?xml version="1.0" encoding="UTF-8"?><AppiumAUT>'
+                 f'<XCUIElementTypeApplication type="XCUIElementTypeApplication" name="Fake" label="Fake" '
+                 f'enabled="true" visible="true" x="0" y="0" width="{width}" height="{height}">']
+        for element_type, name, label, x, y, w, h, _ in self._elements():
+            parts.append(f'<{element_type} type="{element_type}" name={quoteattr(name)} label={quoteattr(label)} '
+                         f'enabled="true" visible="true" accessible="true" x="{x}" y="{y}" width="{w}" height="{h}"/>')
+        parts.append('</XCUIElementTypeApplication></AppiumAUT>')
+        return ''.join(parts)
+
+    @property
+    def page_source(self):
+        self._command('source')
+        return self._source()
+
+    def get_screenshot_as_png(self):
+        self._command('screenshot')
+        return b'\x89PNG\r\n\x1a\n' + zlib.compress(self.current.encode())
+
+    def get_window_size(self):
+        return {'width': self.size[0], 'height': self.size[1]}
+
+    def tap(self, positions, duration=None):
+        self._command('tap')
+        x, y = positions[0]
+        for element in reversed(self._elements()):
+            _, _, _, ex, ey, w, h, target = element
+            if target and ex <= x <= ex + w and ey <= y <= ey + h:
+                self._activate(target)
+                return
+
+    def swipe(self, start_x, start_y, end_x, end_y, duration=0):
+        self._command('swipe')
+        self.swipes.append((start_x, start_y, end_x, end_y))
+
+    def back(self):
+        self._command('back')
+        parent = self.app.screens[self.current]['parent']
+        if parent is not None:
+            self.current = parent
+
+    def terminate_app(self, bundle_id):
+        self._command('terminate')
+
+    def activate_app(self, bundle_id):
+        self._command('activate')
+        self.current = self.app.roots[0]
+
+    def execute_script(self, script, *args):
+        self._command(script)
+
+    def find_elements(self, by=None, value=None):
+        return []
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    @property
+    def switch_to(self):
+        return _SwitchTo(self)
+
+    def quit(self):
+        self._command('quit')
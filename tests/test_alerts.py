@@ -0,0 +1,50 @@
+from fake_device import make_app, FakeDriver
+from ios_app_explorer.alerts import AlertInterceptor, choose_alert_button
+from ios_app_explorer.snapshot import ElementRecord, ScreenState
+
+def alert(text, *labels):
+    """
+    Screen showing an in-app alert with buttons in document order
+    """
+    elements = [
+        ElementRecord(0, -1, 0, 'XCUIElementTypeApplication', 'App', 'App', '', 0, 0, 390, 844, True, True),
+        ElementRecord(1, 0, 1, 'XCUIElementTypeAlert', text, text, '', 40, 300, 310, 200, True, True),
+    ]
+    for i, label in enumerate(labels):
+        elements.append(ElementRecord(len(elements), 1, 2, 'XCUIElementTypeButton', label, label, '',
+                                      40 + 160 * i, 450, 150, 44, True, True))
+    return ScreenState(0, tuple(elements))
+
+def buttons(*labels):
+    return list(alert('', *labels).elements[2:])
+
+def test_accept_only_taps_allowed_buttons():
+    assert choose_alert_button(buttons("Don't Allow", 'Allow'), 'accept').label == 'Allow'
+    assert choose_alert_button(buttons('Cancel', 'OK'), 'accept').label == 'OK'
+    assert choose_alert_button(buttons('Cancel', 'Remove'), 'accept').label == 'Cancel'
+    assert choose_alert_button(buttons('Keep', 'Log Out'), 'accept').label == 'Keep'
+    assert choose_alert_button(buttons('No', 'Yes'), 'accept').label == 'No'
+    assert choose_alert_button(buttons('Delete Account', 'Archive', 'Keep'), 'accept') is None
+    assert choose_alert_button(buttons('Remove'), 'accept') is None
+    assert choose_alert_button([], 'accept') is None
+
+def test_dismiss():
+    assert choose_alert_button(buttons('Allow', 'Not Now'), 'dismiss').label == 'Not Now'
+    assert choose_alert_button(buttons('Keep', 'Remove'), 'dismiss').label == 'Keep'
+    assert choose_alert_button(buttons('Remove'), 'dismiss') is None
+    assert choose_alert_button(buttons('Delete Account', 'Archive', 'Keep'), 'dismiss') is None
+    assert choose_alert_button(buttons('Delete', 'Archive', 'Cancel'), 'dismiss').label == 'Cancel'
+
+def test_confirmations_are_not_accepted(no_waits):
+    driver = FakeDriver(make_app(), latency=0)
+    interceptor = AlertInterceptor(driver, {'name': 'fake'}, policy='accept', check_api=False)
+
+    interceptor.intercept(alert('Remove wallet?', 'Cancel', 'Remove'))
+    assert driver.commands[0] == 'tap'
+    assert interceptor.handled[-1]['button'] == 'Cancel'
+
+    driver.commands.clear()
+    for _ in range(2):
+        interceptor.intercept(alert('Log out?', 'Log Out'))
+    assert 'tap' not in driver.commands
+    assert [a['text'] for a in interceptor.handled if a['button'] is None] == ['Log out?']
@@ -0,0 +1,72 @@
+from ios_app_explorer.audit import audit_elements, audit_index
+from ios_app_explorer.snapshot import ElementRecord, ScreenState
+from ios_app_explorer.text_index import TextIndex
+
+def screen(*controls, parents=None):
+    """
+    Elements of a 390x844 window holding the controls, given as
+    (type, name, label, x, y, width, height) or with visible and enabled added
+    """
+    elements = [ElementRecord(0, -1, 0, 'XCUIElementTypeApplication', 'App', 'App', '', 0, 0, 390, 844, True, True)]
+    for i, control in enumerate(controls, start=1):
+        element_type, name, label, x, y, width, height, *flags = control
+        visible, enabled = flags or (True, True)
+        parent = (parents or {}).get(i, 0)
+        elements.append(ElementRecord(i, parent, elements[parent].depth + 1, 'XCUIElementType' + element_type,
+                                      name, label, '', x, y, width, height, visible, enabled))
+    return elements
+
+def rules(findings):
+    return sorted((f['rule'], f['name']) for f in findings)
+
+def test_clean_screen():
+    assert audit_elements(screen(('Button', 'Send', 'Send', 20, 100, 120, 44),
+                                 ('StaticText', '', '', 20, 200, 10, 10))) == []
+    assert audit_elements([]) == []
+
+def test_missing_label_and_small_target():
+    findings = audit_elements(screen(('Button', 'close', '', 340, 40, 30, 30),
+                                     ('Switch', 'wifi', 'Wi-Fi', 300, 100, 51, 44)))
+    assert rules(findings) == [('missing_label', 'close'), ('small_target', 'close')]
+    assert findings[1]['message'] == 'Tap target is 30x30 pt, below 44x44'
+    assert findings[1]['rect'] == [340, 40, 30, 30]
+
+def test_duplicate_identifiers_except_cells():
+    findings = audit_elements(screen(('Button', 'action', 'Send', 20, 100, 120, 44),
+                                     ('Button', 'action', 'Receive', 20, 200, 120, 44),
+                                     ('Cell', 'row', 'Bitcoin', 0, 300, 390, 60),
+                                     ('Cell', 'row', 'Ether', 0, 360, 390, 60)))
+    assert rules(findings) == [('duplicate_identifier', 'action')] * 2
+
+def test_unreachable_controls():
+    findings = audit_elements(screen(('Button', 'hidden', 'Hidden', 20, 100, 120, 44, False, True),
+                                     ('Button', 'below', 'Below', 20, 900, 120, 44),
+                                     ('Button', 'empty', 'Empty', 20, 100, 0, 0),
+                                     ('Button', 'disabled', 'Disabled', 20, 900, 120, 44, True, False)))
+    assert rules(findings) == [('unreachable', 'below'), ('unreachable', 'empty'), ('unreachable', 'hidden')]
+
+def test_controls_in_a_scroll_view_may_be_off_screen():
+    findings = audit_elements(screen(('ScrollView', '', '', 0, 0, 390, 844),
+                                     ('Button', 'below', 'Below', 20, 900, 120, 44),
+                                     parents={2: 1}))
+    assert findings == []
+
+def test_audit_index(tmp_path):
+    db_path = str(tmp_path / 'index.sqlite')
+    index = TextIndex(db_path)
+    unlabelled = ScreenState(1, tuple(screen(('Button', 'close', '', 300, 40, 60, 60))))
+    clean = ScreenState(2, tuple(screen(('Button', 'Send', 'Send', 20, 100, 120, 44))))
+    index.add_screen('wallet', 'wallet/a.png', unlabelled, level=0)
+    index.add_screen('wallet', 'wallet/b.png', clean, level=1)
+    index.add_screen('wallet', 'wallet/c.png', unlabelled, level=1)
+    index.add_screen('other', 'other/a.png', ScreenState(3, tuple(screen(('Button', 'x', '', 0, 0, 10, 10)))))
+    index.close()
+
+    reports = audit_index(db_path, apps=['wallet'], workers=2, chunk=1)
+    assert list(reports) == ['wallet']
+    report = reports['wallet']
+    assert report['screens'] == 3 and report['screens_with_findings'] == 2
+    assert report['totals']['missing_label'] == 2 and report['totals']['small_target'] == 0
+    assert report['results'][-1]['screenshot'] == 'wallet/b.png'
+
+    assert sorted(audit_index(db_path, workers=1)) == ['other', 'wallet']
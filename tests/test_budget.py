@@ -0,0 +1,50 @@
+import time
+from fake_device import make_app, FakeDriver
+from ios_app_explorer import budget
+from ios_app_explorer.flow_runner import run_app_flows
+from ios_app_explorer.navigation import navigate_and_capture_screenshots, replay_path
+from ios_app_explorer.output import close_backends
+from ios_app_explorer.restore import ScreenRestorer
+from ios_app_explorer.saturation import DiscoveryTracker
+from ios_app_explorer.templates import TemplateClusters
+
+APP_INFO = {'name': 'fake', 'bundleId': 'com.example.fake', 'flows': ['missing.yaml']}
+
+def test_expired():
+    assert not budget.expired(None)
+    assert not budget.expired(time.monotonic() + 60)
+    assert budget.expired(time.monotonic())
+
+def test_nothing_runs_past_the_deadline(no_waits, tmp_path):
+    driver = FakeDriver(make_app(), latency=0)
+    deadline = time.monotonic()
+    saturation = DiscoveryTracker(window=0)
+    try:
+        navigate_and_capture_screenshots(driver, APP_INFO, str(tmp_path), visited_screens=set(),
+                                         templates=TemplateClusters(cap=None), saturation=saturation,
+                                         deadline=deadline)
+    finally:
+        close_backends()
+    restorer = ScreenRestorer(driver, APP_INFO, deadline=deadline)
+
+    assert not restorer.restore(1, [])
+    assert not replay_path(driver, APP_INFO, [], deadline=deadline)
+    assert run_app_flows(driver, APP_INFO, str(tmp_path), deadline=deadline) == 0
+    assert driver.commands == []
+    # Running out of time is not saturation
+    assert saturation.stopped is None
+
+def test_exploration_stops_at_the_deadline(no_waits, monkeypatch, tmp_path):
+    monkeypatch.setattr('ios_app_explorer.navigation.MAX_DEPTH', 2)
+    driver = FakeDriver(make_app(tabs=1, depth=2, fanout=3), latency=0)
+    # The budget runs out as the first child screen is captured
+    monkeypatch.setattr('ios_app_explorer.navigation.expired',
+                        lambda deadline: driver.commands.count('screenshot') >= 2)
+    try:
+        navigate_and_capture_screenshots(driver, APP_INFO, str(tmp_path), visited_screens=set(),
+                                         templates=TemplateClusters(cap=None), saturation=DiscoveryTracker(window=0),
+                                         deadline=time.monotonic() + 3600)
+    finally:
+        close_backends()
+    # Neither the child nor the root screen goes on, not even back
+    assert driver.commands[-1] == 'screenshot'
@@ -0,0 +1,80 @@
+from fake_device import make_app, FakeDriver
+from ios_app_explorer.element_utils import QUERY_ATTRIBUTES, query_elements, buttons_from_snapshot
+from ios_app_explorer.snapshot import ElementRecord, ScreenState
+from ios_app_explorer.wda_client import WdaClient
+
+class StubWda(WdaClient):
+    """
+    WdaClient answering finds the way WebDriverAgent does with compact
+    responses off: a plain 'name' is the element type
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.session_id = 'session'
+        self.requests = []
+
+    def request(self, method, path, payload=None, full=False):
+        self.requests.append((method, path, payload))
+        if path.endswith('/elements'):
+            return [{'ELEMENT': 'e1', 'type': 'XCUIElementTypeButton', 'name': 'XCUIElementTypeButton',
+                     'attribute/name': 'send', 'label': 'Send', 'attribute/value': None,
+                     'rect': {'x': 10, 'y': 20, 'width': 100, 'height': 44}, 'enabled': True}]
+        return None
+
+class FastPath:
+    def __init__(self, wda):
+        self.wda = wda
+
+    def find_element_records(self, using, value, attributes):
+        return self.wda.find_element_records(using, value, attributes)
+
+def test_query_reads_name_and_value_attributes():
+    wda = StubWda()
+    records = query_elements(FastPath(wda), ['XCUIElementTypeButton'])
+
+    settings = wda.requests[0][2]['settings']
+    assert settings['elementResponseAttributes'] == ','.join(QUERY_ATTRIBUTES)
+    assert records == [{'id': 'e1', 'type': 'XCUIElementTypeButton', 'name': 'send', 'label': 'Send',
+                        'value': None, 'text': 'Send', 'rect': (10, 20, 100, 44), 'enabled': True}]
+
+def test_query_through_appium_fetches_one_page_source():
+    app = make_app(tabs=2, depth=1, fanout=2)
+    driver = FakeDriver(app, latency=0)
+    records = query_elements(driver, ['XCUIElementTypeButton'])
+
+    assert driver.commands == ['source']
+    assert [record['name'] for record in records] == ['open t0.0', 'open t0.1', 'tab t0', 'tab t1']
+    assert records[0]['rect'] == (20, 130, 200, 40)
+    assert records[0]['text'] == 'Open t0.0'
+
+def rows(container_type, row_type, count):
+    """
+    A container of same-shaped rows, each a control with an icon and a title
+    """
+    elements = [
+        ElementRecord(0, -1, 0, 'XCUIElementTypeApplication', 'App', 'App', '', 0, 0, 390, 844, True, True),
+        ElementRecord(1, 0, 1, container_type, '', '', '', 0, 100, 390, 600, True, True),
+    ]
+    for i in range(count):
+        row = len(elements)
+        elements.append(ElementRecord(row, 1, 2, row_type, f'row-{i}', f'Row {i}', '', 0, 100 + 50 * i, 390, 50,
+                                      True, True))
+        elements.append(ElementRecord(row + 1, row, 3, 'XCUIElementTypeImage', '', '', '', 10, 110 + 50 * i, 30,
+                                      30, True, True))
+        elements.append(ElementRecord(row + 2, row, 3, 'XCUIElementTypeStaticText', '', f'Row {i}', '', 50,
+                                      110 + 50 * i, 200, 30, True, True))
+    return ScreenState(0, tuple(elements))
+
+def row_groups(state):
+    return {button.name: button.group for button in buttons_from_snapshot(state).values() if button.name}
+
+def test_list_rows_are_grouped():
+    for container_type, row_type in (('XCUIElementTypeTable', 'XCUIElementTypeCell'),
+                                     ('XCUIElementTypeCollectionView', 'XCUIElementTypeOther')):
+        groups = row_groups(rows(container_type, row_type, 4))
+        assert len(set(groups.values())) == 1 and None not in groups.values()
+
+def test_controls_outside_lists_stay_distinct():
+    groups = row_groups(rows('XCUIElementTypeOther', 'XCUIElementTypeButton', 4))
+    assert set(groups.values()) == {None}
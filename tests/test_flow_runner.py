@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip('yaml')
+
+from fake_device import make_app, FakeDriver
+from ios_app_explorer import flow_runner
+from ios_app_explorer.flow_runner import run_flow
+
+APP_INFO = {'name': 'fake', 'bundleId': 'com.example.fake'}
+
+@pytest.fixture
+def run(no_waits, monkeypatch, tmp_path):
+    """
+    Run a flow written inline on a FakeDriver, without waiting for missing elements
+    """
+    monkeypatch.setattr(flow_runner, 'FLOW_LOOKUP_TIMEOUT', 0)
+
+    def run(driver, flow):
+        flow_path = tmp_path / 'flow.yaml'
+        flow_path.write_text('appId: ${MAESTRO_APP_ID}\n---\n' + flow)
+        return run_flow(driver, APP_INFO, str(flow_path), str(tmp_path))
+
+    return run
+
+def test_tap_on_text_id_and_point(run):
+    driver = FakeDriver(make_app(), latency=0)
+    assert run(driver, '- tapOn: "Open t0.1"\n')
+    assert driver.current == 't0.1'
+
+    assert run(driver, '- tapOn:\n    id: "Back"\n')
+    assert driver.current == 't0'
+
+    # The second of two tabs along the bottom of the window
+    assert run(driver, '- tapOn:\n    point: "50%,95%"\n')
+    assert driver.current == 't1'
+
+def test_tap_on_a_missing_element(run):
+    driver = FakeDriver(make_app(), latency=0)
+    assert not run(driver, '- tapOn: "Nope"\n- tapOn: "Open t0.1"\n')
+    assert driver.current == 't0'
+
+    assert run(driver, '- tapOn:\n    text: "Nope"\n    optional: true\n- tapOn: "Open t0.1"\n')
+    assert driver.current == 't0.1'
+
+def test_scroll(run):
+    driver = FakeDriver(make_app(), latency=0)
+    assert run(driver, '- scroll\n')
+    # The finger moves up the middle of the window
+    assert driver.swipes == [(195, 633, 195, 211)]
+
+def test_unsupported_commands_are_skipped(run):
+    driver = FakeDriver(make_app(), latency=0)
+    assert run(driver, '- pressKey: Enter\n- tapOn: "Open t0.2"\n')
+    assert driver.commands.count('tap') == 1
+    assert driver.current == 't0.2'
@@ -0,0 +1,158 @@
+import time
+import pytest
+from fake_device import make_app, FakeDriver
+from ios_app_explorer import frontier
+from ios_app_explorer.config import FRONTIER_CLAIM_TIMEOUT
+from ios_app_explorer.frontier import CrawlFrontier, run_workers
+from ios_app_explorer.output import close_backends
+from ios_app_explorer.saturation import DiscoveryTracker
+from ios_app_explorer.snapshot import take_snapshot
+from ios_app_explorer.templates import TemplateClusters
+
+APP_INFO = {'name': 'fake', 'bundleId': 'com.example.fake'}
+
+@pytest.fixture
+def crawl(no_waits, monkeypatch, tmp_path):
+    """
+    Run a shared crawl over a synthetic app, two levels deep, without the
+    template cap and saturation stop cutting it short
+    """
+    monkeypatch.setattr(frontier, 'MAX_DEPTH', 2)
+    monkeypatch.setattr(frontier, 'TemplateClusters', lambda: TemplateClusters(cap=None))
+    monkeypatch.setattr(frontier, 'DiscoveryTracker', lambda: DiscoveryTracker(window=0))
+    calls = {'publish': [], 'claim': []}
+
+    class RecordingFrontier(CrawlFrontier):
+        def publish(self, fingerprint, level, path, worker_id=None, explore=True):
+            number = super().publish(fingerprint, level, path, worker_id, explore)
+            if number is not None:
+                calls['publish'].append(fingerprint)
+            return number
+
+        def claim(self, worker_id):
+            item = super().claim(worker_id)
+            if item is not None:
+                calls['claim'].append((worker_id, item['fingerprint']))
+            return item
+
+    def run(app, workers=2, setup=None):
+        shared = RecordingFrontier(str(tmp_path / 'frontier.sqlite'))
+        if setup is not None:
+            setup(shared)
+        drivers = {f'w{i}': FakeDriver(app) for i in range(workers)}
+        try:
+            results = run_workers(drivers, APP_INFO, shared, str(tmp_path), max_per_level=20)
+        finally:
+            close_backends()
+        return shared, results, calls
+
+    return run
+
+def expected_fingerprints(app, depth):
+    driver = FakeDriver(app, latency=0)
+    fingerprints = {}
+    for screen_id in app.reachable(app.roots[0], depth):
+        driver.current = screen_id
+        fingerprints[take_snapshot(driver).fingerprint] = screen_id
+    return fingerprints
+
+def test_workers_share_the_frontier(crawl):
+    app = make_app(tabs=2, depth=2, fanout=3)
+    shared, results, calls = crawl(app, workers=2)
+
+    expected = expected_fingerprints(app, 2)
+    assert len(calls['publish']) == len(set(calls['publish']))
+    assert set(calls['publish']) == set(expected)
+    claimed = [fingerprint for _, fingerprint in calls['claim']]
+    assert len(claimed) == len(set(claimed))
+    assert all(count > 0 for count in results.values())
+    assert sum(results.values()) == len(claimed)
+    assert shared.stats() == {'done': len(expected)}
+
+def test_stale_claims_are_reclaimed(tmp_path):
+    shared = CrawlFrontier(str(tmp_path / 'frontier.sqlite'))
+    shared.publish(1, 0, [])
+    shared.publish(2, 1, [])
+    assert shared.claim('dead')['fingerprint'] == 1
+    assert shared.claim('alive')['fingerprint'] == 2
+    assert shared.claim('other') is None
+
+    stale(shared, 'dead')
+    item = shared.claim('other')
+    assert item['fingerprint'] == 1
+    assert shared.claim('another') is None
+
+def test_workers_finish_a_dead_workers_screen(crawl):
+    app = make_app(tabs=1, depth=1, fanout=2)
+    root = take_snapshot(FakeDriver(app, latency=0)).fingerprint
+
+    def dead_worker_claimed_root(shared):
+        shared.publish(root, 0, [], worker_id='dead')
+        assert shared.claim('dead')['fingerprint'] == root
+        shared._connect().execute('UPDATE screens SET claimed_at = ?', (time.time() - FRONTIER_CLAIM_TIMEOUT - 1,))
+
+    shared, results, calls = crawl(app, workers=2, setup=dead_worker_claimed_root)
+
+    assert (root in [fingerprint for worker, fingerprint in calls['claim'] if worker != 'dead'])
+    assert shared.stats() == {'done': len(expected_fingerprints(app, 2))}
+
+def stale(frontier, worker_id):
+    frontier._connect().execute(
+        'UPDATE screens SET claimed_at = ? WHERE claimed_by = ?', (time.time() - FRONTIER_CLAIM_TIMEOUT - 1, worker_id)
+    )
+
+def test_fresh_crawl_starts_from_an_empty_frontier(tmp_path):
+    db_path = str(tmp_path / 'frontier.sqlite')
+    previous = CrawlFrontier(db_path)
+    previous.publish(1, 0, [])
+    previous.publish(2, 1, [])
+    previous.claim('w0')
+    previous.close()
+
+    fresh = CrawlFrontier(db_path, fresh=True)
+    assert fresh.stats() == {}
+    assert fresh.publish(1, 0, []) == 1
+    fresh.close()
+
+def test_reopened_crawl_continues_and_frees_stale_claims(tmp_path):
+    db_path = str(tmp_path / 'frontier.sqlite')
+    previous = CrawlFrontier(db_path)
+    for fingerprint in (1, 2, 3):
+        previous.publish(fingerprint, fingerprint - 1, [])
+    previous.claim('w0')
+    previous.complete(1)
+    previous.claim('dead')
+    previous.claim('alive')
+    stale(previous, 'dead')
+    previous.close()
+
+    reopened = CrawlFrontier(db_path)
+    assert reopened.stats() == {'done': 1, 'pending': 1, 'claimed': 1}
+    assert reopened.claim('w1')['fingerprint'] == 2
+    assert reopened.claim('w1') is None
+    reopened.close()
+
+def test_frontiers_sharing_one_file(tmp_path):
+    db_path = str(tmp_path / 'frontier.sqlite')
+    first = CrawlFrontier(db_path)
+    first.publish(1, 0, [], worker_id='a')
+    first.publish(2, 1, [], worker_id='a')
+    assert first.claim('a')['fingerprint'] == 1
+
+    # A second process joins while the first one is exploring screen 1
+    second = CrawlFrontier(db_path)
+    assert second.stats() == {'claimed': 1, 'pending': 1}
+    assert second.publish(1, 0, [], worker_id='b') is None
+    # Numbering carries on after the first process's screens
+    assert second.publish(3, 1, [], worker_id='b') > 2
+    assert second.claim('b')['fingerprint'] == 2
+    assert first.claim('a')['fingerprint'] == 3
+    assert second.claim('b') is None
+
+    first.complete(1)
+    second.complete(2)
+    first.complete(3)
+    assert not second.has_work_in_progress()
+    assert first.stats() == second.stats() == {'done': 3}
+    first.close()
+    second.close()
@@ -0,0 +1,36 @@
+import threading
+from ios_app_explorer import profiling
+from ios_app_explorer.profiling import PhaseProfiler
+
+def test_threads_charge_their_own_phases():
+    clicking = threading.Barrier(2)
+    waiting = threading.Barrier(2)
+    done = threading.Barrier(2)
+
+    def click():
+        with profiling.phase('clicking'):
+            clicking.wait()
+            # The other thread is now inside 'waiting'
+            waiting.wait()
+            profiling.record_command('tap', 0.25)
+            done.wait()
+
+    def wait():
+        clicking.wait()
+        with profiling.phase('waiting'):
+            waiting.wait()
+            done.wait()
+        profiling.record_command('source', 0.5)
+
+    with PhaseProfiler() as profiler:
+        threads = [threading.Thread(target=click), threading.Thread(target=wait)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert profiler.device['clicking'] == 0.25
+    assert profiler.device['other'] == 0.5
+    assert profiler.device['waiting'] == 0.0
+    assert profiler.calls['clicking'] == profiler.calls['waiting'] == 1
+    assert profiler.wall['clicking'] > 0 and profiler.wall['waiting'] > 0
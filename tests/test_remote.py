@@ -0,0 +1,126 @@
+import threading
+import pytest
+
+pytest.importorskip('boto3')
+
+from botocore.exceptions import ClientError
+from ios_app_explorer.remote import MB, S3Uploader
+
+class StubS3:
+    """
+    In-memory S3 client; fail maps an operation to the error codes its next
+    calls fail with
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.fail = {}
+        self.gate = None
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls.append(operation)
+            codes = self.fail.get(operation)
+            code = codes.pop(0) if codes else None
+        if code is not None:
+            status = 503 if code == 'SlowDown' else 403
+            raise ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+    def put_object(self, Bucket, Key, Body, **extra):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self._call('PutObject')
+        self.objects[Key] = (Body, extra)
+
+    def create_multipart_upload(self, Bucket, Key, **extra):
+        self._call('CreateMultipartUpload')
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {'parts': {}, 'extra': extra}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._call('UploadPart')
+        self.uploads[UploadId]['parts'][PartNumber] = Body
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._call('CompleteMultipartUpload')
+        upload = self.uploads.pop(UploadId)
+        body = b''.join(upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        self.objects[Key] = (body, upload['extra'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._call('AbortMultipartUpload')
+        self.uploads.pop(UploadId, None)
+
+def uploader(client, **options):
+    return S3Uploader(bucket='shots', client=client, workers=2, **options)
+
+def spooled(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_put(tmp_path):
+    client = StubS3()
+    s3 = uploader(client)
+    data = b'png' * 100
+    assert s3.upload('run/a.png', data, spooled(tmp_path, 'a.png', data), {'level': 1}).result(5) == 'run/a.png'
+
+    body, extra = client.objects['run/a.png']
+    assert body == data
+    assert extra == {'ContentType': 'image/png', 'Metadata': {'screenshot': '{"level": 1}'}}
+    assert s3.stats['uploaded'] == 1 and s3.stats['bytes'] == len(data)
+
+def test_multipart(tmp_path):
+    client = StubS3()
+    s3 = uploader(client, multipart_threshold=6 * MB, part_size=5 * MB)
+    data = bytes(range(256)) * (12 * MB // 256)
+    s3.upload('run/big.png', data, spooled(tmp_path, 'big.png', data)).result(5)
+
+    assert client.objects['run/big.png'][0] == data
+    assert client.calls.count('UploadPart') == 3
+    assert s3.stats['multipart'] == 1
+
+def test_retries_throttling_but_not_access_errors(tmp_path):
+    client = StubS3()
+    s3 = uploader(client)
+    client.fail['PutObject'] = ['SlowDown', 'SlowDown']
+    s3.upload('run/a.png', b'a', spooled(tmp_path, 'a.png', b'a')).result(5)
+    assert client.calls.count('PutObject') == 3
+    assert s3.stats['retries'] == 2
+
+    client.fail['PutObject'] = ['AccessDenied']
+    future = s3.upload('run/b.png', b'b', spooled(tmp_path, 'b.png', b'b'))
+    with pytest.raises(ClientError):
+        future.result(5)
+    assert 'run/b.png' not in client.objects
+    assert s3.stats['retries'] == 2 and s3.stats['failed'] == 1
+
+def test_failed_part_aborts_the_multipart_upload(tmp_path):
+    client = StubS3()
+    s3 = uploader(client, multipart_threshold=6 * MB, part_size=5 * MB, max_attempts=2)
+    client.fail['UploadPart'] = ['SlowDown'] * 4
+    data = b'x' * (7 * MB)
+    with pytest.raises(ClientError):
+        s3.upload('run/big.png', data, spooled(tmp_path, 'big.png', data)).result(5)
+    assert 'AbortMultipartUpload' in client.calls
+    assert client.uploads == {}
+
+def test_uploads_over_the_memory_bound_are_spooled(tmp_path):
+    client = StubS3()
+    client.gate = threading.Event()
+    s3 = uploader(client, max_in_flight_bytes=150)
+    first = s3.upload('run/a.png', b'a' * 100, spooled(tmp_path, 'a.png', b'a' * 100))
+    # A spooled upload reads its bytes back from the spool file
+    second = s3.upload('run/b.png', b'b' * 100, spooled(tmp_path, 'b.png', b'B' * 100))
+    assert s3.stats['spooled'] == 1
+    assert 'run/b.png' not in client.objects
+
+    client.gate.set()
+    first.result(5)
+    second.result(5)
+    assert client.objects['run/b.png'][0] == b'B' * 100
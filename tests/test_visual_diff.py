@@ -0,0 +1,109 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+from ios_app_explorer.visual_diff import (
+    BYTES_PER_PIXEL, compare_images, comparison_workers, diff_runs, image_fingerprint, pair_screenshots, ssim_map
+)
+
+def screen(seed, size=(60, 120)):
+    """
+    Grayscale screen-like image: blocks of random shades that depend on the seed
+    """
+    width, height = size
+    blocks = np.random.default_rng(seed).integers(0, 256, (12, 6))
+    return np.kron(blocks, np.ones((height // 12, width // 6))).astype(np.uint8)
+
+def save(run_dir, relative, pixels):
+    path = os.path.join(run_dir, relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(pixels).save(path)
+    return path
+
+def with_badge(pixels):
+    changed = pixels.copy()
+    changed[2:6, 2:6] = 255
+    return changed
+
+@pytest.fixture
+def runs(tmp_path):
+    run_a, run_b = str(tmp_path / 'a'), str(tmp_path / 'b')
+    save(run_a, 'app/level_1/home.png', screen(1))
+    save(run_b, 'app/level_1/home.png', with_badge(screen(1)))
+    # Same bytes under a new name
+    save(run_a, 'app/level_1/wallet.png', screen(2))
+    save(run_b, 'app/level_1/wallet_2.png', screen(2))
+    # New name and a small change
+    save(run_a, 'app/level_2/settings.png', screen(3))
+    save(run_b, 'app/level_2/settings_1.png', with_badge(screen(3)))
+    save(run_a, 'app/level_2/removed.png', screen(4))
+    save(run_b, 'app/level_1/added.png', screen(5))
+    return run_a, run_b
+
+def test_pairs_by_path_then_content_then_fingerprint(runs):
+    run_a, run_b = runs
+    with ThreadPoolExecutor(2) as pool:
+        pairs, only_in_a, only_in_b = pair_screenshots(pool, run_a, run_b)
+
+    assert [(p['a'], p['b']) for p in pairs] == [
+        ('app/level_1/home.png', 'app/level_1/home.png'),
+        ('app/level_1/wallet.png', 'app/level_1/wallet_2.png'),
+        ('app/level_2/settings.png', 'app/level_2/settings_1.png'),
+    ]
+    assert pairs[1]['hash_a'] == pairs[1]['hash_b']
+    assert only_in_a == ['app/level_2/removed.png']
+    assert only_in_b == ['app/level_1/added.png']
+
+def test_fingerprint_tolerates_small_changes(tmp_path):
+    a = image_fingerprint(save(str(tmp_path), 'a/x.png', screen(1)))
+    badge = image_fingerprint(save(str(tmp_path), 'b/x.png', with_badge(screen(1))))
+    other = image_fingerprint(save(str(tmp_path), 'c/x.png', screen(6)))
+    assert bin(a ^ badge).count('1') <= 2
+    assert bin(a ^ other).count('1') > 10
+
+def test_ssim():
+    a = screen(1).astype(np.float64)
+    assert np.allclose(ssim_map(a, a), 1)
+    badge = with_badge(screen(1)).astype(np.float64)
+    similarity = ssim_map(a, badge)
+    assert similarity[:10, :10].mean() < 0.9 and np.allclose(similarity[20:, 20:], 1)
+    assert ssim_map(a, screen(6).astype(np.float64)).mean() < 0.5
+
+def test_compare_images(tmp_path):
+    path_a = save(str(tmp_path), 'a.png', screen(1))
+    heatmap = str(tmp_path / 'heatmaps' / 'a_diff.png')
+    same = compare_images(path_a, save(str(tmp_path), 'same.png', screen(1)), heatmap)
+    assert same['status'] == 'unchanged' and same['ssim'] == 1 and same['heatmap'] is None
+    assert not os.path.exists(heatmap)
+
+    changed = compare_images(path_a, save(str(tmp_path), 'badge.png', with_badge(screen(1))), heatmap)
+    assert changed['status'] == 'changed' and changed['changed_ratio'] > 0
+    assert os.path.exists(heatmap)
+
+    resized = compare_images(path_a, save(str(tmp_path), 'big.png', screen(1, size=(90, 180))))
+    assert resized['status'] == 'changed' and resized['size_changed']
+
+def test_workers_are_capped_by_the_largest_pair():
+    pair = 1000 * 2000 * BYTES_PER_PIXEL
+    assert comparison_workers([1000 * 2000, 10], 8, 3 * pair) == 3
+    assert comparison_workers([10, 10], 8, 3 * pair) == 8
+    assert comparison_workers([1000 * 2000], 8, pair // 2) == 1
+    assert comparison_workers([], 8, pair) == 8
+
+def test_report(runs, tmp_path):
+    run_a, run_b = runs
+    out_dir = str(tmp_path / 'diff')
+    summary = diff_runs(run_a, run_b, out_dir, workers=2)
+
+    assert summary['counts'] == {'identical': 1, 'unchanged': 0, 'changed': 2, 'error': 0, 'removed': 1, 'added': 1}
+    statuses = {p['a']: p['status'] for p in summary['pairs']}
+    assert statuses == {'app/level_1/home.png': 'changed', 'app/level_1/wallet.png': 'identical',
+                        'app/level_2/settings.png': 'changed'}
+    assert all(os.path.exists(p['heatmap']) for p in summary['pairs'] if p['status'] == 'changed')
+    assert not any('path_a' in p or 'hash_a' in p for p in summary['pairs'])
+    with open(os.path.join(out_dir, 'summary.json')) as f:
+        assert json.load(f) == summary
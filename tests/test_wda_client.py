@@ -0,0 +1,95 @@
+import json
+import time
+import asyncio
+from http.server import BaseHTTPRequestHandler
+import pytest
+from ios_app_explorer.async_driver import AsyncWdaClient
+from ios_app_explorer.wda_bench import start_server
+from ios_app_explorer.wda_client import WdaClient, WdaError
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    """
+    Records every request; taps take server.latency seconds to answer, and
+    with server.drop the connection is closed after each response without
+    telling the client
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self):
+        self.server.requests.append((self.command, self.path))
+        if self.path.endswith('/wda/tap'):
+            time.sleep(self.server.latency)
+        body = json.dumps({'value': None, 'sessionId': 'session'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.drop
+
+    def do_GET(self):
+        self._reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply()
+
+@pytest.fixture
+def server():
+    server = start_server(RecordingHandler, latency=0)
+    server.requests = []
+    server.drop = False
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def client_for(server, timeout=5):
+    return WdaClient('127.0.0.1', server.server_address[1], timeout=timeout)
+
+def test_timed_out_tap_is_not_sent_again(server):
+    server.latency = 0.5
+    client = client_for(server, timeout=0.1)
+    client.attach()
+    with pytest.raises(WdaError):
+        client.tap(10, 10)
+    time.sleep(0.6)
+    assert server.requests == [('GET', '/status'), ('POST', '/session/session/wda/tap')]
+    client.close()
+
+def test_connection_closed_by_the_server_is_replaced(server):
+    server.drop = True
+    client = client_for(server)
+    client.attach()
+    client.tap(10, 10)
+    client.tap(20, 20)
+    assert server.requests == [('GET', '/status')] + [('POST', '/session/session/wda/tap')] * 2
+    client.close()
+
+def run_async_client(server, timeout, *taps):
+    """
+    Attach an AsyncWdaClient to the server and tap each point in turn
+    """
+    async def run():
+        client = AsyncWdaClient('127.0.0.1', server.server_address[1], timeout=timeout)
+        try:
+            await client.attach()
+            for x, y in taps:
+                await client.tap(x, y)
+        finally:
+            await client.close()
+    asyncio.run(run())
+
+def test_async_timed_out_tap_is_not_sent_again(server):
+    server.latency = 0.5
+    with pytest.raises(WdaError):
+        run_async_client(server, 0.1, (10, 10))
+    time.sleep(0.6)
+    assert server.requests == [('GET', '/status'), ('POST', '/session/session/wda/tap')]
+
+def test_async_connection_closed_by_the_server_is_replaced(server):
+    server.drop = True
+    run_async_client(server, 5, (10, 10), (20, 20))
+    assert server.requests == [('GET', '/status')] + [('POST', '/session/session/wda/tap')] * 2